@@ -93,16 +93,10 @@ def example_2_different_speeds():
         print(f"\n🚗 Tốc độ: {speed} km/h")
         print("-" * 70)
         
-        # Tạo custom distance calculator với tốc độ khác
-        class CustomDistanceCalculator(DistanceCalculator):
-            @staticmethod
-            def calculate_travel_time(distance_km: float, speed_kmh: float = speed) -> int:
-                return int((distance_km / speed_kmh) * 60)
-        
-        # Tạm thời thay thế trong RouteOptimizer
+        # Tạm thời đổi tốc độ dùng khi build ma trận thời gian di chuyển
         # (Trong thực tế, nên refactor để inject dependency)
-        original_method = DistanceCalculator.calculate_travel_time
-        DistanceCalculator.calculate_travel_time = CustomDistanceCalculator.calculate_travel_time
+        original_speed = DistanceCalculator.SPEED_KMH
+        DistanceCalculator.SPEED_KMH = speed
         
         planner = TourPlanner('destinations_data.json')
         result = planner.plan_tour(user)
@@ -113,7 +107,7 @@ def example_2_different_speeds():
             print(f"  🚗 Thời gian di chuyển: {result['total_distance']} phút")
         
         # Restore
-        DistanceCalculator.calculate_travel_time = original_method
+        DistanceCalculator.SPEED_KMH = original_speed
 
 
 # ==============================================================================
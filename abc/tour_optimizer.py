@@ -13,6 +13,7 @@ import json
 import math
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple, Any
+import numpy as np
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
@@ -160,6 +161,8 @@ class ScoringEngine:
 class DistanceCalculator:
     """Lớp tính toán khoảng cách và thời gian di chuyển"""
     
+    SPEED_KMH = 40  # Tốc độ trung bình dùng khi build ma trận (km/h)
+    
     @staticmethod
     def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
@@ -212,21 +215,24 @@ class DistanceCalculator:
         Returns:
             Ma trận thời gian di chuyển (phút)
         """
-        n = len(locations)
-        matrix = [[0] * n for _ in range(n)]
-        
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    dist = cls.haversine_distance(
-                        locations[i]['latitude'],
-                        locations[i]['longitude'],
-                        locations[j]['latitude'],
-                        locations[j]['longitude']
-                    )
-                    matrix[i][j] = cls.calculate_travel_time(dist)
-        
-        return matrix
+        R = 6371  # Bán kính Trái Đất (km)
+        
+        # Tính tất cả các cặp một lần bằng NumPy broadcasting
+        lats = np.radians([loc['latitude'] for loc in locations])
+        lons = np.radians([loc['longitude'] for loc in locations])
+        delta_lat = lats[None, :] - lats[:, None]
+        delta_lon = lons[None, :] - lons[:, None]
+        
+        a = (np.sin(delta_lat / 2) ** 2 +
+             np.cos(lats)[:, None] * np.cos(lats)[None, :] *
+             np.sin(delta_lon / 2) ** 2)
+        distances = R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        
+        # Thời gian di chuyển (phút) - cùng cách làm tròn với calculate_travel_time
+        matrix = (distances / cls.SPEED_KMH * 60).astype(np.int64)
+        np.fill_diagonal(matrix, 0)
+        
+        return matrix.tolist()
 
 
 # ==============================================================================
@@ -5,14 +5,26 @@ Tour Recommendation Endpoints
 """
 Tour Recommendation Endpoints
 """
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import AsyncIterator, List, Optional
 
 from app.api.deps import get_db
+from app.services.solver_pool import SolverPoolOverloaded
+from app.services.tour_jobs import TourJobManager, TourJobQueueFull, TourJobStore
 from app.services.tour_recommendation_service import TourRecommendationService
 from app.schemas.tour import (
+    BatchTourRequest,
+    BatchTourResponse,
+    StartLocation,
+    TourJobRequest,
+    TourJobStatus,
+    TourRecommendRequest,
+    TourReplanRequest,
+    TourReplanResponse,
     TourRequest,
     TourRecommendation,
     ScoreAnalysis,
@@ -24,27 +36,52 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+
+async def _recommend(db: Session, **kwargs) -> dict:
+    """
+    Chạy pipeline gợi ý tour mà không chiếm threadpool của API trong lúc tối ưu
+    (tối ưu chạy trong SolverPool). Pool đầy => 503 + Retry-After.
+    """
+    try:
+        return await TourRecommendationService.get_tour_recommendations_async(db=db, **kwargs)
+    except SolverPoolOverloaded as e:
+        logger.warning(f"⏳ Solver pool quá tải: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail='Hệ thống đang bận, vui lòng thử lại sau',
+            headers={'Retry-After': str(e.retry_after)}
+        )
+
+
+def _start_location_dict(start_location: Optional[StartLocation]) -> Optional[dict]:
+    """Chuyển StartLocation sang dict điểm khởi hành (node 0) của service"""
+    if not start_location:
+        return None
+    return {
+        'id': 0,
+        'name': start_location.name,
+        'latitude': start_location.latitude,
+        'longitude': start_location.longitude,
+        'visit_time': 0,
+        'price': 0
+    }
+
+
 @router.post("/recommend", response_model=TourRecommendation)
-def get_tour_recommendation(
-    request: TourRequest,
+async def get_tour_recommendation(
+    request: TourRecommendRequest,
     db: Session = Depends(get_db)
 ):
     """
     Tạo gợi ý tour dựa trên user profile
+    
+    - **num_alternatives**: > 1 thì kèm `alternatives` (các tour khác nhau, tính cùng lúc)
     """
     logger.debug("📩 Nhận request tạo tour gợi ý")
 
     # Convert StartLocation to dict
-    start_loc_dict = None
-    if request.start_location:
-        start_loc_dict = {
-            'id': 0,
-            'name': request.start_location.name,
-            'latitude': request.start_location.latitude,
-            'longitude': request.start_location.longitude,
-            'visit_time': 0,
-            'price': 0
-        }
+    start_loc_dict = _start_location_dict(request.start_location)
+    if start_loc_dict:
         logger.debug(f"🏁 Start location: {start_loc_dict}")
     else:
         logger.debug("⚠️ Không có start_location trong request")
@@ -54,10 +91,13 @@ def get_tour_recommendation(
     logger.debug(f"👤 User profile: {user_dict}")
 
     # Gọi service
-    result = TourRecommendationService.get_tour_recommendations(
-        db=db,
+    result = await _recommend(
+        db,
         user_profile=user_dict,
-        start_location=start_loc_dict
+        start_location=start_loc_dict,
+        latency_budget_ms=request.latency_budget_ms,
+        start_time=request.start_time,
+        num_alternatives=request.num_alternatives
     )
     logger.debug(f"🧠 Kết quả gợi ý: {result}")
 
@@ -69,6 +109,189 @@ def get_tour_recommendation(
     return result
 
 
+def _sse_event(event: str, data: dict) -> str:
+    """Định dạng một Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.post("/recommend/stream")
+async def stream_tour_recommendation(
+    request: TourRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Tạo gợi ý tour dạng Server-Sent Events (text/event-stream)
+    
+    - **initial**: lộ trình greedy, gửi ngay sau khi chọn địa điểm
+    - **improved**: lộ trình tốt hơn mỗi khi OR-Tools tìm được (có thể không có)
+    - **final**: kết quả cuối cùng, stream kết thúc
+    - **error**: lỗi trong lúc tối ưu, stream kết thúc
+    
+    Request không tạo được tour (không có địa điểm phù hợp, ...) trả về 400 như `/recommend`.
+    """
+    logger.debug("📩 Nhận request tạo tour gợi ý (streaming)")
+    
+    events = TourRecommendationService.stream_tour_recommendations(
+        db,
+        user_profile=request.user_profile.model_dump(),
+        start_location=_start_location_dict(request.start_location),
+        latency_budget_ms=request.latency_budget_ms,
+        start_time=request.start_time
+    )
+    # Bước chuẩn bị (cần db) chạy xong trước khi trả response => lỗi request vẫn là 400
+    first_event, first_data = await events.__anext__()
+    if first_event == 'error':
+        await events.aclose()
+        logger.error(f"❌ Lỗi tạo tour: {first_data.get('message')}")
+        raise HTTPException(status_code=400, detail=first_data.get('message', 'Không thể tạo tour'))
+    
+    async def event_stream() -> AsyncIterator[str]:
+        yield _sse_event(first_event, first_data)
+        async for event, data in events:
+            yield _sse_event(event, data)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@router.post("/recommend/batch", response_model=BatchTourResponse)
+async def get_batch_tour_recommendations(
+    request: BatchTourRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Tạo gợi ý tour cho nhiều user profile trong một lần gọi
+    
+    - Dùng chung catalog snapshot, ma trận khoảng cách và một lần tính điểm cho cả batch
+    - Các lộ trình được tối ưu song song trong solver pool
+    - **results**: theo đúng thứ tự items, mỗi item có `success` và `result` hoặc `error`
+    """
+    logger.debug(f"📩 Nhận batch {len(request.items)} request tạo tour")
+    
+    items = [
+        {
+            'user_profile': item.user_profile.model_dump(),
+            'start_location': _start_location_dict(item.start_location),
+            'latency_budget_ms': item.latency_budget_ms,
+            'start_time': item.start_time
+        }
+        for item in request.items
+    ]
+    
+    result = await TourRecommendationService.get_batch_tour_recommendations_async(db=db, items=items)
+    
+    if not result['success']:
+        raise HTTPException(status_code=400, detail=result.get('message', 'Không thể xử lý batch'))
+    
+    logger.info(f"✅ Batch: {result['succeeded']}/{result['total']} tour thành công")
+    return result
+
+
+@router.post("/replan", response_model=TourReplanResponse)
+async def replan_tour(
+    request: TourReplanRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Sửa lộ trình đang đi dở thay vì tạo lại tour từ đầu
+    
+    - **current_location** / **elapsed_minutes**: vị trí và số phút đã đi
+    - **visited_ids**: đã thăm, **remaining_ids**: phần còn lại (bỏ id = bỏ qua), **added_ids**: thêm mới
+    
+    Sửa nhanh trên ma trận có sẵn (cheapest insertion / removal + local search), chỉ giải lại
+    toàn bộ khi lộ trình sửa mất quá nhiều địa điểm. `replan.strategy` cho biết cách đã dùng.
+    """
+    result = await TourRecommendationService.replan_tour_async(
+        db=db,
+        user_profile=request.user_profile.model_dump(),
+        current_location={
+            'latitude': request.current_location.latitude,
+            'longitude': request.current_location.longitude
+        },
+        elapsed_minutes=request.elapsed_minutes,
+        visited_ids=request.visited_ids,
+        remaining_ids=request.remaining_ids,
+        added_ids=request.added_ids,
+        start_time=request.start_time,
+        latency_budget_ms=request.latency_budget_ms
+    )
+    
+    if not result['success']:
+        raise HTTPException(status_code=400, detail=result.get('message', 'Không thể sửa lộ trình'))
+    
+    return result
+
+
+@router.post("/jobs", response_model=TourJobStatus, status_code=202)
+def submit_tour_job(request: TourJobRequest):
+    """
+    Tạo job gợi ý tour chạy nền (cho request cần giải lâu), trả về job_id ngay
+    
+    Theo dõi bằng `GET /jobs/{job_id}`, lấy kết quả bằng `GET /jobs/{job_id}/result`,
+    hủy bằng `DELETE /jobs/{job_id}`. Kết quả được giữ trong TOUR_JOB_TTL_SECONDS.
+    """
+    try:
+        job = TourJobManager.submit({
+            'user_profile': request.user_profile.model_dump(),
+            'start_location': _start_location_dict(request.start_location),
+            'latency_budget_ms': request.latency_budget_ms,
+            'start_time': request.start_time
+        })
+    except TourJobQueueFull as e:
+        logger.warning(f"⏳ Hàng đợi job quá tải: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail='Hệ thống đang bận, vui lòng thử lại sau',
+            headers={'Retry-After': str(e.retry_after)}
+        )
+    return job
+
+
+def _get_job(job_id: str) -> dict:
+    job = TourJobStore.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Không tìm thấy job (không tồn tại hoặc đã hết hạn)')
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=TourJobStatus)
+def get_tour_job(job_id: str):
+    """
+    Trạng thái job: queued | running | succeeded | failed | cancelled
+    """
+    return _get_job(job_id)
+
+
+@router.get("/jobs/{job_id}/result", response_model=TourRecommendation)
+def get_tour_job_result(job_id: str):
+    """
+    Kết quả của job đã xong
+    
+    - **409**: job chưa xong hoặc đã bị hủy
+    - **400**: job thất bại (không tạo được tour)
+    """
+    job = _get_job(job_id)
+    if job['status'] == TourJobStore.SUCCEEDED:
+        return job['result']
+    if job['status'] == TourJobStore.FAILED:
+        raise HTTPException(status_code=400, detail=job['error'] or 'Không thể tạo tour')
+    raise HTTPException(status_code=409, detail=f"Job đang ở trạng thái {job['status']}")
+
+
+@router.delete("/jobs/{job_id}", response_model=TourJobStatus)
+def cancel_tour_job(job_id: str):
+    """
+    Hủy job đang chờ / đang chạy (dừng luôn process đang giải); job đã xong thì xóa kết quả
+    """
+    job = TourJobManager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Không tìm thấy job (không tồn tại hoặc đã hết hạn)')
+    return job
+
+
 @router.post("/analyze-scores", response_model=ScoreAnalysis)
 def analyze_destination_scores(
     user_profile: UserProfile,
@@ -96,10 +319,12 @@ def analyze_destination_scores(
 
 
 @router.post("/quick-recommend")
-def quick_recommend(
+async def quick_recommend(
     user_type: str,
     budget: int,
     time_available: int,
+    latency_budget_ms: Optional[int] = Query(default=None, ge=100, le=60000),
+    start_time: Optional[str] = Query(default=None, pattern=r"^\d{1,2}:\d{2}$"),
     db: Session = Depends(get_db)
 ):
     """
@@ -108,6 +333,8 @@ def quick_recommend(
     - **user_type**: Loại user (Adventure, Cultural, Family, Relaxation, Budget)
     - **budget**: Ngân sách (VNĐ)
     - **time_available**: Thời gian có sẵn (giờ)
+    - **latency_budget_ms**: Thời gian phản hồi tối đa (ms, optional)
+    - **start_time**: Giờ bắt đầu tour HH:MM (optional)
     """
     # Default preferences by type
     preference_map = {
@@ -126,13 +353,28 @@ def quick_recommend(
         'max_locations': 5
     }
     
-    result = TourRecommendationService.get_tour_recommendations(
-        db=db,
+    result = await _recommend(
+        db,
         user_profile=user_profile,
-        start_location=None
+        start_location=None,
+        latency_budget_ms=latency_budget_ms,
+        start_time=start_time
     )
     
     if not result['success']:
         raise HTTPException(status_code=400, detail=result.get('message', 'Không thể tạo tour'))
     
     return result
+
+
+@router.get("/cache/stats")
+def get_tour_cache_stats():
+    """
+    Thống kê cache kết quả tour của worker hiện tại
+    
+    - **hits / misses / hit_rate**: Số lần request giống hệt được trả từ cache
+    - **evictions / expirations**: Số kết quả bị bỏ do đầy (LRU) / hết hạn (TTL)
+    - **catalog_version**: Cache bị xóa khi catalog đổi version
+    - **single_flight.coalesced**: Số request dùng chung kết quả của request giống hệt đang chạy
+    """
+    return TourRecommendationService.get_cache_stats()
@@ -27,6 +27,40 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     
+    # Tour recommendation
+    CATALOG_REFRESH_SECONDS: int = 60  # Chu kỳ kiểm tra catalog thay đổi từ worker khác (0 = tắt)
+    CF_MODEL_REFRESH_SECONDS: int = 3600  # Dựng lại model CF sau khoảng thời gian này (0 = chỉ theo số thay đổi)
+    CF_MODEL_REFRESH_MIN_CHANGES: int = 100  # Số rating/visit/favorite thay đổi để dựng lại model CF sớm
+    CF_MODEL_CHECK_SECONDS: int = 60  # Chu kỳ thread nền kiểm tra model CF (0 = tắt, dựng khi request đầu tiên cần)
+    TRAVEL_MATRIX_PATH: Optional[str] = "data/travel_matrix"  # Ma trận precompute (build_travel_matrix.py)
+    TOUR_LATENCY_BUDGET_MS: int = 3000  # Tổng thời gian mặc định cho một request gợi ý tour
+    TOUR_SOLVER_TIME_LIMIT_MS: int = 30000  # Time limit OR-Tools khi gọi trực tiếp không có deadline
+    TOUR_FALLBACK_RESERVE_MS: int = 100  # Thời gian chừa lại cho heuristic fallback
+    TOUR_MIN_SOLVER_TIME_MS: int = 50  # Còn ít hơn mức này thì bỏ qua OR-Tools, dùng heuristic luôn
+    TOUR_START_TIME: str = "08:00"  # Giờ bắt đầu tour mặc định (HH:MM) để áp giờ mở cửa
+    TOUR_EXACT_SOLVER_MAX_NODES: int = 10  # Số địa điểm tối đa giải chính xác bằng Held-Karp (0 = tắt)
+    TOUR_ORIENTEERING: bool = False  # Solver tự chọn địa điểm trong top-K ứng viên thay vì thăm đủ top N
+    TOUR_ORIENTEERING_CANDIDATES: int = 30  # Số ứng viên (K) đưa vào solver ở chế độ orienteering
+    TOUR_SOLVER_WARM_START: bool = True  # OR-Tools bắt đầu từ lộ trình heuristic thay vì AUTOMATIC
+    TOUR_SOLVER_PORTFOLIO: bool = False  # Chạy song song nhiều chiến lược tối ưu, lấy lộ trình tốt nhất
+    TOUR_SOLVER_WORKERS: int = 0  # Số process của solver pool (0 = số CPU)
+    TOUR_SOLVER_MAX_QUEUE: int = 8  # Số task được chờ thêm khi mọi process đều bận (vượt quá => 503)
+    TOUR_CACHE_SIZE: int = 1024  # Số kết quả tour tối đa được cache trong mỗi worker (0 = tắt)
+    TOUR_CACHE_TTL_SECONDS: int = 300  # Thời gian sống của một kết quả trong cache
+    TOUR_SINGLE_FLIGHT: bool = True  # Request giống hệt đang chạy đồng thời dùng chung một lần tính
+    TOUR_BATCH_MAX_ITEMS: int = 500  # Số profile tối đa trong một request /tours/recommend/batch
+    TOUR_BATCH_LATENCY_BUDGET_MS: int = 10000  # Tổng thời gian của một request batch (item chưa kịp tối ưu => greedy)
+    TOUR_ALTERNATIVE_PENALTY: float = 0.5  # Giảm điểm địa điểm đã dùng ở phương án trước (0 = không phạt)
+    TOUR_REPLAN_LATENCY_BUDGET_MS: int = 1000  # Thời gian tối đa mặc định của một request re-plan
+    TOUR_REPLAN_MIN_KEEP_RATIO: float = 0.5  # Lộ trình sửa giữ ít hơn tỷ lệ này số địa điểm yêu cầu => giải lại toàn bộ
+    TOUR_JOB_WORKERS: int = 2  # Số job gợi ý tour chạy nền đồng thời (mỗi job một process riêng)
+    TOUR_JOB_MAX_PENDING: int = 100  # Số job đang chờ + đang chạy tối đa (vượt quá => 503)
+    TOUR_JOB_LATENCY_BUDGET_MS: int = 30000  # Thời gian giải mặc định của một job
+    TOUR_JOB_TTL_SECONDS: int = 3600  # Thời gian giữ trạng thái / kết quả sau khi job kết thúc
+    TOUR_JOB_DB_PATH: Optional[str] = None  # File SQLite lưu job (dùng chung giữa các worker), None = bộ nhớ
+    TOUR_JOB_HEARTBEAT_SECONDS: int = 10  # Chu kỳ worker cập nhật heartbeat của job nó đang giữ
+    TOUR_JOB_STALE_SECONDS: int = 60  # Job chờ / chạy không có heartbeat quá lâu (worker chết) => failed
+    
     # CORS
     BACKEND_CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://localhost:8000"]
     
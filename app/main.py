@@ -3,6 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
 from app.api.v1.router import api_router
 from app.db.database import engine, Base
+from app.services.solver_pool import SolverPool
+from app.services.collaborative_filtering_service import CFModelStore
+from app.services.tour_jobs import TourJobManager
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -29,6 +32,27 @@ app.add_middleware(
 app.include_router(api_router, prefix="/api/v1")
 
 
+@app.on_event("startup")
+def start_solver_pool():
+    """Khởi động sẵn solver pool (tối ưu lộ trình chạy trong các process này)"""
+    SolverPool.warm_up()
+
+
+@app.on_event("startup")
+def start_cf_model_refresh():
+    """Dựng model CF chạy nền và làm mới định kỳ (request chỉ tra cứu model hiện tại)"""
+    CFModelStore.start_background_refresh()
+
+
+@app.on_event("shutdown")
+def stop_solver_pool():
+    """Dừng các process của solver pool (và Manager process của streaming), job chạy nền, thread làm mới model CF"""
+    SolverPool.shutdown(wait=False)
+    SolverPool.shutdown_manager()
+    TourJobManager.shutdown()
+    CFModelStore.stop_background_refresh()
+
+
 @app.get("/")
 def read_root():
     """Root endpoint"""
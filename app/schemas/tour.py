@@ -2,6 +2,7 @@
 Schemas cho Tour Recommendation
 """
 
+from datetime import datetime
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from enum import Enum
@@ -24,9 +25,10 @@ class UserProfile(BaseModel):
         ...,
         description="Danh sách sở thích: ['nature', 'hiking', 'culture', 'history', ...]"
     )
-    budget: int = Field(..., description="Ngân sách (VNĐ)")
-    time_available: int = Field(..., description="Thời gian có sẵn (giờ)")
-    max_locations: int = Field(default=5, description="Số địa điểm tối đa muốn tham quan")
+    budget: int = Field(..., description="Ngân sách (VNĐ) cho cả chuyến")
+    time_available: int = Field(..., description="Thời gian có sẵn (giờ) mỗi ngày")
+    max_locations: int = Field(default=5, description="Số địa điểm tối đa muốn tham quan mỗi ngày")
+    num_days: int = Field(default=1, ge=1, le=14, description="Số ngày của tour (> 1: lộ trình cho từng ngày)")
     
     class Config:
         json_schema_extra = {
@@ -61,6 +63,27 @@ class TourRequest(BaseModel):
     """Request để tạo tour recommendation"""
     user_profile: UserProfile
     start_location: Optional[StartLocation] = None
+    latency_budget_ms: Optional[int] = Field(
+        default=None,
+        ge=100,
+        le=60000,
+        description="Thời gian phản hồi tối đa (ms). Mặc định theo cấu hình server"
+    )
+    start_time: Optional[str] = Field(
+        default=None,
+        pattern=r"^\d{1,2}:\d{2}$",
+        description="Giờ bắt đầu tour (HH:MM) để áp giờ mở cửa. Mặc định theo cấu hình server"
+    )
+
+
+class TourRecommendRequest(TourRequest):
+    """Request /recommend: có thể yêu cầu thêm các phương án thay thế"""
+    num_alternatives: int = Field(
+        default=1,
+        ge=1,
+        le=5,
+        description="Số phương án tour khác nhau (> 1: thêm 'alternatives' vào kết quả)"
+    )
 
 
 class RouteLocation(BaseModel):
@@ -74,10 +97,23 @@ class RouteLocation(BaseModel):
     price: int
     visit_time: int
     travel_time: int
+    arrival_time: Optional[str] = None  # Giờ bắt đầu tham quan (HH:MM)
+    wait_time: int = 0  # Thời gian chờ tới giờ mở cửa (phút)
     score: float
     opening_hours: Optional[str] = None
     facilities: List[str] = []
     images: List[str] = []  # Danh sách URLs hình ảnh của địa điểm
+    day: Optional[int] = None  # Ngày thứ mấy (chỉ có ở tour nhiều ngày)
+
+
+class TourDaySummary(BaseModel):
+    """Tổng kết một ngày của tour nhiều ngày"""
+    day: int
+    total_locations: int = 0
+    total_time: int = 0
+    total_distance: float = 0.0
+    total_score: float = 0.0
+    total_cost: int = 0
 
 
 class TourRecommendation(BaseModel):
@@ -90,9 +126,12 @@ class TourRecommendation(BaseModel):
     total_score: float = 0.0
     total_cost: int = 0
     avg_score: float = 0.0
+    days: Optional[List[TourDaySummary]] = None  # Tour nhiều ngày: route gồm mọi ngày, tổng kết từng ngày
+    alternatives: Optional[List['TourRecommendation']] = None  # Các phương án thay thế (num_alternatives > 1)
     message: Optional[str] = None
-    optimizer_used: Optional[str] = None  # 'ortools' or 'heuristic'
+    optimizer_used: Optional[str] = None  # 'ortools', 'heuristic' hoặc tên chiến lược portfolio (vd: 'ortools_gls')
     note: Optional[str] = None  # Note cho user về optimizer được dùng
+    degraded: Optional[str] = None  # 'latency_budget' | 'overload': lộ trình fallback, không được cache
     
     class Config:
         json_schema_extra = {
@@ -109,6 +148,8 @@ class TourRecommendation(BaseModel):
                         "price": 200000,
                         "visit_time": 90,
                         "travel_time": 5,
+                        "arrival_time": "09:30",
+                        "wait_time": 25,
                         "score": 0.85,
                         "opening_hours": "09:30-21:30",
                         "facilities": ["parking", "restroom", "restaurant"]
@@ -124,6 +165,90 @@ class TourRecommendation(BaseModel):
         }
 
 
+class BatchTourRequest(BaseModel):
+    """Request tạo tour cho nhiều user profile trong một lần gọi"""
+    items: List[TourRequest] = Field(
+        ...,
+        min_length=1,
+        description="Danh sách request (tối đa theo cấu hình server TOUR_BATCH_MAX_ITEMS)"
+    )
+
+
+class BatchTourItemResult(BaseModel):
+    """Kết quả của một item trong batch (cùng thứ tự với request)"""
+    index: int
+    success: bool
+    result: Optional[TourRecommendation] = None
+    error: Optional[str] = None
+
+
+class BatchTourResponse(BaseModel):
+    """Kết quả batch tour recommendation"""
+    success: bool
+    total: int
+    succeeded: int
+    failed: int
+    results: List[BatchTourItemResult]
+    elapsed_ms: int
+
+
+class TourJobRequest(TourRequest):
+    """Request tạo job gợi ý tour chạy nền (cho phép thời gian giải dài hơn)"""
+    latency_budget_ms: Optional[int] = Field(
+        default=None,
+        ge=100,
+        le=600000,
+        description="Thời gian giải tối đa (ms). Mặc định theo cấu hình server"
+    )
+
+
+class TourJobStatus(BaseModel):
+    """Trạng thái một job gợi ý tour"""
+    job_id: str
+    status: str  # 'queued' | 'running' | 'succeeded' | 'failed' | 'cancelled'
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None  # Sau thời điểm này trạng thái / kết quả bị xóa
+    error: Optional[str] = None
+
+
+class TourReplanRequest(BaseModel):
+    """Request sửa lộ trình đang đi dở (bỏ qua địa điểm, bị trễ, thêm địa điểm)"""
+    user_profile: UserProfile
+    current_location: StartLocation = Field(..., description="Vị trí hiện tại")
+    elapsed_minutes: int = Field(..., ge=0, description="Số phút đã đi tính từ giờ bắt đầu tour")
+    visited_ids: List[int] = Field(default=[], description="Địa điểm đã thăm")
+    remaining_ids: List[int] = Field(..., description="Phần còn lại của lộ trình theo thứ tự (bỏ id = bỏ qua)")
+    added_ids: List[int] = Field(default=[], description="Địa điểm muốn thêm vào lộ trình")
+    start_time: Optional[str] = Field(
+        default=None,
+        pattern=r"^\d{1,2}:\d{2}$",
+        description="Giờ bắt đầu tour (HH:MM). Mặc định theo cấu hình server"
+    )
+    latency_budget_ms: Optional[int] = Field(
+        default=None,
+        ge=100,
+        le=60000,
+        description="Thời gian phản hồi tối đa (ms). Mặc định theo cấu hình server"
+    )
+
+
+class TourReplanInfo(BaseModel):
+    """Thông tin lần sửa lộ trình"""
+    strategy: str  # 'repair' | 'full_solve'
+    current_time: str  # Giờ hiện tại (HH:MM)
+    time_left: int  # Số phút còn lại của tour
+    budget_left: float  # Ngân sách còn lại (VNĐ)
+    dropped_ids: List[int] = []  # Địa điểm yêu cầu nhưng không còn trong lộ trình
+    elapsed_ms: int
+
+
+class TourReplanResponse(TourRecommendation):
+    """Phần còn lại của tour sau khi sửa"""
+    replan: Optional[TourReplanInfo] = None
+
+
 class DestinationScore(BaseModel):
     """Điểm của một địa điểm"""
     id: int
@@ -6,16 +6,21 @@ Implements hybrid recommendation using:
 - User-User Collaborative Filtering (k-Nearest Neighbors)
 - Item-Item Collaborative Filtering
 - Cold start handling with quiz-based seeding
+- CFModelStore: one shared, versioned model per worker, refreshed in the background
 """
 
-from typing import List, Dict, Tuple, Optional
+from datetime import datetime
+from typing import Any, Callable, List, Dict, Tuple, Optional
+import threading
+import time
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import csr_matrix
+from sklearn.preprocessing import normalize
+from scipy.sparse import coo_matrix, csr_matrix
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 import logging
 
+from app.core.config import settings
 from app.models.destination_rating import DestinationRating
 from app.models.visit_log import VisitLog
 from app.models.user_favorite import UserFavorite
@@ -25,25 +30,87 @@ from app.models.user import User
 logger = logging.getLogger(__name__)
 
 
+class CFModel:
+    """
+    Read-only snapshot of everything request-time CF needs
+    
+    Shared by all requests of a worker: never mutate, CFModelStore swaps in a new one.
+    """
+    
+    def __init__(
+        self,
+        matrix: csr_matrix,
+        user_ids: List[int],
+        dest_ids: List[int],
+        user_neighbors: Optional[csr_matrix],
+        item_neighbors: Optional[csr_matrix],
+        activity_counts: Dict[int, Tuple[int, int, int]],
+        dest_avg_ratings: Dict[int, float],
+        version: int,
+        signature: Dict[str, Tuple[int, int]],
+        built_at: datetime
+    ):
+        """
+        Args:
+            matrix, user_ids, dest_ids: Output of build_interaction_matrix()
+            user_neighbors, item_neighbors: Output of build_neighbors() (None = no data)
+            activity_counts: user_id -> (ratings, completed visits, favorites)
+            dest_avg_ratings: destination_id -> avg_rating (baseline when CF can't predict)
+            version: Increases with every rebuild in this worker
+            signature: Table -> (row count, max primary key) when the build started
+            built_at: UTC time when the build started (rating updates after it count as changes)
+        """
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.dest_ids = dest_ids
+        self.user_index = {uid: idx for idx, uid in enumerate(user_ids)}
+        self.dest_index = {did: idx for idx, did in enumerate(dest_ids)}
+        self.user_neighbors = user_neighbors
+        self.item_neighbors = item_neighbors
+        self.activity_counts = activity_counts
+        self.dest_avg_ratings = dest_avg_ratings
+        self.version = version
+        self.signature = signature
+        self.built_at = built_at
+        self.loaded_at = time.monotonic()
+
+
 class CollaborativeFilteringService:
     """
     Collaborative Filtering for tour recommendations
     Supports: User-User CF, Item-Item CF, and Hybrid
+    
+    With a CFModel (CFModelStore.get_model) predictions are lookups only:
+    no interaction queries, no similarity computation.
     """
     
-    def __init__(self, db: Session):
+    NEIGHBORS_K = 20  # Neighbours kept per user / destination (max k of the predictors)
+    
+    def __init__(self, db: Session, model: Optional[CFModel] = None):
         self.db = db
+        self.model = model
         self.user_item_matrix = None
-        self.user_similarity = None
-        self.item_similarity = None
+        self.user_neighbors = None  # Row u: top-k similar users (indices) with similarities (data)
+        self.item_neighbors = None  # Row i: top-k similar destinations
         self.user_ids = []
         self.dest_ids = []
+        self.user_index = {}
+        self.dest_index = {}
+        
+        if model is not None:
+            self.user_item_matrix = model.matrix
+            self.user_neighbors = model.user_neighbors
+            self.item_neighbors = model.item_neighbors
+            self.user_ids = model.user_ids
+            self.dest_ids = model.dest_ids
+            self.user_index = model.user_index
+            self.dest_index = model.dest_index
         
     # ==========================================
     # PART 1: DATA PREPARATION
     # ==========================================
     
-    def build_interaction_matrix(self) -> Tuple[np.ndarray, List[int], List[int]]:
+    def build_interaction_matrix(self) -> Tuple[csr_matrix, List[int], List[int]]:
         """
         Build User-Item interaction matrix from ratings, visits, and favorites
         
@@ -52,8 +119,11 @@ class CollaborativeFilteringService:
         - Implicit: visits (pseudo-rating based on frequency)
         - Implicit: favorites (pseudo-rating = 4.5)
         
+        The matrix is built directly in sparse form from index arrays (memory grows with
+        the number of interactions, not users × destinations).
+        
         Returns:
-            matrix: (n_users, n_items) numpy array
+            matrix: (n_users, n_items) float32 CSR matrix (0 = no interaction)
             user_ids: List of user IDs (row index mapping)
             dest_ids: List of destination IDs (column index mapping)
         """
@@ -84,89 +154,157 @@ class CollaborativeFilteringService:
             UserFavorite.destination_id
         ).all()
         
-        # Combine signals into interaction dictionary
-        interaction_dict = {}
+        # Combine signals as (user, destination, value, priority) arrays
+        users, dests, values, priorities = [], [], [], []
+        
+        def add_signal(rows, value_fn, priority):
+            if not rows:
+                return
+            columns = list(zip(*rows))
+            users.append(np.asarray(columns[0], dtype=np.int64))
+            dests.append(np.asarray(columns[1], dtype=np.int64))
+            values.append(value_fn(columns).astype(np.float32))
+            priorities.append(np.full(len(rows), priority, dtype=np.int8))
         
         # 1. Explicit ratings (highest priority)
-        for user_id, dest_id, rating in ratings:
-            key = (user_id, dest_id)
-            interaction_dict[key] = float(rating)
+        add_signal(ratings, lambda columns: np.asarray(columns[2], dtype=np.float64), 0)
         
         # 2. Implicit: visits (convert to pseudo-rating)
-        for user_id, dest_id, visit_count in visits:
-            key = (user_id, dest_id)
-            if key not in interaction_dict:  # Only if no explicit rating
-                # Visit frequency → pseudo-rating
-                # 1 visit = 3.0, 2 visits = 3.5, 3+ visits = 4.0 (capped at 5.0)
-                pseudo_rating = min(3.0 + (visit_count - 1) * 0.5, 5.0)
-                interaction_dict[key] = pseudo_rating
+        # 1 visit = 3.0, 2 visits = 3.5, 3+ visits = 4.0 (capped at 5.0)
+        add_signal(visits, lambda columns: np.minimum(
+            3.0 + (np.asarray(columns[2], dtype=np.float64) - 1) * 0.5, 5.0
+        ), 1)
         
         # 3. Implicit: favorites (pseudo-rating = 4.5)
-        for user_id, dest_id in favorites:
-            key = (user_id, dest_id)
-            if key not in interaction_dict:
-                interaction_dict[key] = 4.5
+        add_signal(favorites, lambda columns: np.full(len(columns[0]), 4.5), 2)
         
-        if not interaction_dict:
+        if not users:
             logger.warning("No interaction data found!")
-            return np.array([]), [], []
+            return csr_matrix((0, 0), dtype=np.float32), [], []
         
-        # Build matrix indices
-        unique_users = sorted(set(k[0] for k in interaction_dict.keys()))
-        unique_dests = sorted(set(k[1] for k in interaction_dict.keys()))
+        user_col = np.concatenate(users)
+        dest_col = np.concatenate(dests)
+        value_col = np.concatenate(values)
+        priority_col = np.concatenate(priorities)
+        
+        # One value per (user, destination): highest priority signal, latest rating row wins
+        order = np.lexsort((-np.arange(len(user_col)), priority_col, dest_col, user_col))
+        sorted_users = user_col[order]
+        sorted_dests = dest_col[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (sorted_users[1:] != sorted_users[:-1]) | (sorted_dests[1:] != sorted_dests[:-1])
+        keep = order[first]
         
-        user_idx_map = {uid: idx for idx, uid in enumerate(unique_users)}
-        dest_idx_map = {did: idx for idx, did in enumerate(unique_dests)}
+        # Build matrix indices
+        unique_users, rows = np.unique(user_col[keep], return_inverse=True)
+        unique_dests, cols = np.unique(dest_col[keep], return_inverse=True)
         
-        # Initialize matrix
         n_users = len(unique_users)
         n_dests = len(unique_dests)
-        matrix = np.zeros((n_users, n_dests))
+        matrix = coo_matrix(
+            (value_col[keep], (rows, cols)), shape=(n_users, n_dests), dtype=np.float32
+        ).tocsr()
+        matrix.eliminate_zeros()
         
-        # Fill matrix
-        for (user_id, dest_id), rating in interaction_dict.items():
-            i = user_idx_map[user_id]
-            j = dest_idx_map[dest_id]
-            matrix[i, j] = rating
+        density = matrix.nnz / (n_users * n_dests) if n_users * n_dests > 0 else 0
+        logger.info(f"Matrix built: {n_users} users × {n_dests} destinations, "
+                    f"{matrix.nnz} interactions, density: {density:.2%}")
         
-        density = np.count_nonzero(matrix) / (n_users * n_dests) if n_users * n_dests > 0 else 0
-        logger.info(f"Matrix built: {n_users} users × {n_dests} destinations, density: {density:.2%}")
-        
-        return matrix, unique_users, unique_dests
-    
-    # ==========================================
-    # PART 2: USER-USER COLLABORATIVE FILTERING
-    # ==========================================
+        return matrix, unique_users.tolist(), unique_dests.tolist()
     
-    def compute_user_similarity(self, matrix: np.ndarray) -> np.ndarray:
+    def build_neighbors(
+        self,
+        matrix: csr_matrix,
+        k: Optional[int] = None
+    ) -> Tuple[csr_matrix, csr_matrix]:
         """
-        Compute user-user similarity using cosine similarity
+        Top-k cosine neighbours of every user and every destination
         
-        Similarity = cos(θ) = (A · B) / (||A|| ||B||)
-        
-        Args:
-            matrix: (n_users, n_items) interaction matrix
-            
         Returns:
-            similarity: (n_users, n_users) similarity matrix
+            (user_neighbors, item_neighbors): CSR matrices, row i holds the indices of
+            the k most similar rows (most similar first) and their similarities
         """
-        logger.info("Computing user-user similarity matrix...")
-        
-        # Use sparse matrix for efficiency
-        sparse_matrix = csr_matrix(matrix)
-        similarity = cosine_similarity(sparse_matrix)
-        
-        # Set diagonal to 0 (user shouldn't be similar to themselves)
-        np.fill_diagonal(similarity, 0)
+        k = k or self.NEIGHBORS_K
+        matrix = csr_matrix(matrix, dtype=np.float32)
+        return self._top_k_neighbors(matrix, k), self._top_k_neighbors(matrix.T.tocsr(), k)
+    
+    @staticmethod
+    def _top_k_neighbors(matrix: csr_matrix, k: int, chunk_size: int = 1024) -> csr_matrix:
+        """
+        Similarity = cos(θ) = (A · B) / (||A|| ||B||) between rows, keeping only the top k per row
         
-        logger.info(f"User similarity matrix computed: {similarity.shape}")
-        return similarity
+        Computed chunk by chunk as sparse products of L2-normalized rows, so memory
+        never holds a dense (n × n) similarity matrix.
+        """
+        n = matrix.shape[0]
+        vectors = normalize(matrix, norm='l2', axis=1)
+        vectors_t = vectors.T.tocsr()
+        
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indices, data = [], []
+        for start in range(0, n, chunk_size):
+            similarities = vectors[start:start + chunk_size].dot(vectors_t).tocsr()
+            for offset in range(similarities.shape[0]):
+                lo, hi = similarities.indptr[offset], similarities.indptr[offset + 1]
+                cols = similarities.indices[lo:hi]
+                sims = similarities.data[lo:hi]
+                
+                # Not itself; zero similarity never contributes to a prediction
+                keep = (cols != start + offset) & (sims > 0)
+                cols, sims = cols[keep], sims[keep]
+                if len(sims) > k:
+                    top = np.argpartition(sims, -k)[-k:]
+                    cols, sims = cols[top], sims[top]
+                order = np.argsort(-sims, kind='stable')
+                
+                indices.append(cols[order])
+                data.append(sims[order])
+                indptr[start + offset + 1] = indptr[start + offset] + len(order)
+        
+        return csr_matrix(
+            (
+                np.concatenate(data).astype(np.float32) if data else np.zeros(0, dtype=np.float32),
+                np.concatenate(indices).astype(np.int32) if indices else np.zeros(0, dtype=np.int32),
+                indptr
+            ),
+            shape=(n, n)
+        )
+    
+    def _ensure_neighbors(self, matrix: csr_matrix) -> None:
+        """Neighbour lists for a matrix built by this service (a CFModel already has them)"""
+        if self.user_neighbors is None or self.item_neighbors is None:
+            self.user_neighbors, self.item_neighbors = self.build_neighbors(matrix)
+    
+    @staticmethod
+    def _neighbors_of(neighbors: csr_matrix, idx: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, similarities) of the k most similar rows to idx"""
+        lo = neighbors.indptr[idx]
+        hi = min(neighbors.indptr[idx + 1], lo + k)
+        return neighbors.indices[lo:hi], neighbors.data[lo:hi]
+    
+    def _find_indices(
+        self,
+        user_id: int,
+        destination_id: int,
+        user_ids: List[int],
+        dest_ids: List[int]
+    ) -> Tuple[Optional[int], Optional[int]]:
+        """Row / column of (user, destination): dict lookup for the cached matrix, list search otherwise"""
+        if user_ids is self.user_ids and dest_ids is self.dest_ids and self.user_index:
+            return self.user_index.get(user_id), self.dest_index.get(destination_id)
+        user_idx = user_ids.index(user_id) if user_id in user_ids else None
+        dest_idx = dest_ids.index(destination_id) if destination_id in dest_ids else None
+        return user_idx, dest_idx
+    
+    # ==========================================
+    # PART 2: USER-USER COLLABORATIVE FILTERING
+    # ==========================================
     
     def predict_user_based(
         self,
         user_id: int,
         destination_id: int,
-        matrix: np.ndarray,
+        matrix: csr_matrix,
         user_ids: List[int],
         dest_ids: List[int],
         k: int = 20
@@ -189,38 +327,28 @@ class CollaborativeFilteringService:
         Returns:
             Predicted rating (1-5) or None if can't predict
         """
-        try:
-            user_idx = user_ids.index(user_id)
-            dest_idx = dest_ids.index(destination_id)
-        except ValueError:
+        user_idx, dest_idx = self._find_indices(user_id, destination_id, user_ids, dest_ids)
+        if user_idx is None or dest_idx is None:
             # User or destination not in training data
             return None
         
         # If user already rated, return actual rating
-        actual_rating = matrix[user_idx, dest_idx]
+        actual_rating = float(matrix[user_idx, dest_idx])
         if actual_rating > 0:
             return actual_rating
         
-        # Compute similarity if not cached
-        if self.user_similarity is None:
-            self.user_similarity = self.compute_user_similarity(matrix)
-        
-        # Get similarities for target user
-        similarities = self.user_similarity[user_idx]
-        
-        # Find k most similar users
-        top_k_indices = np.argsort(similarities)[-k:][::-1]
+        # Find k most similar users (precomputed neighbour lists)
+        self._ensure_neighbors(matrix)
+        top_k_indices, sim_scores = self._neighbors_of(self.user_neighbors, user_idx, k)
+        if len(top_k_indices) == 0:
+            return None
         
         # Weighted average of similar users' ratings
-        numerator = 0.0
-        denominator = 0.0
-        
-        for similar_user_idx in top_k_indices:
-            rating = matrix[similar_user_idx, dest_idx]
-            if rating > 0:  # Only consider users who rated this destination
-                sim_score = similarities[similar_user_idx]
-                numerator += sim_score * rating
-                denominator += abs(sim_score)
+        # (only users who rated this destination)
+        ratings = matrix[top_k_indices, dest_idx].toarray().ravel()
+        rated = ratings > 0
+        numerator = float(np.dot(sim_scores[rated], ratings[rated]))
+        denominator = float(np.abs(sim_scores[rated]).sum())
         
         if denominator == 0:
             return None  # No similar users rated this destination
@@ -232,28 +360,11 @@ class CollaborativeFilteringService:
     # PART 3: ITEM-ITEM COLLABORATIVE FILTERING
     # ==========================================
     
-    def compute_item_similarity(self, matrix: np.ndarray) -> np.ndarray:
-        """
-        Compute item-item similarity (destinations)
-        
-        "Destinations that are rated similarly by users are similar"
-        """
-        logger.info("Computing item-item similarity matrix...")
-        
-        # Transpose for item-item
-        sparse_matrix = csr_matrix(matrix.T)
-        similarity = cosine_similarity(sparse_matrix)
-        
-        np.fill_diagonal(similarity, 0)
-        
-        logger.info(f"Item similarity matrix computed: {similarity.shape}")
-        return similarity
-    
     def predict_item_based(
         self,
         user_id: int,
         destination_id: int,
-        matrix: np.ndarray,
+        matrix: csr_matrix,
         user_ids: List[int],
         dest_ids: List[int],
         k: int = 20
@@ -267,37 +378,26 @@ class CollaborativeFilteringService:
         
         Logic: "Users who liked destination A also liked B"
         """
-        try:
-            user_idx = user_ids.index(user_id)
-            dest_idx = dest_ids.index(destination_id)
-        except ValueError:
+        user_idx, dest_idx = self._find_indices(user_id, destination_id, user_ids, dest_ids)
+        if user_idx is None or dest_idx is None:
             return None
         
         # Check if already rated
-        actual_rating = matrix[user_idx, dest_idx]
+        actual_rating = float(matrix[user_idx, dest_idx])
         if actual_rating > 0:
             return actual_rating
         
-        # Compute item similarity if not cached
-        if self.item_similarity is None:
-            self.item_similarity = self.compute_item_similarity(matrix)
-        
-        # Get similarities for target destination
-        similarities = self.item_similarity[dest_idx]
-        
-        # Find k most similar destinations
-        top_k_indices = np.argsort(similarities)[-k:][::-1]
+        # Find k most similar destinations (precomputed neighbour lists)
+        self._ensure_neighbors(matrix)
+        top_k_indices, sim_scores = self._neighbors_of(self.item_neighbors, dest_idx, k)
+        if len(top_k_indices) == 0:
+            return None
         
         # Weighted average of user's ratings on similar destinations
-        numerator = 0.0
-        denominator = 0.0
-        
-        for similar_dest_idx in top_k_indices:
-            rating = matrix[user_idx, similar_dest_idx]
-            if rating > 0:
-                sim_score = similarities[similar_dest_idx]
-                numerator += sim_score * rating
-                denominator += abs(sim_score)
+        ratings = matrix[user_idx, top_k_indices].toarray().ravel()
+        rated = ratings > 0
+        numerator = float(np.dot(sim_scores[rated], ratings[rated]))
+        denominator = float(np.abs(sim_scores[rated]).sum())
         
         if denominator == 0:
             return None
@@ -330,24 +430,27 @@ class CollaborativeFilteringService:
                 'method_used': str
             }
         """
-        # Build matrix if not cached
+        # Build matrix if not cached (never with a shared CFModel)
         if self.user_item_matrix is None:
             matrix, user_ids, dest_ids = self.build_interaction_matrix()
-            if len(user_ids) == 0:
-                # No data available
-                return {
-                    'predicted_rating': 3.0,
-                    'confidence': 0.0,
-                    'method_used': 'no_data'
-                }
             self.user_item_matrix = matrix
             self.user_ids = user_ids
             self.dest_ids = dest_ids
+            self.user_index = {uid: idx for idx, uid in enumerate(user_ids)}
+            self.dest_index = {did: idx for idx, did in enumerate(dest_ids)}
         else:
             matrix = self.user_item_matrix
             user_ids = self.user_ids
             dest_ids = self.dest_ids
         
+        if len(user_ids) == 0:
+            # No data available
+            return {
+                'predicted_rating': 3.0,
+                'confidence': 0.0,
+                'method_used': 'no_data'
+            }
+        
         if method == 'user_based':
             pred = self.predict_user_based(user_id, destination_id, matrix, user_ids, dest_ids)
             return {
@@ -383,12 +486,16 @@ class CollaborativeFilteringService:
                 method_used = 'item_based'
             else:
                 # Fallback: use destination average
-                dest = self.db.query(Destination).filter(
-                    Destination.destination_id == destination_id
-                ).first()
+                if self.model is not None:
+                    avg_rating = self.model.dest_avg_ratings.get(destination_id)
+                else:
+                    dest = self.db.query(Destination).filter(
+                        Destination.destination_id == destination_id
+                    ).first()
+                    avg_rating = dest.avg_rating if dest else None
                 
-                if dest and dest.avg_rating and dest.avg_rating > 0:
-                    final_pred = float(dest.avg_rating)
+                if avg_rating and avg_rating > 0:
+                    final_pred = float(avg_rating)
                     confidence = 0.3
                     method_used = 'baseline_avg'
                 else:
@@ -462,18 +569,21 @@ class CollaborativeFilteringService:
                 'recommended_cf_weight': float  # 0.0-1.0
             }
         """
-        rating_count = self.db.query(DestinationRating).filter(
-            DestinationRating.user_id == user_id
-        ).count()
-        
-        visit_count = self.db.query(VisitLog).filter(
-            VisitLog.user_id == user_id,
-            VisitLog.completed == True
-        ).count()
-        
-        favorite_count = self.db.query(UserFavorite).filter(
-            UserFavorite.user_id == user_id
-        ).count()
+        if self.model is not None:
+            rating_count, visit_count, favorite_count = self.model.activity_counts.get(user_id, (0, 0, 0))
+        else:
+            rating_count = self.db.query(DestinationRating).filter(
+                DestinationRating.user_id == user_id
+            ).count()
+            
+            visit_count = self.db.query(VisitLog).filter(
+                VisitLog.user_id == user_id,
+                VisitLog.completed == True
+            ).count()
+            
+            favorite_count = self.db.query(UserFavorite).filter(
+                UserFavorite.user_id == user_id
+            ).count()
         
         total_interactions = rating_count + visit_count + favorite_count
         
@@ -496,3 +606,194 @@ class CollaborativeFilteringService:
             'activity_level': activity_level,
             'recommended_cf_weight': cf_weight
         }
+
+
+# ==============================================================================
+# CF MODEL STORE - One shared model per worker
+# ==============================================================================
+
+class CFModelStore:
+    """
+    Holds the current CFModel of this process (worker)
+    
+    - get_model(): current model, built synchronously only if none exists yet
+    - reload(): build a new model, then swap (readers see the old or the new model, never half of one)
+    - Background thread: every CF_MODEL_CHECK_SECONDS rebuilds when the model is older than
+      CF_MODEL_REFRESH_SECONDS or at least CF_MODEL_REFRESH_MIN_CHANGES interactions changed
+    """
+    
+    _model: Optional[CFModel] = None
+    _version: int = 0
+    _lock = threading.Lock()  # Serializes builds; readers never take it
+    _refresh_thread: Optional[threading.Thread] = None
+    _stop_event = threading.Event()
+    
+    @classmethod
+    def get_model(cls, db: Session) -> CFModel:
+        """Current model (builds the first one if needed)"""
+        model = cls._model
+        if model is None:
+            return cls.reload(db, only_if_missing=True)
+        return model
+    
+    @classmethod
+    def current_version(cls) -> Optional[int]:
+        """Version of the current model (None = not built yet)"""
+        model = cls._model
+        return model.version if model is not None else None
+    
+    @classmethod
+    def reload(cls, db: Session, only_if_missing: bool = False) -> CFModel:
+        """Build a model from the database and swap it in"""
+        with cls._lock:
+            if only_if_missing and cls._model is not None:
+                return cls._model  # Built by another thread while waiting for the lock
+            
+            started = time.monotonic()
+            signature = cls._read_signature(db)
+            built_at = datetime.utcnow()
+            
+            service = CollaborativeFilteringService(db)
+            matrix, user_ids, dest_ids = service.build_interaction_matrix()
+            user_neighbors = item_neighbors = None
+            if user_ids:
+                user_neighbors, item_neighbors = service.build_neighbors(matrix)
+            
+            model = CFModel(
+                matrix, user_ids, dest_ids, user_neighbors, item_neighbors,
+                cls._read_activity_counts(db),
+                {
+                    dest_id: float(avg_rating)
+                    for dest_id, avg_rating in db.query(Destination.destination_id, Destination.avg_rating).all()
+                    if avg_rating is not None
+                },
+                cls._version + 1,
+                signature,
+                built_at
+            )
+            cls._version = model.version
+            cls._model = model
+        
+        logger.info(f"CF model v{model.version} built in {time.monotonic() - started:.2f}s: "
+                    f"{len(user_ids)} users x {len(dest_ids)} destinations, {matrix.nnz} interactions")
+        return model
+    
+    @classmethod
+    def invalidate(cls) -> None:
+        """Drop the current model, the next request builds a new one"""
+        with cls._lock:
+            cls._model = None
+    
+    @classmethod
+    def refresh_if_needed(cls, db: Session) -> bool:
+        """Rebuild when the model is missing, too old or enough interactions changed"""
+        model = cls._model
+        if model is None:
+            cls.reload(db)
+            return True
+        
+        refresh_seconds = settings.CF_MODEL_REFRESH_SECONDS
+        if refresh_seconds > 0 and time.monotonic() - model.loaded_at >= refresh_seconds:
+            cls.reload(db)
+            return True
+        
+        changes = cls.count_changes(db, model)
+        if changes >= settings.CF_MODEL_REFRESH_MIN_CHANGES:
+            logger.info(f"CF model v{model.version}: {changes} interactions changed, rebuilding")
+            cls.reload(db)
+            return True
+        return False
+    
+    @classmethod
+    def count_changes(cls, db: Session, model: CFModel) -> int:
+        """
+        Interactions inserted / deleted since the model was built (from row counts and
+        max primary keys) plus ratings updated after the build started
+        """
+        changes = 0
+        for table, (count, max_id) in cls._read_signature(db).items():
+            old_count, old_max_id = model.signature.get(table, (0, 0))
+            inserted = max(0, max_id - old_max_id)
+            deleted = max(0, old_count + inserted - count)
+            changes += inserted + deleted
+        
+        changes += db.query(func.count(DestinationRating.rating_id)).filter(
+            DestinationRating.updated_date > model.built_at,
+            DestinationRating.rating_id <= model.signature.get('ratings', (0, 0))[1]
+        ).scalar() or 0
+        return changes
+    
+    @classmethod
+    def start_background_refresh(cls, session_factory: Optional[Callable[[], Any]] = None) -> None:
+        """
+        Start the refresh thread (builds the first model right away)
+        
+        Args:
+            session_factory: Creates a db session for each check (None = SessionLocal)
+        """
+        if settings.CF_MODEL_CHECK_SECONDS <= 0:
+            return
+        if cls._refresh_thread is not None and cls._refresh_thread.is_alive():
+            return
+        if session_factory is None:
+            from app.db.database import SessionLocal
+            session_factory = SessionLocal
+        
+        cls._stop_event.clear()
+        cls._refresh_thread = threading.Thread(
+            target=cls._refresh_loop, args=(session_factory,), name='cf-model-refresh', daemon=True
+        )
+        cls._refresh_thread.start()
+    
+    @classmethod
+    def stop_background_refresh(cls, timeout: float = 5.0) -> None:
+        """Stop the refresh thread (a build in progress finishes first, up to timeout)"""
+        cls._stop_event.set()
+        thread = cls._refresh_thread
+        if thread is not None:
+            thread.join(timeout)
+        cls._refresh_thread = None
+    
+    @classmethod
+    def _refresh_loop(cls, session_factory: Callable[[], Any]) -> None:
+        while True:
+            db = session_factory()
+            try:
+                cls.refresh_if_needed(db)
+            except Exception as e:
+                # Keep serving the current model, try again on the next check
+                logger.error(f"CF model refresh failed: {str(e)}")
+            finally:
+                db.close()
+            if cls._stop_event.wait(settings.CF_MODEL_CHECK_SECONDS):
+                return
+    
+    @staticmethod
+    def _read_signature(db: Session) -> Dict[str, Tuple[int, int]]:
+        """Cheap change signature: (row count, max primary key) of every interaction table"""
+        signature = {}
+        for table, column, filters in (
+            ('ratings', DestinationRating.rating_id, ()),
+            ('visits', VisitLog.log_id, (VisitLog.completed == True,)),
+            ('favorites', UserFavorite.favorite_id, ()),
+        ):
+            count, max_id = db.query(func.count(column), func.max(column)).filter(*filters).one()
+            signature[table] = (count or 0, max_id or 0)
+        return signature
+    
+    @staticmethod
+    def _read_activity_counts(db: Session) -> Dict[int, Tuple[int, int, int]]:
+        """user_id -> (ratings, completed visits, favorites), same counts as get_user_activity_level"""
+        counts: Dict[int, List[int]] = {}
+        queries = (
+            db.query(DestinationRating.user_id, func.count(DestinationRating.rating_id))
+            .group_by(DestinationRating.user_id),
+            db.query(VisitLog.user_id, func.count(VisitLog.log_id))
+            .filter(VisitLog.completed == True).group_by(VisitLog.user_id),
+            db.query(UserFavorite.user_id, func.count(UserFavorite.favorite_id))
+            .group_by(UserFavorite.user_id),
+        )
+        for column, query in enumerate(queries):
+            for user_id, count in query.all():
+                counts.setdefault(user_id, [0, 0, 0])[column] = count
+        return {user_id: tuple(values) for user_id, values in counts.items()}
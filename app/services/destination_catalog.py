@@ -0,0 +1,387 @@
+"""
+==============================================================================
+DESTINATION CATALOG - Snapshot danh sách địa điểm trong bộ nhớ
+==============================================================================
+Mỗi worker giữ một snapshot read-only của các địa điểm đang hoạt động:
+- Load một lần từ database (to_dict() chỉ chạy khi build snapshot)
+- Build lại toàn bộ (cả feature store và spatial index) rồi swap nguyên tử khi dữ liệu thay đổi
+- Được dùng chung bởi bước tính điểm và bước tối ưu lộ trình
+"""
+
+import copy
+import re
+import threading
+import time
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple, Any
+
+import numpy as np
+from sklearn.neighbors import BallTree
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.destination import Destination
+
+
+# ==============================================================================
+# OPENING HOURS - Parse giờ mở cửa thành khung phút (một lần khi build snapshot)
+# ==============================================================================
+
+class OpeningHours:
+    """
+    Chuyển chuỗi opening_hours ("08:00-17:00") thành (open, close) tính bằng phút trong ngày
+
+    - close < open: mở qua đêm (vd: "18:00-02:00" => (1080, 120))
+    - Mở cả ngày ("00:00-23:59", "00:00-00:00"), không có hoặc không đọc được
+      (vd: "11") => None = không ràng buộc
+    """
+
+    MINUTES_PER_DAY = 24 * 60
+    _CLOCK = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*$')
+    _RANGE = re.compile(r'^\s*(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})\s*$')
+
+    @classmethod
+    def parse_clock(cls, value: Optional[str]) -> Optional[int]:
+        """"HH:MM" => số phút từ 00:00 (None nếu không hợp lệ)"""
+        match = cls._CLOCK.match(value or '')
+        if not match:
+            return None
+        hour, minute = int(match.group(1)), int(match.group(2))
+        if hour > 24 or minute > 59 or hour * 60 + minute > cls.MINUTES_PER_DAY:
+            return None
+        return hour * 60 + minute
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> Optional[Tuple[int, int]]:
+        """opening_hours => (open, close) phút trong ngày, None = mở cả ngày / không rõ"""
+        match = cls._RANGE.match(value or '')
+        if not match:
+            return None
+        open_minutes = cls.parse_clock(match.group(1))
+        close_minutes = cls.parse_clock(match.group(2))
+        if open_minutes is None or close_minutes is None:
+            return None
+        open_minutes %= cls.MINUTES_PER_DAY
+        close_minutes %= cls.MINUTES_PER_DAY
+        if open_minutes == close_minutes or (open_minutes == 0 and close_minutes >= cls.MINUTES_PER_DAY - 1):
+            return None
+        return open_minutes, close_minutes
+
+    @classmethod
+    def get_window(cls, dest: Dict) -> Optional[Tuple[int, int]]:
+        """Khung giờ đã parse sẵn trong snapshot ('time_window'), parse nếu dict không từ snapshot"""
+        if 'time_window' in dest:
+            return dest['time_window']
+        return cls.parse(dest.get('opening_hours'))
+
+    @staticmethod
+    def format_clock(minutes: int) -> str:
+        """Số phút (có thể vượt 24h) => "HH:MM" trong ngày"""
+        minutes = int(minutes) % (24 * 60)
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+# ==============================================================================
+# DESTINATION FEATURE STORE - Dữ liệu địa điểm dạng cột (NumPy)
+# ==============================================================================
+
+class DestinationFeatureStore:
+    """
+    Lưu các thuộc tính dùng để tính điểm của danh sách địa điểm dưới dạng cột
+    (NumPy arrays) để ScoringEngine có thể tính điểm cho tất cả địa điểm
+    trong một lần vector hóa thay vì lặp từng dict.
+
+    Thứ tự các hàng trùng với thứ tự của danh sách destinations truyền vào.
+    """
+
+    def __init__(self, destinations: List[Dict]):
+        self.size = len(destinations)
+
+        # Type: mã hóa mỗi loại (lowercase) thành một số nguyên
+        self.type_vocab: List[str] = []
+        type_index: Dict[str, int] = {}
+        type_codes = []
+        for dest in destinations:
+            place_type = (dest.get('type') or '').lower()
+            if place_type not in type_index:
+                type_index[place_type] = len(self.type_vocab)
+                self.type_vocab.append(place_type)
+            type_codes.append(type_index[place_type])
+        self.type_codes = np.array(type_codes, dtype=np.int32)
+
+        # Tags: ma trận membership (n_destinations x n_tags)
+        self.tag_index: Dict[str, int] = {}
+        rows, cols = [], []
+        for row, dest in enumerate(destinations):
+            for tag in set(t.lower() for t in dest.get('tags', []) or []):
+                if tag not in self.tag_index:
+                    self.tag_index[tag] = len(self.tag_index)
+                rows.append(row)
+                cols.append(self.tag_index[tag])
+        self.tag_matrix = np.zeros((self.size, len(self.tag_index)), dtype=bool)
+        self.tag_matrix[rows, cols] = True
+        self.tag_counts = self.tag_matrix.sum(axis=1)
+
+        # Tọa độ, price và visit_time
+        self.latitudes = np.array(
+            [dest.get('latitude', 0) for dest in destinations], dtype=np.float64
+        )
+        self.longitudes = np.array(
+            [dest.get('longitude', 0) for dest in destinations], dtype=np.float64
+        )
+        self.prices = np.array(
+            [dest.get('price', 0) for dest in destinations], dtype=np.float64
+        )
+        self.visit_times = np.array(
+            [dest.get('visit_time', 60) for dest in destinations], dtype=np.float64
+        )
+
+        # Giờ mở cửa (phút trong ngày), -1 = không ràng buộc
+        windows = [OpeningHours.get_window(dest) or (-1, -1) for dest in destinations]
+        self.open_minutes = np.array([w[0] for w in windows], dtype=np.int32)
+        self.close_minutes = np.array([w[1] for w in windows], dtype=np.int32)
+
+    def subset(self, positions: np.ndarray) -> 'DestinationFeatureStore':
+        """
+        Tạo feature store cho một tập con các hàng (không cần đọc lại dict)
+
+        Args:
+            positions: Chỉ số các hàng cần lấy, theo thứ tự mong muốn
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        sub = copy.copy(self)
+        sub.size = len(positions)
+        sub.type_codes = self.type_codes[positions]
+        sub.tag_matrix = self.tag_matrix[positions]
+        sub.tag_counts = self.tag_counts[positions]
+        sub.latitudes = self.latitudes[positions]
+        sub.longitudes = self.longitudes[positions]
+        sub.prices = self.prices[positions]
+        sub.visit_times = self.visit_times[positions]
+        sub.open_minutes = self.open_minutes[positions]
+        sub.close_minutes = self.close_minutes[positions]
+        return sub
+
+
+# ==============================================================================
+# SPATIAL INDEX - Truy vấn bán kính / k-nearest theo tọa độ
+# ==============================================================================
+
+class SpatialIndex:
+    """
+    BallTree (metric haversine) trên tọa độ địa điểm
+
+    Trả lời truy vấn bán kính và k-nearest trong thời gian sub-linear thay vì
+    tính haversine cho toàn bộ catalog. Kết quả là chỉ số hàng trong catalog
+    (positions), sắp xếp tăng dần để giữ thứ tự gốc của catalog.
+    """
+
+    EARTH_RADIUS_KM = 6371  # Cùng bán kính với DistanceCalculator
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray, positions: np.ndarray):
+        """
+        Args:
+            latitudes, longitudes: Tọa độ (độ) của các địa điểm được index
+            positions: Chỉ số hàng trong catalog tương ứng với từng tọa độ
+        """
+        self.positions = np.asarray(positions, dtype=np.intp)
+        self.tree = None
+        if len(self.positions):
+            coords = np.radians(np.column_stack([latitudes, longitudes]).astype(np.float64))
+            self.tree = BallTree(coords, metric='haversine')
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @staticmethod
+    def _query_point(lat: float, lon: float) -> np.ndarray:
+        return np.radians([[lat, lon]])
+
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tìm các địa điểm trong bán kính radius_km
+
+        Returns:
+            (positions, distances_km) sắp xếp theo position
+        """
+        if self.tree is None:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        idx, dist = self.tree.query_radius(
+            self._query_point(lat, lon),
+            r=radius_km / self.EARTH_RADIUS_KM,
+            return_distance=True
+        )
+        idx, dist = idx[0], dist[0] * self.EARTH_RADIUS_KM
+        order = np.argsort(self.positions[idx], kind='stable')
+        return self.positions[idx][order], dist[order]
+
+    def query_nearest(self, lat: float, lon: float, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Tìm k địa điểm gần nhất
+
+        Returns:
+            (positions, distances_km) sắp xếp theo khoảng cách tăng dần
+        """
+        k = min(k, len(self.positions))
+        if self.tree is None or k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        dist, idx = self.tree.query(self._query_point(lat, lon), k=k)
+        return self.positions[idx[0]], dist[0] * self.EARTH_RADIUS_KM
+
+    def query_expanding(
+        self,
+        lat: float,
+        lon: float,
+        radii_km: Tuple[float, ...]
+    ) -> Tuple[np.ndarray, np.ndarray, float]:
+        """
+        Tìm theo bán kính mở rộng dần (vd: 50km rồi 100km) chỉ với một lần truy vấn
+
+        Truy vấn một lần ở bán kính lớn nhất, sau đó chọn bán kính nhỏ nhất
+        có kết quả bằng cách lọc trên khoảng cách đã có - không quét lại catalog.
+
+        Returns:
+            (positions, distances_km, radius_used)
+        """
+        positions, distances = self.query_radius(lat, lon, max(radii_km))
+        for radius in sorted(radii_km):
+            mask = distances <= radius
+            if mask.any():
+                return positions[mask], distances[mask], radius
+        return positions, distances, max(radii_km)
+
+
+# ==============================================================================
+# CATALOG SNAPSHOT - Dữ liệu read-only của một phiên bản catalog
+# ==============================================================================
+
+class CatalogSnapshot:
+    """
+    Snapshot read-only của các địa điểm đang hoạt động
+
+    Các dict trong snapshot được chia sẻ giữa mọi request: không được sửa trực tiếp,
+    cần .copy() trước khi gắn thêm thông tin (score, metadata, ...).
+    """
+
+    def __init__(self, destinations: List[Dict], version: int, signature: Tuple[Any, ...] = ()):
+        self.version = version
+        self.signature = signature
+        self.loaded_at = datetime.utcnow()
+
+        # Parse opening_hours một lần cho cả snapshot (solver chỉ đọc 'time_window')
+        for dest in destinations:
+            dest['time_window'] = OpeningHours.parse(dest.get('opening_hours'))
+
+        self.destinations = destinations
+        self.index_by_id = {dest['id']: i for i, dest in enumerate(destinations)}
+        self.features = DestinationFeatureStore(destinations)
+
+        # Địa điểm hợp lệ cho lộ trình (tọa độ ở Việt Nam, visit_time hợp lý)
+        self.valid_positions = np.array(
+            [i for i, dest in enumerate(destinations) if self.is_routable(dest)],
+            dtype=np.intp
+        )
+        self.spatial_index = SpatialIndex(
+            [destinations[i]['latitude'] for i in self.valid_positions],
+            [destinations[i]['longitude'] for i in self.valid_positions],
+            self.valid_positions
+        )
+
+    @staticmethod
+    def is_routable(dest: Dict) -> bool:
+        """Vietnam: latitude 8-24, longitude 102-110; max 10 giờ mỗi địa điểm"""
+        lat = dest.get('latitude', 0)
+        lon = dest.get('longitude', 0)
+        visit_time = dest.get('visit_time', 0)
+        return (8 <= lat <= 24 and 102 <= lon <= 110 and
+                visit_time > 0 and visit_time <= 600)
+
+    def __len__(self) -> int:
+        return len(self.destinations)
+
+    def get(self, destination_id: int) -> Optional[Dict]:
+        """Lấy địa điểm theo ID (None nếu không có trong snapshot)"""
+        position = self.index_by_id.get(destination_id)
+        return self.destinations[position] if position is not None else None
+
+    def take(self, positions) -> List[Dict]:
+        """Lấy danh sách địa điểm theo chỉ số hàng"""
+        return [self.destinations[i] for i in positions]
+
+
+# ==============================================================================
+# DESTINATION CATALOG - Quản lý snapshot trong mỗi worker
+# ==============================================================================
+
+class DestinationCatalog:
+    """
+    Giữ snapshot hiện tại của catalog cho process (worker) này
+
+    - get_snapshot(): trả về snapshot hiện tại, load lần đầu nếu chưa có
+    - reload(): build snapshot mới rồi swap (reader luôn thấy bản cũ hoặc bản mới đầy đủ)
+    - Định kỳ (CATALOG_REFRESH_SECONDS) so sánh chữ ký count/max(updated_date)
+      để nhận thay đổi được ghi từ worker khác
+    """
+
+    _snapshot: Optional[CatalogSnapshot] = None
+    _version: int = 0
+    _last_checked: float = 0.0
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_snapshot(cls, db: Session) -> CatalogSnapshot:
+        """Lấy snapshot hiện tại (load hoặc refresh khi cần)"""
+        snapshot = cls._snapshot
+        if snapshot is None:
+            return cls.reload(db)
+
+        refresh_seconds = settings.CATALOG_REFRESH_SECONDS
+        if refresh_seconds > 0 and time.monotonic() - cls._last_checked > refresh_seconds:
+            cls._last_checked = time.monotonic()
+            if cls._read_signature(db) != snapshot.signature:
+                return cls.reload(db)
+
+        return snapshot
+
+    @classmethod
+    def current_version(cls) -> Optional[int]:
+        """Version của snapshot đang giữ (không truy vấn database, None nếu chưa load)"""
+        snapshot = cls._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    @classmethod
+    def reload(cls, db: Session) -> CatalogSnapshot:
+        """Load lại toàn bộ địa điểm đang hoạt động và swap snapshot"""
+        with cls._lock:
+            signature = cls._read_signature(db)
+            destinations = db.query(Destination).filter(
+                Destination.is_active == True
+            ).all()
+            destinations_dict = [dest.to_dict() for dest in destinations]
+
+            snapshot = CatalogSnapshot(destinations_dict, cls._version + 1, signature)
+            cls._version = snapshot.version
+            cls._last_checked = time.monotonic()
+            cls._snapshot = snapshot
+
+        print(f"DEBUG: Catalog v{snapshot.version} loaded: {len(snapshot)} destinations, "
+              f"{len(snapshot.valid_positions)} routable")
+        return snapshot
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """Bỏ snapshot hiện tại, request tiếp theo sẽ load lại"""
+        with cls._lock:
+            cls._snapshot = None
+
+    @staticmethod
+    def _read_signature(db: Session) -> Tuple[Any, ...]:
+        """Chữ ký rẻ để phát hiện thay đổi: số dòng và updated_date mới nhất"""
+        count, last_update = db.query(
+            func.count(Destination.destination_id),
+            func.max(Destination.updated_date)
+        ).one()
+        return (count, last_update)
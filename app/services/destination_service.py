@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import or_, and_, func
 from app.models.destination import Destination
 from app.schemas.destination import DestinationCreate, DestinationUpdate, DestinationFilter
+from app.services.destination_catalog import DestinationCatalog
 
 
 class DestinationService:
@@ -117,6 +118,7 @@ class DestinationService:
         db.add(db_destination)
         db.commit()
         db.refresh(db_destination)
+        DestinationCatalog.reload(db)
         return db_destination
     
     @staticmethod
@@ -139,6 +141,7 @@ class DestinationService:
         
         db.commit()
         db.refresh(db_destination)
+        DestinationCatalog.reload(db)
         return db_destination
     
     @staticmethod
@@ -153,6 +156,7 @@ class DestinationService:
         
         db_destination.is_active = False
         db.commit()
+        DestinationCatalog.reload(db)
         return True
     
     @staticmethod
@@ -180,4 +184,5 @@ class DestinationService:
             created.append(destination)
         
         db.commit()
+        DestinationCatalog.reload(db)
         return created
@@ -0,0 +1,107 @@
+"""
+==============================================================================
+SINGLE FLIGHT - Gộp các request giống hệt đang chạy đồng thời
+==============================================================================
+Request đầu tiên với một key thực sự tính toán; các request cùng key đến trong lúc
+đó chờ và dùng chung kết quả (hoặc exception) thay vì tự chạy solver lần nữa.
+- SingleFlight: cho code đồng bộ (thread)
+- AsyncSingleFlight: cho coroutine trong event loop (không chặn loop khi chờ)
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """Gộp các lời gọi cùng key từ nhiều thread"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.shared = 0  # Số lời gọi dùng chung kết quả của lời gọi khác
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[bool, Any]:
+        """
+        Chạy fn() nếu chưa có lời gọi nào cùng key đang chạy, ngược lại chờ lời gọi đó
+
+        Returns:
+            (shared, result) - shared=True: kết quả của lời gọi khác (không được sửa trực tiếp)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return True, call.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return False, result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """Gộp các coroutine cùng key trong một event loop"""
+
+    def __init__(self):
+        self._calls: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[bool, Any]:
+        """
+        Như SingleFlight.do nhưng await; lời gọi chính bị hủy (client ngắt kết nối)
+        thì các lời gọi đang chờ tự chạy lại thay vì bị hủy theo
+
+        Returns:
+            (shared, result)
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+
+        while True:
+            call = self._calls.get(call_key)
+            if call is None:
+                break
+            self.shared += 1
+            try:
+                return True, await asyncio.shield(call)
+            except asyncio.CancelledError:
+                if call.cancelled():
+                    self.shared -= 1
+                    continue  # Lời gọi chính bị hủy => chạy lại
+                raise
+
+        call = self._calls[call_key] = loop.create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            call.exception()  # Đánh dấu đã đọc (không có ai chờ thì không log cảnh báo)
+            raise
+        else:
+            call.set_result(result)
+            return False, result
+        finally:
+            self._calls.pop(call_key, None)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
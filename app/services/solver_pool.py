@@ -0,0 +1,291 @@
+"""
+==============================================================================
+SOLVER POOL - Process pool dùng chung cho các bài toán tối ưu lộ trình
+==============================================================================
+- Tạo lười (lần đầu cần dùng), dùng chung trong cả worker
+- Context 'spawn': process con không kế thừa connection pool / thread của worker
+- Task gửi vào pool phải là hàm top-level (picklable) với tham số thuần dữ liệu
+- Giới hạn số task đang chạy + đang chờ (TOUR_SOLVER_MAX_QUEUE): quá tải thì từ chối
+  ngay (SolverPoolOverloaded) thay vì xếp hàng làm chậm mọi request
+- Task cần gửi kết quả trung gian về worker (streaming) nhận ProgressReporter của một
+  ProgressChannel: mọi channel của worker dùng chung một queue (proxy qua Manager
+  process) và một thread đọc, thread này chuyển từng kết quả vào asyncio.Queue của
+  request tương ứng (không request nào phải poll queue trong threadpool)
+"""
+
+import asyncio
+import importlib
+import itertools
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import wait as wait_futures
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.managers import SyncManager
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+
+def _import_modules(modules: Tuple[str, ...]) -> int:
+    """Task warm-up: import trước các module nặng (OR-Tools, NumPy, ...) trong process con"""
+    for module in modules:
+        importlib.import_module(module)
+    return os.getpid()
+
+
+class SolverPoolOverloaded(Exception):
+    """Solver pool đã đầy (đang chạy + đang chờ đạt giới hạn)"""
+
+    def __init__(self, in_flight: int, capacity: int):
+        self.in_flight = in_flight
+        self.capacity = capacity
+        # Một task dài nhất bằng latency budget => thử lại sau chừng đó là hợp lý
+        self.retry_after = max(1, math.ceil(settings.TOUR_LATENCY_BUDGET_MS / 1000))
+        super().__init__(f"Solver pool overloaded ({in_flight}/{capacity} tasks)")
+
+
+class ProgressReporter:
+    """Phía task (process con): gửi kết quả trung gian vào channel của request"""
+
+    def __init__(self, queue: Any, channel_id: int):
+        self.queue = queue
+        self.channel_id = channel_id
+
+    def put(self, item: Any) -> None:
+        self.queue.put((self.channel_id, item))
+
+
+class ProgressChannel:
+    """Phía worker: asyncio.Queue nhận kết quả trung gian của một task"""
+
+    END = '__end__'  # Đánh dấu đã nhận hết (gửi sau khi task xong, qua cùng queue => đúng thứ tự)
+    FLUSH_TIMEOUT = 1.0  # Chờ tối đa (giây) phần còn lại sau khi task xong (Manager chết => bỏ)
+
+    def __init__(self, reporter: ProgressReporter, loop: asyncio.AbstractEventLoop):
+        self.reporter = reporter
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._loop = loop
+
+    def deliver(self, item: Any) -> None:
+        """Gọi từ thread đọc của SolverPool"""
+        self._loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    async def receive(self, task: asyncio.Future) -> AsyncIterator[Any]:
+        """Các kết quả trung gian theo thứ tự, tới khi task xong và đã nhận hết"""
+        finished = False
+        while True:
+            getter = asyncio.ensure_future(self.queue.get())
+            done, _ = await asyncio.wait(
+                {getter} if finished else {getter, task},
+                timeout=self.FLUSH_TIMEOUT if finished else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter not in done:
+                getter.cancel()
+                if finished:
+                    print("ERROR: Progress channel did not flush, dropping remaining results")
+                    return
+                # Task xong => mọi kết quả của nó đã ở trong queue chung, END tới sau cùng
+                finished = True
+                try:
+                    await self._loop.run_in_executor(None, self.reporter.put, self.END)
+                except Exception as e:
+                    print(f"ERROR: Cannot close progress channel: {str(e)}")
+                    return
+                continue
+
+            item = getter.result()
+            if item == self.END:
+                return
+            yield item
+
+
+class SolverPool:
+    """Quản lý ProcessPoolExecutor (có admission control) của worker hiện tại"""
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _manager: Optional[SyncManager] = None
+    _max_workers: int = 0
+    _in_flight: int = 0
+    _lock = threading.Lock()
+
+    # Kết quả trung gian: một queue + một thread đọc cho mọi ProgressChannel của worker
+    _progress_queue: Any = None
+    _progress_reader: Optional[threading.Thread] = None
+    _channels: Dict[int, ProgressChannel] = {}
+    _channel_ids = itertools.count(1)
+
+    @classmethod
+    def get_max_workers(cls) -> int:
+        """Số process (settings.TOUR_SOLVER_WORKERS, 0 = số CPU)"""
+        return settings.TOUR_SOLVER_WORKERS or os.cpu_count() or 1
+
+    @classmethod
+    def get_executor(cls) -> ProcessPoolExecutor:
+        """Lấy executor hiện tại, tạo mới nếu chưa có"""
+        executor = cls._executor
+        if executor is not None:
+            return executor
+
+        with cls._lock:
+            if cls._executor is None:
+                cls._max_workers = cls.get_max_workers()
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=cls._max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                print(f"DEBUG: Solver pool started with {cls._max_workers} processes")
+            return cls._executor
+
+    @classmethod
+    def get_manager(cls) -> SyncManager:
+        """Manager process ('spawn') của worker, tạo nếu chưa có"""
+        with cls._lock:
+            if cls._manager is None:
+                cls._manager = multiprocessing.get_context('spawn').Manager()
+            return cls._manager
+
+    @classmethod
+    def get_progress_queue(cls) -> Any:
+        """Queue chung của mọi ProgressChannel, khởi động thread đọc nếu chưa có"""
+        manager = cls.get_manager()
+        with cls._lock:
+            if cls._progress_queue is None:
+                cls._progress_queue = manager.Queue()
+                cls._progress_reader = threading.Thread(
+                    target=cls._read_progress, args=(cls._progress_queue,),
+                    name='solver-progress-reader', daemon=True
+                )
+                cls._progress_reader.start()
+            return cls._progress_queue
+
+    @classmethod
+    def open_channel(cls, loop: asyncio.AbstractEventLoop) -> ProgressChannel:
+        """
+        Channel nhận kết quả trung gian của một task (truyền channel.reporter vào task)
+
+        Lần đầu khởi động Manager process => gọi trong threadpool, không gọi trên event loop
+        """
+        reporter = ProgressReporter(cls.get_progress_queue(), next(cls._channel_ids))
+        channel = ProgressChannel(reporter, loop)
+        with cls._lock:
+            cls._channels[reporter.channel_id] = channel
+        return channel
+
+    @classmethod
+    def close_channel(cls, channel: ProgressChannel) -> None:
+        """Bỏ đăng ký (kết quả tới sau đó bị bỏ qua)"""
+        with cls._lock:
+            cls._channels.pop(channel.reporter.channel_id, None)
+
+    @classmethod
+    def _read_progress(cls, queue: Any) -> None:
+        """Thread đọc: chuyển (channel_id, item) tới channel đang mở, None = dừng"""
+        while True:
+            try:
+                message = queue.get()
+            except (EOFError, OSError) as e:
+                print(f"ERROR: Progress reader stopped: {str(e)}")
+                return
+            if message is None:
+                return
+            channel_id, item = message
+            with cls._lock:
+                channel = cls._channels.get(channel_id)
+            if channel is None:
+                continue
+            try:
+                channel.deliver(item)
+            except RuntimeError:
+                # Event loop của request đã đóng
+                cls.close_channel(channel)
+
+    @classmethod
+    def get_capacity(cls) -> int:
+        """Số task tối đa đang chạy + đang chờ"""
+        return cls.get_max_workers() + settings.TOUR_SOLVER_MAX_QUEUE
+
+    @classmethod
+    def in_flight(cls) -> int:
+        return cls._in_flight
+
+    @classmethod
+    def submit(cls, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Gửi một task vào pool
+
+        Raises:
+            SolverPoolOverloaded: Pool đã đầy, task không được nhận
+        """
+        executor = cls.get_executor()
+        capacity = cls.get_capacity()
+        with cls._lock:
+            if cls._in_flight >= capacity:
+                raise SolverPoolOverloaded(cls._in_flight, capacity)
+            cls._in_flight += 1
+
+        try:
+            try:
+                future = executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # Một process con bị kill (OOM, ...) => tạo pool mới và thử lại một lần
+                print("ERROR: Solver pool is broken, restarting")
+                cls.shutdown(wait=False)
+                future = cls.get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            cls._release()
+            raise
+
+        future.add_done_callback(cls._release)
+        return future
+
+    @classmethod
+    def _release(cls, future: Optional[Future] = None) -> None:
+        with cls._lock:
+            cls._in_flight -= 1
+
+    @classmethod
+    def warm_up(
+        cls,
+        modules: Tuple[str, ...] = ('app.services.tour_recommendation_service',),
+        timeout: Optional[float] = None
+    ) -> None:
+        """
+        Khởi động sẵn tất cả process và import trước các module cần thiết
+
+        Process 'spawn' mất vài giây để khởi động - gọi lúc startup để request
+        đầu tiên không phải chờ. Manager process + thread đọc của streaming cũng được tạo luôn.
+        """
+        executor = cls.get_executor()
+        futures = [executor.submit(_import_modules, modules) for _ in range(cls._max_workers)]
+        cls.get_progress_queue()
+        wait_futures(futures, timeout=timeout)
+
+    @classmethod
+    def shutdown(cls, wait: bool = True) -> None:
+        """Dừng pool (các task đang chờ bị hủy)"""
+        with cls._lock:
+            executor, cls._executor = cls._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    @classmethod
+    def shutdown_manager(cls) -> None:
+        """Dừng thread đọc và Manager process của streaming (nếu đã tạo)"""
+        with cls._lock:
+            manager, cls._manager = cls._manager, None
+            queue, cls._progress_queue = cls._progress_queue, None
+            reader, cls._progress_reader = cls._progress_reader, None
+            cls._channels.clear()
+        if queue is not None:
+            try:
+                queue.put(None)
+            except Exception as e:
+                print(f"ERROR: Cannot stop progress reader: {str(e)}")
+        if reader is not None:
+            reader.join(timeout=5)
+        if manager is not None:
+            manager.shutdown()
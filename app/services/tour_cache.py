@@ -0,0 +1,154 @@
+"""
+==============================================================================
+TOUR RESULT CACHE - Cache kết quả gợi ý tour (LRU + TTL) trong mỗi worker
+==============================================================================
+- Key: hash của request đã chuẩn hóa (type, preference, budget, thời gian, số địa điểm,
+  giờ bắt đầu, tọa độ xuất phát làm tròn) + version của catalog snapshot
+- Catalog đổi version (reload) => xóa toàn bộ cache, không trả lộ trình cũ
+- Chỉ cache kết quả thành công và không phụ thuộc user (không có CF)
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+
+class TourResultCache:
+    """Cache LRU + TTL dùng chung cho các request trong worker hiện tại"""
+
+    # Điểm xuất phát mặc định (trung tâm Sài Gòn) - request không có start_location
+    DEFAULT_START = (10.7769, 106.7009)
+    COORDINATE_DECIMALS = 4  # ~11m
+
+    # key -> (expires_at, result)
+    _entries: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+    _catalog_version: Optional[int] = None
+    _hits: int = 0
+    _misses: int = 0
+    _evictions: int = 0
+    _expirations: int = 0
+    _lock = threading.Lock()
+
+    @staticmethod
+    def enabled() -> bool:
+        return settings.TOUR_CACHE_SIZE > 0 and settings.TOUR_CACHE_TTL_SECONDS > 0
+
+    @classmethod
+    def normalize_request(
+        cls,
+        user_profile: Dict,
+        start_location: Optional[Dict] = None,
+        start_time: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Chuẩn hóa các trường ảnh hưởng tới kết quả (cùng cách so sánh với ScoringEngine)
+
+        - type / preference: không phân biệt hoa thường, preference là tập (bỏ trùng, sắp xếp)
+        - max_locations: tối đa 6 như khi tạo tour
+        - Không có start_location = điểm xuất phát mặc định; tọa độ làm tròn
+        """
+        user_type = user_profile.get('type') or ''
+        user_type = getattr(user_type, 'value', user_type)
+        if start_location:
+            start = (start_location.get('latitude', cls.DEFAULT_START[0]),
+                     start_location.get('longitude', cls.DEFAULT_START[1]))
+        else:
+            start = cls.DEFAULT_START
+
+        return {
+            'type': str(user_type).lower(),
+            'preference': sorted({str(p).lower() for p in user_profile.get('preference', []) or []}),
+            'budget': user_profile.get('budget'),
+            'time_available': user_profile.get('time_available'),
+            'max_locations': min(user_profile.get('max_locations', 5), 6),
+            'num_days': max(1, int(user_profile.get('num_days') or 1)),
+            'num_alternatives': max(1, int(user_profile.get('num_alternatives') or 1)),
+            'start': [round(float(coord), cls.COORDINATE_DECIMALS) for coord in start],
+            'start_time': start_time or settings.TOUR_START_TIME,
+        }
+
+    @classmethod
+    def make_key(
+        cls,
+        user_profile: Dict,
+        start_location: Optional[Dict] = None,
+        start_time: Optional[str] = None,
+        catalog_version: int = 0
+    ) -> str:
+        """Hash ổn định của request đã chuẩn hóa + catalog version"""
+        normalized = cls.normalize_request(user_profile, start_location, start_time)
+        normalized['catalog_version'] = catalog_version
+        payload = json.dumps(normalized, sort_keys=True, ensure_ascii=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _check_version(cls, catalog_version: int) -> None:
+        """Catalog đổi version => bỏ toàn bộ kết quả cũ (gọi khi đang giữ lock)"""
+        if cls._catalog_version != catalog_version:
+            if cls._entries:
+                print(f"DEBUG: Catalog v{catalog_version} loaded, clearing {len(cls._entries)} cached tours")
+            cls._entries.clear()
+            cls._catalog_version = catalog_version
+
+    @classmethod
+    def get(cls, key: str, catalog_version: int) -> Optional[Dict]:
+        """Lấy bản sao kết quả đã cache (None nếu không có / hết hạn)"""
+        with cls._lock:
+            cls._check_version(catalog_version)
+            entry = cls._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del cls._entries[key]
+                cls._expirations += 1
+                entry = None
+            if entry is None:
+                cls._misses += 1
+                return None
+            cls._entries.move_to_end(key)
+            cls._hits += 1
+            result = entry[1]
+        return copy.deepcopy(result)
+
+    @classmethod
+    def put(cls, key: str, catalog_version: int, result: Dict) -> None:
+        """Lưu kết quả (bỏ qua nếu tính trên catalog cũ hơn catalog hiện tại)"""
+        if not result.get('success'):
+            return
+        result = copy.deepcopy(result)
+        with cls._lock:
+            if cls._catalog_version is not None and catalog_version < cls._catalog_version:
+                return
+            cls._check_version(catalog_version)
+            cls._entries[key] = (time.monotonic() + settings.TOUR_CACHE_TTL_SECONDS, result)
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > settings.TOUR_CACHE_SIZE:
+                cls._entries.popitem(last=False)
+                cls._evictions += 1
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._entries.clear()
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """Thống kê hit / miss của cache trong worker hiện tại"""
+        with cls._lock:
+            lookups = cls._hits + cls._misses
+            return {
+                'enabled': cls.enabled(),
+                'size': len(cls._entries),
+                'capacity': settings.TOUR_CACHE_SIZE,
+                'ttl_seconds': settings.TOUR_CACHE_TTL_SECONDS,
+                'catalog_version': cls._catalog_version,
+                'hits': cls._hits,
+                'misses': cls._misses,
+                'hit_rate': round(cls._hits / lookups, 3) if lookups else 0.0,
+                'evictions': cls._evictions,
+                'expirations': cls._expirations,
+            }
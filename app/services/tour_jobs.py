@@ -0,0 +1,615 @@
+"""
+==============================================================================
+TOUR JOBS - Gợi ý tour chạy nền (submit => poll trạng thái => lấy kết quả)
+==============================================================================
+Cho các request cần giải lâu (nhiều địa điểm, nhiều ngày, ...) mà không giữ kết nối HTTP:
+- TourJobStore: trạng thái + kết quả job, giữ TOUR_JOB_TTL_SECONDS sau khi job kết thúc.
+  Mặc định trong bộ nhớ của worker; đặt TOUR_JOB_DB_PATH để lưu vào SQLite (dùng chung
+  giữa các worker trên cùng máy - cần khi chạy nhiều worker)
+- TourJobManager: TOUR_JOB_WORKERS thread chạy job, mỗi thread giữ một process giải riêng
+  ('spawn') => hủy job đang chạy = dừng hẳn process đó (tạo lại khi có job tiếp theo)
+- Job đang chờ / đang chạy được worker sở hữu cập nhật heartbeat_at định kỳ; worker chết /
+  restart giữa chừng => heartbeat cũ quá TOUR_JOB_STALE_SECONDS => job bị đánh dấu failed
+"""
+
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.tour_recommendation_service import Deadline, TourRecommendationService
+
+
+class TourJobQueueFull(Exception):
+    """Đã có quá nhiều job đang chờ / đang chạy"""
+
+    def __init__(self, pending: int, capacity: int):
+        self.pending = pending
+        self.capacity = capacity
+        self.retry_after = max(1, int(settings.TOUR_JOB_LATENCY_BUDGET_MS / 1000))
+        super().__init__(f"Tour job queue full ({pending}/{capacity} jobs)")
+
+
+class TourJobCancelled(Exception):
+    """Job bị hủy trong lúc chạy"""
+
+
+def _solver_process_main(conn) -> None:
+    """Vòng lặp của process giải job: nhận (fn, args), trả về ('ok', result) | ('error', message)"""
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        fn, args = task
+        try:
+            conn.send(('ok', fn(*args)))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {str(e)}"))
+
+
+class SolverProcess:
+    """Process riêng của một thread chạy job (dừng được bất cứ lúc nào)"""
+
+    POLL_SECONDS = 0.2  # Chu kỳ kiểm tra yêu cầu hủy trong lúc chờ kết quả
+
+    def __init__(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_solver_process_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, fn: Callable, args: Tuple, should_cancel: Callable[[], bool]) -> Any:
+        """
+        Chạy fn(*args) trong process, chờ kết quả
+
+        Raises:
+            TourJobCancelled: should_cancel() trả về True (process đã bị dừng)
+            RuntimeError: fn lỗi hoặc process chết giữa chừng
+        """
+        self.conn.send((fn, args))
+        while not self.conn.poll(self.POLL_SECONDS):
+            if should_cancel():
+                self.terminate()
+                raise TourJobCancelled()
+        try:
+            status, value = self.conn.recv()
+        except EOFError:
+            self.terminate()
+            raise RuntimeError('Process giải job bị dừng bất thường')
+        if status == 'error':
+            raise RuntimeError(value)
+        return value
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def terminate(self) -> None:
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(5)
+        self.conn.close()
+
+    def close(self) -> None:
+        """Dừng process sau khi gửi tín hiệu kết thúc"""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        self.terminate()
+
+
+# ==============================================================================
+# JOB STORE - Trạng thái và kết quả job (bộ nhớ hoặc SQLite)
+# ==============================================================================
+
+class TourJobStore:
+    """
+    Lưu job dạng dict: {job_id, status, owner, created_at, heartbeat_at, started_at, finished_at,
+    expires_at, cancel_requested, result, error} (thời gian là epoch giây)
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    ACTIVE_STATUSES = (QUEUED, RUNNING)
+    STALE_ERROR = 'Worker chạy job đã dừng trước khi job kết thúc'
+
+    _jobs: Dict[str, Dict] = {}
+    _lock = threading.Lock()
+    _initialized_paths: set = set()
+
+    @staticmethod
+    def get_db_path() -> Optional[str]:
+        return settings.TOUR_JOB_DB_PATH or None
+
+    @classmethod
+    def _connect(cls, path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=5)
+        if path not in cls._initialized_paths:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tour_jobs ("
+                "job_id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                "expires_at REAL, heartbeat_at REAL, payload TEXT NOT NULL)"
+            )
+            # File tạo trước khi có heartbeat: thêm cột (job cũ heartbeat NULL => bị coi là mồ côi)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(tour_jobs)")}
+            if 'heartbeat_at' not in columns:
+                conn.execute("ALTER TABLE tour_jobs ADD COLUMN heartbeat_at REAL")
+            conn.commit()
+            cls._initialized_paths.add(path)
+        return conn
+
+    @classmethod
+    def save(cls, job: Dict) -> None:
+        path = cls.get_db_path()
+        if path is None:
+            with cls._lock:
+                cls._jobs[job['job_id']] = dict(job)
+            return
+        with cls._lock:
+            conn = cls._connect(path)
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tour_jobs (job_id, status, expires_at, heartbeat_at, payload) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (job['job_id'], job['status'], job['expires_at'], job.get('heartbeat_at'),
+                     json.dumps(job, default=str))
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    @staticmethod
+    def _load(row: Tuple) -> Dict:
+        """(payload, heartbeat_at) => job (heartbeat chỉ được cập nhật ở cột riêng)"""
+        job = json.loads(row[0])
+        job['heartbeat_at'] = row[1]
+        return job
+
+    @classmethod
+    def _read(cls, job_id: str) -> Optional[Dict]:
+        path = cls.get_db_path()
+        with cls._lock:
+            if path is None:
+                job = cls._jobs.get(job_id)
+                return dict(job) if job is not None else None
+            conn = cls._connect(path)
+            try:
+                row = conn.execute(
+                    "SELECT payload, heartbeat_at FROM tour_jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()
+            finally:
+                conn.close()
+        return cls._load(row) if row else None
+
+    @classmethod
+    def get(cls, job_id: str) -> Optional[Dict]:
+        """Bản sao job (None nếu không có / đã hết hạn); job mồ côi được đánh dấu failed trước"""
+        job = cls._read(job_id)
+        if job is not None and cls.is_stale(job, time.time()):
+            cls.reap_stale()
+            job = cls._read(job_id)
+        if job is not None and job['expires_at'] is not None and job['expires_at'] < time.time():
+            return None
+        return job
+
+    @classmethod
+    def is_stale(cls, job: Dict, now: float) -> bool:
+        """Job đang chờ / đang chạy nhưng worker sở hữu không còn cập nhật heartbeat"""
+        return (
+            job['status'] in cls.ACTIVE_STATUSES
+            and (job.get('heartbeat_at') or 0) < now - settings.TOUR_JOB_STALE_SECONDS
+        )
+
+    @classmethod
+    def _stale_fields(cls, now: float) -> Dict:
+        return {
+            'status': cls.FAILED,
+            'finished_at': now,
+            'expires_at': now + settings.TOUR_JOB_TTL_SECONDS,
+            'error': cls.STALE_ERROR,
+        }
+
+    @classmethod
+    def update(cls, job_id: str, **fields) -> Optional[Dict]:
+        """Cập nhật một số trường của job trong một transaction (None nếu job không còn)"""
+        path = cls.get_db_path()
+        with cls._lock:
+            if path is None:
+                job = cls._jobs.get(job_id)
+                if job is None:
+                    return None
+                job.update(fields)
+                return dict(job)
+            conn = cls._connect(path)
+            try:
+                conn.execute("BEGIN IMMEDIATE")  # Không để worker khác ghi xen giữa đọc và ghi
+                row = conn.execute(
+                    "SELECT payload, heartbeat_at FROM tour_jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()
+                if row is None:
+                    conn.rollback()
+                    return None
+                job = cls._load(row)
+                job.update(fields)
+                conn.execute(
+                    "UPDATE tour_jobs SET status = ?, expires_at = ?, heartbeat_at = ?, payload = ? WHERE job_id = ?",
+                    (job['status'], job['expires_at'], job['heartbeat_at'], json.dumps(job, default=str), job_id)
+                )
+                conn.commit()
+                return job
+            finally:
+                conn.close()
+
+    @classmethod
+    def delete(cls, job_id: str) -> None:
+        path = cls.get_db_path()
+        with cls._lock:
+            if path is None:
+                cls._jobs.pop(job_id, None)
+                return
+            conn = cls._connect(path)
+            try:
+                conn.execute("DELETE FROM tour_jobs WHERE job_id = ?", (job_id,))
+                conn.commit()
+            finally:
+                conn.close()
+
+    @classmethod
+    def touch(cls, job_ids: List[str]) -> None:
+        """Heartbeat: worker sở hữu các job này vẫn sống"""
+        now = time.time()
+        path = cls.get_db_path()
+        with cls._lock:
+            if path is None:
+                for job_id in job_ids:
+                    job = cls._jobs.get(job_id)
+                    if job is not None and job['status'] in cls.ACTIVE_STATUSES:
+                        job['heartbeat_at'] = now
+                return
+            conn = cls._connect(path)
+            try:
+                conn.executemany(
+                    "UPDATE tour_jobs SET heartbeat_at = ? WHERE job_id = ? AND status IN (?, ?)",
+                    [(now, job_id) + cls.ACTIVE_STATUSES for job_id in job_ids]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    @classmethod
+    def reap_stale(cls) -> int:
+        """Đánh dấu failed (có hạn xóa) các job mà worker sở hữu đã chết, trả về số job"""
+        now = time.time()
+        fields = cls._stale_fields(now)
+        path = cls.get_db_path()
+        with cls._lock:
+            if path is None:
+                stale = [job for job in cls._jobs.values() if cls.is_stale(job, now)]
+                for job in stale:
+                    job.update(fields)
+            else:
+                conn = cls._connect(path)
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    rows = conn.execute(
+                        "SELECT payload, heartbeat_at FROM tour_jobs WHERE status IN (?, ?) "
+                        "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                        cls.ACTIVE_STATUSES + (now - settings.TOUR_JOB_STALE_SECONDS,)
+                    ).fetchall()
+                    stale = [cls._load(row) for row in rows]
+                    for job in stale:
+                        job.update(fields)
+                        conn.execute(
+                            "UPDATE tour_jobs SET status = ?, expires_at = ?, payload = ? WHERE job_id = ?",
+                            (job['status'], job['expires_at'], json.dumps(job, default=str), job['job_id'])
+                        )
+                    conn.commit()
+                finally:
+                    conn.close()
+        for job in stale:
+            print(f"DEBUG: Tour job {job['job_id']} failed (owner {job.get('owner')} stopped)")
+        return len(stale)
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        """Xóa job đã kết thúc quá TTL (job mồ côi được đánh dấu failed trước), trả về số job bị xóa"""
+        cls.reap_stale()
+        now = time.time()
+        path = cls.get_db_path()
+        with cls._lock:
+            if path is None:
+                expired = [
+                    job_id for job_id, job in cls._jobs.items()
+                    if job['expires_at'] is not None and job['expires_at'] < now
+                ]
+                for job_id in expired:
+                    del cls._jobs[job_id]
+                return len(expired)
+            conn = cls._connect(path)
+            try:
+                deleted = conn.execute(
+                    "DELETE FROM tour_jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)
+                ).rowcount
+                conn.commit()
+            finally:
+                conn.close()
+            return deleted
+
+    @classmethod
+    def count_active(cls) -> int:
+        """Số job đang chờ / đang chạy (không tính job mồ côi)"""
+        cls.reap_stale()
+        path = cls.get_db_path()
+        with cls._lock:
+            if path is None:
+                return sum(1 for job in cls._jobs.values() if job['status'] in cls.ACTIVE_STATUSES)
+            conn = cls._connect(path)
+            try:
+                return conn.execute(
+                    "SELECT COUNT(*) FROM tour_jobs WHERE status IN (?, ?)", cls.ACTIVE_STATUSES
+                ).fetchone()[0]
+            finally:
+                conn.close()
+
+    @classmethod
+    def clear(cls) -> None:
+        """Xóa mọi job (bộ nhớ và bảng tour_jobs nếu dùng SQLite)"""
+        path = cls.get_db_path()
+        with cls._lock:
+            cls._jobs.clear()
+            if path is None:
+                return
+            conn = cls._connect(path)
+            try:
+                conn.execute("DELETE FROM tour_jobs")
+                conn.commit()
+            finally:
+                conn.close()
+
+
+# ==============================================================================
+# JOB MANAGER - Nhận job, chạy trong thread + process riêng, hủy job
+# ==============================================================================
+
+class TourJobManager:
+    """Quản lý các thread chạy job của worker hiện tại"""
+
+    _executor: Optional[ThreadPoolExecutor] = None
+    _cancel_events: Dict[str, threading.Event] = {}
+    _local = threading.local()  # SolverProcess của từng thread chạy job
+    _processes: list = []
+    _lock = threading.Lock()
+    _heartbeat_thread: Optional[threading.Thread] = None
+    _heartbeat_stop = threading.Event()
+
+    @staticmethod
+    def get_owner() -> str:
+        """Định danh worker hiện tại (máy + pid)"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=max(1, settings.TOUR_JOB_WORKERS), thread_name_prefix='tour-job'
+                )
+                cls._heartbeat_stop.clear()
+                cls._heartbeat_thread = threading.Thread(
+                    target=cls._heartbeat_loop, name='tour-job-heartbeat', daemon=True
+                )
+                cls._heartbeat_thread.start()
+            return cls._executor
+
+    @classmethod
+    def _heartbeat_loop(cls) -> None:
+        """Cập nhật heartbeat_at của các job worker này đang giữ (đang chờ / đang chạy)"""
+        while not cls._heartbeat_stop.wait(settings.TOUR_JOB_HEARTBEAT_SECONDS):
+            with cls._lock:
+                job_ids = list(cls._cancel_events)
+            if not job_ids:
+                continue
+            try:
+                TourJobStore.touch(job_ids)
+            except Exception as e:
+                print(f"ERROR: Tour job heartbeat failed: {str(e)}")
+
+    @classmethod
+    def submit(
+        cls,
+        params: Dict,
+        session_factory: Optional[Callable[[], Any]] = None
+    ) -> Dict:
+        """
+        Tạo job và đưa vào hàng đợi
+
+        Args:
+            params: {'user_profile', 'start_location', 'user_id', 'use_cf',
+                     'latency_budget_ms', 'start_time'} như get_tour_recommendations
+            session_factory: Tạo db session cho job (None = SessionLocal) - session của
+                request đã đóng khi job chạy
+
+        Raises:
+            TourJobQueueFull: Đã có TOUR_JOB_MAX_PENDING job đang chờ / đang chạy
+        """
+        TourJobStore.purge_expired()
+        pending = TourJobStore.count_active()
+        if pending >= settings.TOUR_JOB_MAX_PENDING:
+            raise TourJobQueueFull(pending, settings.TOUR_JOB_MAX_PENDING)
+
+        now = time.time()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'status': TourJobStore.QUEUED,
+            'owner': cls.get_owner(),
+            'created_at': now,
+            'heartbeat_at': now,
+            'started_at': None,
+            'finished_at': None,
+            'expires_at': None,
+            'cancel_requested': False,
+            'result': None,
+            'error': None,
+        }
+        TourJobStore.save(job)
+        with cls._lock:
+            cls._cancel_events[job['job_id']] = threading.Event()
+        cls.get_executor().submit(cls._run, job['job_id'], params, session_factory)
+        print(f"DEBUG: Tour job {job['job_id']} queued ({pending + 1} pending)")
+        return job
+
+    @classmethod
+    def cancel(cls, job_id: str) -> Optional[Dict]:
+        """
+        Hủy job đang chờ / đang chạy (process giải bị dừng); job đã kết thúc thì xóa khỏi store
+
+        Returns:
+            Job sau khi hủy / trước khi xóa (None nếu không có)
+        """
+        job = TourJobStore.get(job_id)
+        if job is None:
+            return None
+        if job['status'] not in TourJobStore.ACTIVE_STATUSES:
+            TourJobStore.delete(job_id)
+            return job
+
+        job = TourJobStore.update(job_id, cancel_requested=True) or job
+        event = cls._cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+        return job
+
+    @classmethod
+    def _is_cancelled(cls, job_id: str) -> bool:
+        """Hủy từ worker này (Event) hoặc từ worker khác qua SQLite"""
+        event = cls._cancel_events.get(job_id)
+        if event is not None and event.is_set():
+            return True
+        if TourJobStore.get_db_path() is not None:
+            job = TourJobStore.get(job_id)
+            return job is None or job['cancel_requested']
+        return False
+
+    @classmethod
+    def _get_process(cls) -> SolverProcess:
+        process = getattr(cls._local, 'process', None)
+        if process is None or not process.is_alive():
+            process = SolverProcess()
+            cls._local.process = process
+            with cls._lock:
+                cls._processes.append(process)
+        return process
+
+    @classmethod
+    def _finish(cls, job_id: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None) -> None:
+        now = time.time()
+        TourJobStore.update(
+            job_id,
+            status=status,
+            finished_at=now,
+            expires_at=now + settings.TOUR_JOB_TTL_SECONDS,
+            result=result,
+            error=error
+        )
+        print(f"DEBUG: Tour job {job_id} {status}")
+
+    @classmethod
+    def _run(cls, job_id: str, params: Dict, session_factory: Optional[Callable[[], Any]]) -> None:
+        """Chạy một job trong thread của executor: chuẩn bị tại chỗ, tối ưu trong SolverProcess"""
+        db = None
+        try:
+            if cls._is_cancelled(job_id):
+                cls._finish(job_id, TourJobStore.CANCELLED)
+                return
+            TourJobStore.update(job_id, status=TourJobStore.RUNNING, started_at=time.time())
+
+            # Budget của job tính từ lúc bắt đầu chạy (không tính thời gian chờ)
+            deadline = Deadline(params.get('latency_budget_ms') or settings.TOUR_JOB_LATENCY_BUDGET_MS)
+            request_args = (
+                params['user_profile'], params.get('start_location'), params.get('user_id'),
+                params.get('use_cf', True), params.get('start_time')
+            )
+            result = TourRecommendationService.get_cached_result(*request_args, deadline)
+            if result is None:
+                if session_factory is None:
+                    from app.db.database import SessionLocal
+                    session_factory = SessionLocal
+                db = session_factory()
+                prepared = TourRecommendationService.prepare_tour_request(
+                    db, params['user_profile'], params.get('start_location'), params.get('user_id'),
+                    params.get('use_cf', True), params.get('start_time')
+                )
+                if not prepared['success']:
+                    cls._finish(job_id, TourJobStore.FAILED, error=prepared['message'])
+                    return
+
+                result = cls._get_process().run(
+                    TourRecommendationService.solve_route,
+                    (
+                        prepared['destinations'],
+                        prepared['user_profile'],
+                        prepared['start_location'],
+                        prepared['matrices'],
+                        deadline,
+                        prepared['optional_nodes']
+                    ),
+                    lambda: cls._is_cancelled(job_id)
+                )
+                result = TourRecommendationService.finalize_result(result, prepared, deadline)
+                TourRecommendationService.cache_result(
+                    result, prepared, params.get('start_location'), params.get('start_time')
+                )
+
+            if result.get('success'):
+                cls._finish(job_id, TourJobStore.SUCCEEDED, result=result)
+            else:
+                cls._finish(job_id, TourJobStore.FAILED, error=result.get('message', 'Không thể tạo tour'))
+        except TourJobCancelled:
+            cls._finish(job_id, TourJobStore.CANCELLED)
+        except Exception as e:
+            print(f"ERROR: Tour job {job_id} failed: {str(e)}")
+            cls._finish(job_id, TourJobStore.FAILED, error=str(e))
+        finally:
+            if db is not None:
+                db.close()
+            with cls._lock:
+                cls._cancel_events.pop(job_id, None)
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Dừng các thread và process chạy job (job đang chờ bị hủy, không để 'queued' mãi)"""
+        with cls._lock:
+            executor, cls._executor = cls._executor, None
+            processes, cls._processes = cls._processes, []
+            job_ids = list(cls._cancel_events)
+            for event in cls._cancel_events.values():
+                event.set()
+        cls._heartbeat_stop.set()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # Job bị bỏ khỏi hàng đợi không bao giờ chạy _run => kết thúc tại đây
+        for job_id in job_ids:
+            job = TourJobStore.get(job_id)
+            if job is not None and job['status'] == TourJobStore.QUEUED:
+                cls._finish(job_id, TourJobStore.CANCELLED, error='Worker dừng trước khi job chạy')
+
+        # Job đang chạy: process bị dừng => _run kết thúc job; worker bị kill trước đó thì
+        # heartbeat ngừng và worker khác đánh dấu failed sau TOUR_JOB_STALE_SECONDS
+        for process in processes:
+            process.close()
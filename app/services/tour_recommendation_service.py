@@ -10,16 +10,31 @@ Service tích hợp các thành phần:
 - Tạo tour recommendations
 """
 
+import asyncio
+import copy
 import json
 import math
+import os
+import shutil
+import time
+from concurrent.futures import Future, wait
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from typing import List, Dict, Tuple, Any, Optional
+from typing import List, Dict, Tuple, Any, Optional, Awaitable, AsyncIterator, Callable
+import numpy as np
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
 
-from app.models.destination import Destination
-from app.services.collaborative_filtering_service import CollaborativeFilteringService
+from app.core.config import settings
+from app.services.collaborative_filtering_service import CollaborativeFilteringService, CFModelStore
+from app.services.destination_catalog import (
+    CatalogSnapshot, DestinationCatalog, DestinationFeatureStore, OpeningHours
+)
+from app.services.single_flight import AsyncSingleFlight, SingleFlight
+from app.services.solver_pool import SolverPool, SolverPoolOverloaded
+from app.services.tour_cache import TourResultCache
 
 
 # ==============================================================================
@@ -89,12 +104,153 @@ class ScoringEngine:
         
         return round(score, 3)
     
+    @classmethod
+    def calculate_scores_batch(
+        cls,
+        user: Dict,
+        features: DestinationFeatureStore
+    ) -> np.ndarray:
+        """
+        Tính điểm cho tất cả địa điểm trong feature store bằng một lần vector hóa
+        
+        Cho kết quả giống hệt calculate_score() áp dụng cho từng địa điểm
+        (cùng thứ tự phép tính, cùng cách làm tròn).
+        
+        Args:
+            user: User profile {type, preference, budget, time_available}
+            features: DestinationFeatureStore của danh sách địa điểm
+            
+        Returns:
+            np.ndarray: Điểm (0.0 - 1.0) theo thứ tự hàng của feature store
+        """
+        # 1. Type matching (30%) - chỉ so khớp chuỗi trên các loại duy nhất
+        user_type = user.get('type', '').lower()
+        type_match = np.array(
+            [user_type in t or t in user_type for t in features.type_vocab],
+            dtype=bool
+        )
+        score = np.where(type_match[features.type_codes], cls.WEIGHTS['type'], 0.0)
+        
+        # 2. Tag similarity (40%) - Jaccard qua ma trận membership
+        user_prefs = set([p.lower() for p in user.get('preference', [])])
+        if user_prefs:
+            cols = [features.tag_index[p] for p in user_prefs if p in features.tag_index]
+            intersection = features.tag_matrix[:, cols].sum(axis=1)
+            union = len(user_prefs) + features.tag_counts - intersection
+            has_tags = features.tag_counts > 0
+            tag_similarity = np.divide(
+                intersection, union,
+                out=np.zeros(features.size, dtype=np.float64),
+                where=has_tags
+            )
+            score = np.where(has_tags, score + cls.WEIGHTS['tags'] * tag_similarity, score)
+        
+        # 3. Price fit (20%)
+        price = features.prices
+        budget = user.get('budget', float('inf'))
+        if budget > 0:
+            score = score + np.select(
+                [price <= budget * 0.3, price <= budget * 0.5, price <= budget],
+                [cls.WEIGHTS['price'], cls.WEIGHTS['price'] * 0.8, cls.WEIGHTS['price'] * 0.5],
+                default=0.0
+            )
+        else:
+            score = score + cls.WEIGHTS['price'] * 0.5
+        
+        # 4. Time fit (10%)
+        time_available = user.get('time_available', 480) * 60  # Convert to minutes
+        if time_available > 0:
+            time_ratio = np.minimum(features.visit_times / time_available, 1.0)
+            score = score + cls.WEIGHTS['time_fit'] * (1 - time_ratio * 0.5)
+        
+        return cls.round_scores(score)
+    
+    @classmethod
+    def calculate_scores_matrix(
+        cls,
+        users: List[Dict],
+        features: DestinationFeatureStore
+    ) -> np.ndarray:
+        """
+        Tính điểm cho nhiều user profile cùng lúc (batch request)
+        
+        Mỗi hàng giống hệt calculate_scores_batch(users[i], features): tag similarity
+        của mọi profile là một phép nhân ma trận (profiles x tags) @ (tags x địa điểm).
+        
+        Returns:
+            np.ndarray (len(users), features.size)
+        """
+        n_users = len(users)
+        
+        # 1. Type matching (30%)
+        user_types = [user.get('type', '').lower() for user in users]
+        type_match = np.array(
+            [[user_type in t or t in user_type for t in features.type_vocab] for user_type in user_types],
+            dtype=bool
+        ).reshape(n_users, len(features.type_vocab))
+        score = np.where(type_match[:, features.type_codes], cls.WEIGHTS['type'], 0.0)
+        
+        # 2. Tag similarity (40%)
+        user_prefs = [set([p.lower() for p in user.get('preference', [])]) for user in users]
+        pref_matrix = np.zeros((n_users, len(features.tag_index)), dtype=np.int64)
+        for row, prefs in enumerate(user_prefs):
+            pref_matrix[row, [features.tag_index[p] for p in prefs if p in features.tag_index]] = 1
+        intersection = pref_matrix @ features.tag_matrix.T.astype(np.int64)
+        pref_counts = np.array([len(prefs) for prefs in user_prefs], dtype=np.int64)[:, None]
+        union = pref_counts + features.tag_counts[None, :] - intersection
+        has_tags = (pref_counts > 0) & (features.tag_counts[None, :] > 0)
+        tag_similarity = np.divide(
+            intersection, union,
+            out=np.zeros(score.shape, dtype=np.float64),
+            where=has_tags
+        )
+        score = np.where(has_tags, score + cls.WEIGHTS['tags'] * tag_similarity, score)
+        
+        # 3. Price fit (20%)
+        price = features.prices[None, :]
+        budget = np.array([user.get('budget', float('inf')) for user in users], dtype=np.float64)[:, None]
+        price_fit = np.select(
+            [price <= budget * 0.3, price <= budget * 0.5, price <= budget],
+            [cls.WEIGHTS['price'], cls.WEIGHTS['price'] * 0.8, cls.WEIGHTS['price'] * 0.5],
+            default=0.0
+        )
+        score = np.where(budget > 0, score + price_fit, score + cls.WEIGHTS['price'] * 0.5)
+        
+        # 4. Time fit (10%)
+        time_available = np.array(
+            [user.get('time_available', 480) * 60 for user in users], dtype=np.float64
+        )[:, None]
+        time_ratio = np.minimum(
+            features.visit_times[None, :] / np.where(time_available > 0, time_available, 1.0), 1.0
+        )
+        score = np.where(
+            time_available > 0, score + cls.WEIGHTS['time_fit'] * (1 - time_ratio * 0.5), score
+        )
+        
+        return cls.round_scores(score)
+    
+    @staticmethod
+    def round_scores(score: np.ndarray) -> np.ndarray:
+        """
+        Làm tròn 3 chữ số giống hệt round() của Python trong calculate_score
+        
+        np.rint chỉ có thể khác round() khi giá trị sát mức .5 (sai số khi nhân 1000)
+        => chỉ các phần tử đó dùng round() của Python.
+        """
+        scaled = score * 1000
+        rounded = np.rint(scaled) / 1000
+        near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+        if near_half.any():
+            rounded[near_half] = [round(s, 3) for s in score[near_half].tolist()]
+        return rounded
+    
     @classmethod
     def rank_destinations(
         cls,
         user: Dict,
         destinations: List[Dict],
-        top_n: Optional[int] = None
+        top_n: Optional[int] = None,
+        features: Optional[DestinationFeatureStore] = None
     ) -> List[Tuple[Dict, float]]:
         """
         Tính điểm và xếp hạng các địa điểm
@@ -103,21 +259,21 @@ class ScoringEngine:
             user: User profile
             destinations: Danh sách địa điểm
             top_n: Số lượng top muốn lấy (None = tất cả)
+            features: Feature store dựng sẵn cho destinations (None = tự dựng)
             
         Returns:
             List[(destination, score)] đã sắp xếp theo điểm giảm dần
         """
-        scored = []
-        for dest in destinations:
-            score = cls.calculate_score(user, dest)
-            scored.append((dest, score))
-        
-        # Sắp xếp theo điểm giảm dần
-        scored.sort(key=lambda x: x[1], reverse=True)
+        if features is None:
+            features = DestinationFeatureStore(destinations)
+        scores = cls.calculate_scores_batch(user, features)
         
+        # Sắp xếp theo điểm giảm dần (stable - giữ thứ tự gốc khi bằng điểm)
+        order = np.argsort(-scores, kind='stable')
         if top_n:
-            return scored[:top_n]
-        return scored
+            order = order[:top_n]
+        
+        return [(destinations[i], float(scores[i])) for i in order]
     
     @classmethod
     def rank_destinations_hybrid(
@@ -127,7 +283,8 @@ class ScoringEngine:
         db: Session,
         user_id: Optional[int] = None,
         use_cf: bool = True,
-        top_n: Optional[int] = None
+        top_n: Optional[int] = None,
+        features: Optional[DestinationFeatureStore] = None
     ) -> List[Tuple[Dict, float, Dict]]:
         """
         Tính điểm hybrid (Content-Based + Collaborative Filtering) và xếp hạng
@@ -139,21 +296,24 @@ class ScoringEngine:
             user_id: User ID (None = anonymous, chỉ dùng CB)
             use_cf: Enable CF (False = CB only)
             top_n: Số lượng top muốn lấy
+            features: Feature store dựng sẵn cho destinations (None = tự dựng)
             
         Returns:
             List[(destination, final_score, metadata)] đã sắp xếp theo điểm giảm dần
         """
         scored = []
         
-        # Step 1: Content-Based Scoring (Always)
-        for dest in destinations:
-            cb_score = cls.calculate_score(user, dest)
-            dest['cb_score'] = cb_score
+        # Step 1: Content-Based Scoring (Always) - vector hóa cho toàn bộ danh sách
+        if features is None:
+            features = DestinationFeatureStore(destinations)
+        cb_scores = cls.calculate_scores_batch(user, features).tolist()
         
         # Step 2: Collaborative Filtering Scoring (if user_id provided)
         if use_cf and user_id:
             try:
-                cf_service = CollaborativeFilteringService(db)
+                # Model CF dùng chung của worker (dựng sẵn, làm mới chạy nền) => chỉ tra cứu
+                cf_model = CFModelStore.get_model(db)
+                cf_service = CollaborativeFilteringService(db, model=cf_model)
                 dest_ids = [d['id'] for d in destinations]
                 
                 # Get CF scores batch
@@ -168,9 +328,8 @@ class ScoringEngine:
                       f"CF weight: {cf_weight:.2f}, CB weight: {cb_weight:.2f}")
                 
                 # Hybrid scoring
-                for dest in destinations:
+                for dest, cb_score in zip(destinations, cb_scores):
                     dest_id = dest['id']
-                    cb_score = dest['cb_score']
                     
                     if dest_id in cf_scores:
                         cf_data = cf_scores[dest_id]
@@ -201,6 +360,7 @@ class ScoringEngine:
                             'cf_method': cf_data['method'],
                             'alpha_cb': round(alpha_cb, 2),
                             'alpha_cf': round(alpha_cf, 2),
+                            'cf_model_version': cf_model.version,
                             'scoring_method': 'hybrid'
                         }
                     else:
@@ -218,17 +378,18 @@ class ScoringEngine:
             except Exception as e:
                 print(f"ERROR CF: Collaborative filtering failed: {str(e)}")
                 # Fallback to content-based only
-                for dest in destinations:
-                    scored.append((dest, dest['cb_score'], {
-                        'cb_score': round(dest['cb_score'], 3),
+                scored = []
+                for dest, cb_score in zip(destinations, cb_scores):
+                    scored.append((dest, cb_score, {
+                        'cb_score': round(cb_score, 3),
                         'scoring_method': 'content_based',
                         'cf_error': str(e)
                     }))
         else:
             # Content-based only (no user_id or CF disabled)
-            for dest in destinations:
-                scored.append((dest, dest['cb_score'], {
-                    'cb_score': round(dest['cb_score'], 3),
+            for dest, cb_score in zip(destinations, cb_scores):
+                scored.append((dest, cb_score, {
+                    'cb_score': round(cb_score, 3),
                     'scoring_method': 'content_based'
                 }))
         
@@ -247,6 +408,9 @@ class ScoringEngine:
 class DistanceCalculator:
     """Lớp tính toán khoảng cách và thời gian di chuyển"""
     
+    # Hệ số đổi km -> số nguyên cho OR-Tools (1 đơn vị = 10m)
+    DISTANCE_SCALE = 100
+    
     @staticmethod
     def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
@@ -284,35 +448,594 @@ class DistanceCalculator:
         time_hours = distance_km / speed_kmh
         return int(time_hours * 60)
     
+    @staticmethod
+    def haversine_matrix(
+        lats1: np.ndarray,
+        lons1: np.ndarray,
+        lats2: np.ndarray,
+        lons2: np.ndarray
+    ) -> np.ndarray:
+        """
+        Tính khoảng cách Haversine giữa mọi cặp điểm (vector hóa bằng broadcasting)
+        
+        Cùng công thức với haversine_distance() nhưng cho cả ma trận một lần.
+        
+        Args:
+            lats1, lons1: Tọa độ các điểm nguồn (m điểm)
+            lats2, lons2: Tọa độ các điểm đích (n điểm)
+            
+        Returns:
+            np.ndarray (m, n): Khoảng cách (km)
+        """
+        R = 6371  # Bán kính trái đất (km)
+        
+        lats1 = np.asarray(lats1, dtype=np.float64)[:, None]
+        lons1 = np.asarray(lons1, dtype=np.float64)[:, None]
+        lats2 = np.asarray(lats2, dtype=np.float64)[None, :]
+        lons2 = np.asarray(lons2, dtype=np.float64)[None, :]
+        
+        dlat = np.radians(lats2 - lats1)
+        dlon = np.radians(lons2 - lons1)
+        
+        a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lats1)) * np.cos(np.radians(lats2)) * np.sin(dlon / 2) ** 2
+        c = 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+        
+        return R * c
+    
+    @staticmethod
+    def travel_time_matrix(distance_matrix: np.ndarray, speed_kmh: float = 40) -> np.ndarray:
+        """
+        Tính ma trận thời gian di chuyển (phút, số nguyên) từ ma trận khoảng cách
+        
+        Cùng cách làm tròn với calculate_travel_time() (cắt phần thập phân)
+        """
+        travel_time = (distance_matrix / speed_kmh * 60).astype(np.int64)
+        travel_time[distance_matrix <= 0] = 0
+        return travel_time
+    
+    @staticmethod
+    def scale_distance_matrix(distance_matrix: np.ndarray) -> np.ndarray:
+        """
+        Chuyển ma trận khoảng cách (km) sang số nguyên cho solver (đơn vị 10m)
+        """
+        return (distance_matrix * DistanceCalculator.DISTANCE_SCALE).astype(np.int64)
+    
     @classmethod
     def build_distance_matrix(
         cls,
         locations: List[Dict],
         speed_kmh: float = 40
-    ) -> Tuple[List[List[int]], List[List[int]]]:
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
-        Xây dựng ma trận khoảng cách và thời gian
+        Xây dựng ma trận khoảng cách và thời gian (một phép broadcast NumPy)
         
         Returns:
-            (distance_matrix, time_matrix)
+            (distance_matrix, time_matrix): km (float64) và phút (int64), shape (n, n)
         """
-        n = len(locations)
-        distance_matrix = [[0] * n for _ in range(n)]
-        time_matrix = [[0] * n for _ in range(n)]
+        lats = [loc['latitude'] for loc in locations]
+        lons = [loc['longitude'] for loc in locations]
         
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    dist = cls.haversine_distance(
-                        locations[i]['latitude'],
-                        locations[i]['longitude'],
-                        locations[j]['latitude'],
-                        locations[j]['longitude']
-                    )
-                    distance_matrix[i][j] = dist
-                    time_matrix[i][j] = cls.calculate_travel_time(dist, speed_kmh)
+        distance_matrix = cls.haversine_matrix(lats, lons, lats, lons)
+        np.fill_diagonal(distance_matrix, 0.0)
+        time_matrix = cls.travel_time_matrix(distance_matrix, speed_kmh)
+        
+        return distance_matrix, time_matrix
+    
+    @classmethod
+    def build_route_matrices(
+        cls,
+        start_location: Dict,
+        destinations: List[Dict],
+        speed_kmh: float = 40,
+        store: Optional['TravelMatrixStore'] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Xây dựng ma trận cho lộ trình [start_location] + destinations
+        
+        Nếu có TravelMatrixStore chứa đủ các destinations thì chỉ cắt ma trận con
+        từ file memory-map và tính riêng hàng/cột của điểm khởi hành.
+        Ngược lại tính toàn bộ bằng build_distance_matrix().
+        
+        Args:
+            store: Store precompute (None = dùng store mặc định nếu có)
+            
+        Returns:
+            (distance_matrix, time_matrix) shape (n+1, n+1), node 0 là start_location
+        """
+        if store is None:
+            store = TravelMatrixStore.get_default()
+        
+        dest_ids = [dest.get('id') for dest in destinations]
+        if store is None or store.speed_kmh != speed_kmh or not store.contains(dest_ids):
+            return cls.build_distance_matrix([start_location] + destinations, speed_kmh)
+        
+        n = len(destinations) + 1
+        sub_distance, sub_time = store.submatrices(dest_ids)
+        
+        # Chỉ tính hàng của điểm khởi hành (ad-hoc), haversine đối xứng nên dùng lại cho cột
+        start_row = cls.haversine_matrix(
+            [start_location['latitude']], [start_location['longitude']],
+            [dest['latitude'] for dest in destinations],
+            [dest['longitude'] for dest in destinations]
+        )[0]
+        start_time_row = cls.travel_time_matrix(start_row, speed_kmh)
+        
+        distance_matrix = np.zeros((n, n), dtype=np.float64)
+        distance_matrix[1:, 1:] = sub_distance
+        distance_matrix[0, 1:] = start_row
+        distance_matrix[1:, 0] = start_row
+        
+        time_matrix = np.zeros((n, n), dtype=np.int64)
+        time_matrix[1:, 1:] = sub_time
+        time_matrix[0, 1:] = start_time_row
+        time_matrix[1:, 0] = start_time_row
+        
+        return distance_matrix, time_matrix
+    
+    @classmethod
+    def build_shared_matrices(
+        cls,
+        start_locations: List[Dict],
+        destinations: List[Dict],
+        speed_kmh: float = 40,
+        store: Optional['TravelMatrixStore'] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ma trận dùng chung cho nhiều lộ trình: [k start_locations] + [n destinations]
+        
+        Khối destinations x destinations tính một lần (cắt từ store nếu có), các điểm
+        khởi hành chỉ tính thêm k hàng. Mỗi lộ trình cắt ma trận con bằng slice_route_matrices().
+        
+        Returns:
+            (distance_matrix, time_matrix) shape (k+n, k+n)
+        """
+        k = len(start_locations)
+        n = k + len(destinations)
+        dest_distance, dest_time = cls.build_route_matrices(
+            start_locations[0], destinations, speed_kmh, store
+        )
+        
+        start_rows = cls.haversine_matrix(
+            [loc['latitude'] for loc in start_locations],
+            [loc['longitude'] for loc in start_locations],
+            [dest['latitude'] for dest in destinations],
+            [dest['longitude'] for dest in destinations]
+        )
+        start_time_rows = cls.travel_time_matrix(start_rows, speed_kmh)
+        
+        # Ô start x start không dùng tới (mỗi lộ trình chỉ có một điểm khởi hành)
+        distance_matrix = np.zeros((n, n), dtype=np.float64)
+        distance_matrix[k:, k:] = dest_distance[1:, 1:]
+        distance_matrix[:k, k:] = start_rows
+        distance_matrix[k:, :k] = start_rows.T
+        
+        time_matrix = np.zeros((n, n), dtype=np.int64)
+        time_matrix[k:, k:] = dest_time[1:, 1:]
+        time_matrix[:k, k:] = start_time_rows
+        time_matrix[k:, :k] = start_time_rows.T
         
         return distance_matrix, time_matrix
+    
+    @staticmethod
+    def slice_route_matrices(
+        shared_matrices: Tuple[np.ndarray, np.ndarray],
+        start_index: int,
+        dest_indices: List[int]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cắt ma trận của một lộ trình từ build_shared_matrices()
+        
+        Args:
+            start_index: Vị trí điểm khởi hành trong start_locations
+            dest_indices: Chỉ số các destinations trong ma trận chung (đã cộng k)
+        
+        Returns:
+            (distance_matrix, time_matrix) như build_route_matrices(), node 0 là điểm khởi hành
+        """
+        nodes = np.concatenate(([start_index], np.asarray(dest_indices, dtype=np.int64)))
+        index = np.ix_(nodes, nodes)
+        return shared_matrices[0][index], shared_matrices[1][index]
+
+
+# ==============================================================================
+# TRAVEL MATRIX STORE - Ma trận all-pairs precompute (memory-mapped)
+# ==============================================================================
+
+class TravelMatrixStore:
+    """
+    Ma trận khoảng cách / thời gian di chuyển giữa mọi cặp địa điểm của catalog,
+    được build offline (build_travel_matrix.py) và đọc qua np.memmap.
+    
+    Các worker uvicorn cùng map một file nên dùng chung page cache của OS
+    thay vì mỗi worker giữ một bản copy riêng.
+    
+    path là symlink tới thư mục của lần build mới nhất (thay bằng một os.replace).
+    Files trong thư mục store:
+        dest_ids.npy  - destination_id theo thứ tự hàng/cột
+        distance.npy  - khoảng cách (km, float64 - giống hệt ma trận tính trực tiếp)
+        time.npy      - thời gian di chuyển (phút, int32)
+        meta.json     - speed_kmh, số địa điểm, thời điểm build
+    """
+    
+    _default: Optional['TravelMatrixStore'] = None
+    _default_mtime: Optional[float] = None
+    
+    def __init__(
+        self,
+        path: str,
+        dest_ids: np.ndarray,
+        distance: np.ndarray,
+        time_matrix: np.ndarray,
+        speed_kmh: float
+    ):
+        self.path = path
+        self.dest_ids = dest_ids
+        self.distance = distance
+        self.time_matrix = time_matrix
+        self.speed_kmh = speed_kmh
+        self.index_by_id = {int(dest_id): row for row, dest_id in enumerate(dest_ids.tolist())}
+    
+    def __len__(self) -> int:
+        return len(self.dest_ids)
+    
+    def contains(self, dest_ids: List[int]) -> bool:
+        """Kiểm tra store có đủ tất cả destination_id không"""
+        return all(dest_id in self.index_by_id for dest_id in dest_ids)
+    
+    def submatrices(self, dest_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cắt ma trận con theo danh sách destination_id (theo đúng thứ tự truyền vào)
+        
+        Returns:
+            (distance km float64, time phút int64)
+        """
+        rows = np.array([self.index_by_id[dest_id] for dest_id in dest_ids], dtype=np.intp)
+        selector = np.ix_(rows, rows)
+        return (
+            self.distance[selector].astype(np.float64),
+            self.time_matrix[selector].astype(np.int64)
+        )
+    
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        destinations: List[Dict],
+        speed_kmh: float = 40,
+        block_size: int = 1024
+    ) -> 'TravelMatrixStore':
+        """
+        Precompute ma trận cho danh sách địa điểm và ghi ra thư mục path
+        
+        Tính theo từng khối hàng để không cần giữ ma trận n x n trong RAM.
+        Ghi vào thư mục mới rồi trỏ symlink path sang đó bằng một os.replace (atomic),
+        worker đang map file cũ vẫn đọc được cho tới khi load lại.
+        """
+        n = len(destinations)
+        tmp_path = f"{path}.{time.time_ns()}"
+        os.makedirs(tmp_path)
+        
+        lats = np.array([dest['latitude'] for dest in destinations], dtype=np.float64)
+        lons = np.array([dest['longitude'] for dest in destinations], dtype=np.float64)
+        np.save(os.path.join(tmp_path, 'dest_ids.npy'),
+                np.array([dest['id'] for dest in destinations], dtype=np.int64))
+        
+        distance = np.lib.format.open_memmap(
+            os.path.join(tmp_path, 'distance.npy'), mode='w+', dtype=np.float64, shape=(n, n)
+        )
+        time_matrix = np.lib.format.open_memmap(
+            os.path.join(tmp_path, 'time.npy'), mode='w+', dtype=np.int32, shape=(n, n)
+        )
+        for start in range(0, n, block_size):
+            end = min(start + block_size, n)
+            block = DistanceCalculator.haversine_matrix(lats[start:end], lons[start:end], lats, lons)
+            block[np.arange(end - start), np.arange(start, end)] = 0.0
+            distance[start:end] = block
+            time_matrix[start:end] = DistanceCalculator.travel_time_matrix(block, speed_kmh)
+        distance.flush()
+        time_matrix.flush()
+        del distance, time_matrix
+        
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'speed_kmh': speed_kmh,
+                'size': n,
+                'built_at': datetime.utcnow().isoformat()
+            }, f)
+        
+        old_path = os.path.realpath(path) if os.path.islink(path) else None
+        if os.path.isdir(path) and not os.path.islink(path):
+            # Store cũ là thư mục thật (trước khi dùng symlink) => chuyển sang một lần
+            old_path = f"{path}.old-{os.getpid()}"
+            os.rename(path, old_path)
+        link_path = f"{path}.link-{os.getpid()}"
+        os.symlink(os.path.basename(tmp_path), link_path)
+        os.replace(link_path, path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+        
+        return cls.load(path)
+    
+    @classmethod
+    def load(cls, path: str) -> 'TravelMatrixStore':
+        """Mở store ở chế độ read-only memory-map"""
+        # Đọc mọi file từ cùng một lần build (symlink có thể đổi giữa chừng)
+        data_path = os.path.realpath(path)
+        with open(os.path.join(data_path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(
+            path=path,
+            dest_ids=np.load(os.path.join(data_path, 'dest_ids.npy')),
+            distance=np.load(os.path.join(data_path, 'distance.npy'), mmap_mode='r'),
+            time_matrix=np.load(os.path.join(data_path, 'time.npy'), mmap_mode='r'),
+            speed_kmh=meta['speed_kmh']
+        )
+    
+    @classmethod
+    def get_default(cls) -> Optional['TravelMatrixStore']:
+        """
+        Store tại settings.TRAVEL_MATRIX_PATH (None nếu chưa build)
+        
+        Tự load lại khi meta.json thay đổi (store được build lại).
+        """
+        path = settings.TRAVEL_MATRIX_PATH
+        if not path:
+            return None
+        try:
+            mtime = os.path.getmtime(os.path.join(path, 'meta.json'))
+        except OSError:
+            cls._default = None
+            cls._default_mtime = None
+            return None
+        
+        if cls._default is None or cls._default_mtime != mtime:
+            try:
+                cls._default = cls.load(path)
+                cls._default_mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                print(f"ERROR: Cannot load travel matrix store at {path}: {str(e)}")
+                cls._default = None
+                return None
+        return cls._default
+
+
+# ==============================================================================
+# DEADLINE - Ngân sách độ trễ cho một request
+# ==============================================================================
+
+class Deadline:
+    """Mốc thời gian kết thúc (monotonic) tính từ lúc nhận request"""
+    
+    def __init__(self, budget_ms: int):
+        self.budget_ms = budget_ms
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget_ms / 1000
+    
+    def remaining_ms(self) -> int:
+        """Số ms còn lại (không âm)"""
+        return max(0, int((self.expires_at - time.monotonic()) * 1000))
+    
+    def elapsed_ms(self) -> int:
+        return int((time.monotonic() - self.started_at) * 1000)
+    
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+    
+    def cap(self, limit: 'Deadline') -> 'Deadline':
+        """Không kết thúc muộn hơn limit (vd: deadline của cả request batch)"""
+        self.expires_at = min(self.expires_at, limit.expires_at)
+        return self
+
+
+# ==============================================================================
+# OPENING SCHEDULE - Khung giờ được phép bắt đầu tham quan của từng node
+# ==============================================================================
+
+class OpeningSchedule:
+    """
+    Giờ mở cửa (đã parse trong snapshot) quy đổi theo giờ bắt đầu tour
+    
+    - Thời gian tính bằng phút từ lúc bắt đầu tour (0 = tour_start_minutes)
+    - Mỗi node có danh sách khoảng [lo, hi] được phép BẮT ĐẦU tham quan sao cho
+      tham quan xong trước giờ đóng cửa (lặp theo ngày, hỗ trợ mở qua đêm)
+    - None = không ràng buộc (mở cả ngày / không có opening_hours), [] = không thể thăm
+    - Đến sớm thì chờ tới giờ mở cửa (thời gian chờ tính vào tổng thời gian)
+    """
+    
+    def __init__(self, locations: List[Dict], start_minutes: int, horizon: int):
+        """
+        Args:
+            locations: [start_location] + destinations (node 0 không ràng buộc)
+            start_minutes: Giờ bắt đầu tour (phút từ 00:00)
+            horizon: Thời gian tối đa của tour (phút)
+        """
+        self.start_minutes = start_minutes
+        self.intervals: List[Optional[List[Tuple[int, int]]]] = [None] + [
+            self.service_intervals(
+                OpeningHours.get_window(loc), int(loc.get('visit_time', 60)), start_minutes, horizon
+            )
+            for loc in locations[1:]
+        ]
+        self.constrained = any(intervals is not None for intervals in self.intervals)
+    
+    @staticmethod
+    def get_start_minutes(user: Dict) -> int:
+        """Giờ bắt đầu tour: user['tour_start_minutes'], mặc định settings.TOUR_START_TIME"""
+        start_minutes = user.get('tour_start_minutes')
+        if start_minutes is None:
+            start_minutes = OpeningHours.parse_clock(settings.TOUR_START_TIME) or 0
+        return start_minutes
+    
+    @classmethod
+    def from_user(cls, locations: List[Dict], user: Dict) -> 'OpeningSchedule':
+        return cls(locations, cls.get_start_minutes(user), int(user.get('time_available', 8) * 60))
+    
+    @staticmethod
+    def service_intervals(
+        window: Optional[Tuple[int, int]],
+        visit_time: int,
+        start_minutes: int,
+        horizon: int
+    ) -> Optional[List[Tuple[int, int]]]:
+        """Các khoảng (tương đối so với giờ bắt đầu tour) được phép bắt đầu tham quan"""
+        if window is None:
+            return None
+        
+        day = OpeningHours.MINUTES_PER_DAY
+        open_minutes, close_minutes = window
+        if close_minutes <= open_minutes:
+            close_minutes += day  # Mở qua đêm
+        
+        intervals = []
+        # Ngày -1: phần sau nửa đêm của khung mở qua đêm hôm trước
+        for offset in range(-day, start_minutes + horizon + day, day):
+            lo = max(offset + open_minutes - start_minutes, 0)
+            hi = min(offset + close_minutes - visit_time - start_minutes, horizon)
+            if lo <= hi:
+                intervals.append((lo, hi))
+        return intervals
+    
+    @staticmethod
+    def earliest_in(intervals: Optional[List[Tuple[int, int]]], ready: int) -> Optional[int]:
+        """Thời điểm sớm nhất >= ready thuộc một khoảng cho phép (None = không kịp)"""
+        if intervals is None:
+            return ready
+        for lo, hi in intervals:
+            if ready <= hi:
+                return max(ready, lo)
+        return None
+    
+    def earliest_start(self, node: int, ready: int) -> Optional[int]:
+        """Thời điểm sớm nhất bắt đầu tham quan node khi đến lúc ready (None = không kịp)"""
+        return self.earliest_in(self.intervals[node], ready)
+    
+    def clock(self, minutes: int) -> str:
+        """Phút từ lúc bắt đầu tour => giờ dạng HH:MM"""
+        return OpeningHours.format_clock(self.start_minutes + minutes)
+
+
+# ==============================================================================
+# FEASIBILITY CHECKER - Cận dưới rẻ để loại request / địa điểm vô vọng trước khi tối ưu
+# ==============================================================================
+
+class FeasibilityChecker:
+    """
+    Kiểm tra khả thi bằng cận dưới trước khi gọi solver
+    
+    - Từng địa điểm: chỉ có thể nằm trong một lộ trình nào đó nếu giá <= budget và
+      di chuyển từ điểm xuất phát (+ chờ mở cửa) + visit_time <= thời gian (lộ trình mở,
+      điều kiện lỏng nhất trong các solver) => loại địa điểm không thỏa trước khi xếp hạng
+    - Không còn địa điểm nào: trả lỗi ngay kèm lý do
+    - Thăm tất cả (không orienteering): tổng giá / tổng visit_time + cận dưới di chuyển
+      của tour vượt giới hạn => bỏ qua solver, dùng heuristic luôn
+    """
+    
+    @staticmethod
+    def get_limits(user: Dict) -> Tuple[float, int]:
+        """(budget, max_time phút) - cùng cách đọc với các optimizer"""
+        return user.get('budget', float('inf')), user.get('time_available', 8) * 60
+    
+    @classmethod
+    def feasible_mask(
+        cls,
+        user: Dict,
+        start_location: Dict,
+        features: DestinationFeatureStore,
+        speed_kmh: float = 40
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Địa điểm nào có thể xuất hiện trong ít nhất một lộ trình khả thi
+        
+        Returns:
+            (mask, min_time) - min_time = di chuyển từ điểm xuất phát + chờ mở cửa
+            + visit_time (phút), inf nếu đóng cửa suốt thời gian của tour
+        """
+        budget, max_time = cls.get_limits(user)
+        start_distance = DistanceCalculator.haversine_matrix(
+            [start_location['latitude']], [start_location['longitude']],
+            features.latitudes, features.longitudes
+        )[0]
+        travel = DistanceCalculator.travel_time_matrix(start_distance, speed_kmh)
+        min_time = travel + features.visit_times
+        
+        # Giờ mở cửa: chỉ tính cho địa điểm có ràng buộc và còn khả thi
+        # (vector hóa, cùng kết quả với OpeningSchedule.service_intervals + earliest_in)
+        start_minutes = OpeningSchedule.get_start_minutes(user)
+        windowed = np.flatnonzero((features.open_minutes >= 0) & (min_time <= max_time))
+        if len(windowed):
+            day = OpeningHours.MINUTES_PER_DAY
+            visit_time = features.visit_times[windowed].astype(np.int64)
+            open_minutes = features.open_minutes[windowed].astype(np.int64)
+            close_minutes = features.close_minutes[windowed].astype(np.int64)
+            close_minutes = np.where(close_minutes <= open_minutes, close_minutes + day, close_minutes)  # Qua đêm
+            ready = start_minutes + travel[windowed]
+            # Ngày sớm nhất mà đến lúc ready vẫn tham quan xong trước giờ đóng cửa
+            days = -((close_minutes - visit_time - ready) // day)
+            service_start = np.maximum(ready, days * day + open_minutes) - start_minutes
+            reachable = (close_minutes - open_minutes >= visit_time) & (service_start <= int(max_time))
+            min_time[windowed] = np.where(reachable, service_start + visit_time, np.inf)
+        
+        mask = (features.prices <= budget) & (min_time <= max_time)
+        return mask, min_time
+    
+    @classmethod
+    def explain_infeasible(
+        cls,
+        user: Dict,
+        features: DestinationFeatureStore,
+        min_time: np.ndarray
+    ) -> str:
+        """Lý do không có địa điểm nào khả thi (dùng làm message trả về cho user)"""
+        budget, max_time = cls.get_limits(user)
+        reasons = []
+        cheapest = features.prices.min()
+        fastest = min_time.min()
+        if cheapest > budget:
+            reasons.append(
+                f"ngân sách {budget:,.0f}đ thấp hơn giá địa điểm rẻ nhất ({cheapest:,.0f}đ)"
+            )
+        if np.isinf(fastest):
+            reasons.append('mọi địa điểm đều đóng cửa trong khoảng thời gian của tour')
+        elif fastest > max_time:
+            reasons.append(
+                f"thời gian {max_time} phút không đủ cho địa điểm nhanh nhất "
+                f"(cần {fastest:.0f} phút gồm di chuyển và tham quan)"
+            )
+        if not reasons:
+            reasons.append('không có địa điểm nào vừa ngân sách vừa đủ thời gian')
+        return 'Không thể tạo tour: ' + '; '.join(reasons)
+    
+    @classmethod
+    def visit_all_infeasible(
+        cls,
+        user: Dict,
+        destinations: List[Dict],
+        matrices: Tuple[np.ndarray, np.ndarray]
+    ) -> Optional[str]:
+        """
+        Cận dưới cho model thăm tất cả + quay về điểm xuất phát
+        
+        Thời gian: tổng visit_time + với mỗi node (kể cả điểm xuất phát) chặng đến
+        ngắn nhất - mỗi node trong tour có đúng một chặng đến.
+        
+        Returns:
+            Lý do nếu chắc chắn không có lời giải, None nếu chưa kết luận được
+        """
+        budget, max_time = cls.get_limits(user)
+        total_price = sum(dest.get('price', 0) for dest in destinations)
+        if total_price > budget:
+            return f"Tổng giá {total_price:,.0f}đ vượt ngân sách {budget:,.0f}đ"
+        
+        _, time_matrix = matrices
+        if len(time_matrix) > 1:
+            incoming = time_matrix + np.diag(np.full(len(time_matrix), np.iinfo(np.int64).max // 2))
+            travel_bound = int(incoming.min(axis=0).sum())
+        else:
+            travel_bound = 0
+        time_bound = sum(dest.get('visit_time', 60) for dest in destinations) + travel_bound
+        if time_bound > max_time:
+            return f"Cần ít nhất {time_bound} phút để thăm tất cả, vượt {max_time} phút"
+        return None
 
 
 # ==============================================================================
@@ -322,24 +1045,45 @@ class DistanceCalculator:
 class HeuristicOptimizer:
     """
     Lớp tối ưu hóa lộ trình sử dụng thuật toán tham lam (greedy heuristic)
-    Được dùng khi OR-Tools không tìm được solution
+    Được dùng khi OR-Tools không tìm được solution, và là các chiến lược
+    chạy ngay (không cần process pool) trong chế độ portfolio
     """
     
-    def __init__(self, destinations: List[Dict], user: Dict, start_location: Dict):
+    def __init__(
+        self,
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    ):
         """
         Args:
             destinations: Danh sách địa điểm đã có điểm
             user: User profile
             start_location: Điểm khởi hành
+            matrices: (distance, time) cho [start_location] + destinations (None = tự build)
         """
         self.user = user
         self.start_location = start_location
         self.destinations = destinations
         
+        # Ma trận khoảng cách / thời gian (node 0 = start location)
+        if matrices is None:
+            matrices = DistanceCalculator.build_route_matrices(start_location, destinations)
+        self.distance_matrix, self.time_matrix = matrices
+        self._distance_rows = self.distance_matrix.tolist()
+        self._time_rows = self.time_matrix.tolist()
+        
+        # Thuộc tính theo node (node 0 = start location) cho local search
+        self._scores = [0.0] + [dest.get('score', 0) for dest in destinations]
+        self._visit_times = [0] + [dest.get('visit_time', 60) for dest in destinations]
+        self._prices = [0] + [dest.get('price', 0) for dest in destinations]
+        
         # Constraints
         self.max_time = user.get('time_available', 8) * 60  # Convert to minutes
         self.max_budget = user.get('budget', float('inf'))
         self.max_locations = user.get('max_locations', 5)
+        self.schedule = OpeningSchedule.from_user([start_location] + destinations, user)
     
     def optimize_greedy(self) -> Dict:
         """
@@ -354,48 +1098,92 @@ class HeuristicOptimizer:
         Returns:
             Dict với route đơn giản
         """
-        route = []
+        print(f"🔄 Fallback to Heuristic Optimizer (Greedy Algorithm)")
+        
+        return self._build_result(self._greedy_nodes(), 'heuristic')
+    
+    def optimize_local_search(self) -> Dict:
+        """
+        Greedy + local search (insertion, replace, 2-opt, Or-opt)
+        
+        Returns:
+            Dict với route (cùng format optimize_greedy)
+        """
+        print(f"🔄 Heuristic Optimizer (Greedy + Local Search)")
+        
+        return self._build_result(self.local_search_nodes(), 'heuristic_local_search')
+    
+    def local_search_nodes(self, nodes: Optional[List[int]] = None) -> List[int]:
+        """
+        Cải thiện lộ trình bằng local search cho tới khi không còn move nào tốt hơn
+        
+        Moves (chỉ nhận lộ trình thỏa time, budget, max_locations):
+        - Insertion: thêm địa điểm chưa thăm vào vị trí tốt nhất
+        - Replace: bỏ một địa điểm (removal) và chèn một địa điểm khác có điểm cao hơn
+        - 2-opt: đảo ngược một đoạn
+        - Or-opt: chuyển một đoạn 1-3 địa điểm sang vị trí khác
+        
+        Mục tiêu: total_score cao hơn, bằng điểm thì quãng đường ngắn hơn.
+        
+        Args:
+            nodes: Lộ trình ban đầu (node 1..n, None = greedy)
+        
+        Returns:
+            Danh sách node theo thứ tự thăm (dùng được làm lời giải khởi đầu cho OR-Tools)
+        """
+        if nodes is None:
+            nodes = self._greedy_nodes()
+        current = self._evaluate(nodes)
+        if current is None:
+            return nodes
+        
+        moves = (self._insertion_move, self._replace_move, self._two_opt_move, self._or_opt_move)
+        improved = True
+        while improved:
+            improved = False
+            for move in moves:
+                found = move(nodes, current)
+                if found is not None:
+                    nodes, current = found
+                    improved = True
+        return nodes
+    
+    def _greedy_nodes(self) -> List[int]:
+        """Chọn các node (1..n, node 0 = start) theo thuật toán tham lam"""
+        nodes = []
         visited = set()
-        current_location = self.start_location
+        current_node = 0  # Start location
         
         total_time = 0
-        total_distance = 0.0
-        total_score = 0.0
         total_cost = 0
         
-        print(f"🔄 Fallback to Heuristic Optimizer (Greedy Algorithm)")
-        
-        while len(route) < self.max_locations:
-            best_dest = None
+        while len(nodes) < self.max_locations:
+            best_node = None
             best_metric = -1
-            best_travel_time = 0
-            best_distance = 0
             
             # Tìm địa điểm tốt nhất chưa thăm
-            for dest in self.destinations:
+            for node, dest in enumerate(self.destinations, start=1):
                 dest_id = dest.get('id')
                 
                 if dest_id in visited:
                     continue
                 
-                # Tính khoảng cách và thời gian
-                distance = DistanceCalculator.haversine_distance(
-                    current_location['latitude'],
-                    current_location['longitude'],
-                    dest['latitude'],
-                    dest['longitude']
-                )
-                
-                travel_time = DistanceCalculator.calculate_travel_time(distance)
+                # Khoảng cách và thời gian từ ma trận precompute
+                distance = self._distance_rows[current_node][node]
+                travel_time = self._time_rows[current_node][node]
                 visit_time = dest.get('visit_time', 60)
                 price = dest.get('price', 0)
                 score = dest.get('score', 0)
                 
-                # Kiểm tra constraints
-                new_time = total_time + travel_time + visit_time
+                # Kiểm tra constraints (đến sớm thì chờ giờ mở cửa)
+                service_start = self.schedule.earliest_start(node, total_time + travel_time)
+                if service_start is None:
+                    continue
+                new_time = service_start + visit_time
                 new_cost = total_cost + price
                 
-                if new_time > self.max_time or new_cost > self.max_budget:
+                # Lộ trình khép kín: sau địa điểm này vẫn phải kịp quay về start location
+                if new_time + self._time_rows[node][0] > self.max_time or new_cost > self.max_budget:
                     continue
                 
                 # Tính metric: score/distance (ưu tiên gần + điểm cao)
@@ -405,48 +1193,172 @@ class HeuristicOptimizer:
                 
                 if metric > best_metric:
                     best_metric = metric
-                    best_dest = dest
-                    best_travel_time = travel_time
-                    best_distance = distance
+                    best_node = node
             
             # Nếu không tìm được địa điểm nào thỏa mãn -> dừng
-            if best_dest is None:
+            if best_node is None:
                 break
             
-            # Thêm địa điểm vào route
-            visited.add(best_dest['id'])
-            
-            route.append({
-                'id': best_dest['id'],
-                'name': best_dest['name'],
-                'type': best_dest['type'],
-                'latitude': best_dest['latitude'],
-                'longitude': best_dest['longitude'],
-                'location_address': best_dest.get('location_address'),
-                'price': best_dest['price'],
-                'visit_time': best_dest['visit_time'],
-                'travel_time': best_travel_time,
-                'score': best_dest['score'],
-                'opening_hours': best_dest.get('opening_hours'),
-                'facilities': best_dest.get('facilities', []),
-                'images': best_dest.get('images', [])
-            })
-            
-            # Update totals
-            total_time += best_travel_time + best_dest['visit_time']
-            total_distance += best_distance
-            total_cost += best_dest['price']
-            total_score += best_dest['score']
+            dest = self.destinations[best_node - 1]
+            visited.add(dest['id'])
+            nodes.append(best_node)
             
-            # Update current location
-            current_location = best_dest
+            total_time = self.schedule.earliest_start(
+                best_node, total_time + self._time_rows[current_node][best_node]
+            ) + dest['visit_time']
+            total_cost += dest['price']
+            current_node = best_node
         
-        if not route:
+        return nodes
+    
+    def _evaluate(self, nodes: List[int]) -> Optional[Tuple[float, float]]:
+        """
+        (total_score, total_distance) của lộ trình khép kín (node 0 -> nodes -> node 0),
+        None nếu vi phạm constraints (cùng model với OR-Tools / ExactRouteSolver)
+        """
+        if len(nodes) > self.max_locations:
+            return None
+        
+        total_time = 0
+        total_cost = 0
+        total_distance = 0.0
+        total_score = 0.0
+        prev = 0
+        for node in nodes:
+            service_start = self.schedule.earliest_start(node, total_time + self._time_rows[prev][node])
+            if service_start is None:
+                return None
+            total_time = service_start + self._visit_times[node]
+            total_cost += self._prices[node]
+            total_distance += self._distance_rows[prev][node]
+            total_score += self._scores[node]
+            prev = node
+        
+        # Chặng quay về start location
+        total_time += self._time_rows[prev][0]
+        total_distance += self._distance_rows[prev][0]
+        
+        if total_time > self.max_time or total_cost > self.max_budget:
+            return None
+        return total_score, total_distance
+    
+    @staticmethod
+    def _is_better(candidate: Tuple[float, float], current: Tuple[float, float]) -> bool:
+        """Điểm cao hơn, hoặc bằng điểm và quãng đường ngắn hơn"""
+        if abs(candidate[0] - current[0]) > 1e-9:
+            return candidate[0] > current[0]
+        return candidate[1] < current[1] - 1e-9
+    
+    def _best_of(
+        self,
+        candidates,
+        current: Tuple[float, float]
+    ) -> Optional[Tuple[List[int], Tuple[float, float]]]:
+        """Lộ trình tốt nhất (và tốt hơn current) trong các candidate, None nếu không có"""
+        best = None
+        best_value = current
+        for candidate in candidates:
+            value = self._evaluate(candidate)
+            if value is not None and self._is_better(value, best_value):
+                best, best_value = candidate, value
+        return (best, best_value) if best is not None else None
+    
+    def _unvisited(self, nodes: List[int]) -> List[int]:
+        visited = set(nodes)
+        return [node for node in range(1, len(self.destinations) + 1) if node not in visited]
+    
+    def _insertion_move(self, nodes, current):
+        if len(nodes) >= self.max_locations:
+            return None
+        return self._best_of(
+            (nodes[:pos] + [node] + nodes[pos:]
+             for node in self._unvisited(nodes)
+             for pos in range(len(nodes) + 1)),
+            current
+        )
+    
+    def _replace_move(self, nodes, current):
+        unvisited = self._unvisited(nodes)
+        candidates = []
+        for i in range(len(nodes)):
+            rest = nodes[:i] + nodes[i + 1:]
+            for node in unvisited:
+                if self._scores[node] <= self._scores[nodes[i]]:
+                    continue  # Không tăng điểm => không thể tốt hơn
+                candidates.extend(rest[:pos] + [node] + rest[pos:] for pos in range(len(rest) + 1))
+        return self._best_of(candidates, current)
+    
+    def _two_opt_move(self, nodes, current):
+        return self._best_of(
+            (nodes[:i] + nodes[i:j + 1][::-1] + nodes[j + 1:]
+             for i in range(len(nodes) - 1)
+             for j in range(i + 1, len(nodes))),
+            current
+        )
+    
+    def _or_opt_move(self, nodes, current):
+        candidates = []
+        for length in (1, 2, 3):
+            for i in range(len(nodes) - length + 1):
+                segment = nodes[i:i + length]
+                rest = nodes[:i] + nodes[i + length:]
+                for pos in range(len(rest) + 1):
+                    if pos != i:
+                        candidates.append(rest[:pos] + segment + rest[pos:])
+        return self._best_of(candidates, current)
+    
+    def _build_result(self, nodes: List[int], optimizer_used: str) -> Dict:
+        """Tạo Dict kết quả từ danh sách node theo thứ tự thăm"""
+        if not nodes:
             return {
                 'success': False,
                 'message': 'Không thể tạo tour với constraints hiện tại (quá chặt)'
             }
         
+        route = []
+        total_time = 0
+        total_distance = 0.0
+        total_score = 0.0
+        total_cost = 0
+        prev_node = 0
+        
+        for node in nodes:
+            dest = self.destinations[node - 1]
+            travel_time = self._time_rows[prev_node][node]
+            arrival = total_time + travel_time
+            service_start = self.schedule.earliest_start(node, arrival)
+            if service_start is None:
+                service_start = arrival
+            
+            route.append({
+                'id': dest['id'],
+                'name': dest['name'],
+                'type': dest['type'],
+                'latitude': dest['latitude'],
+                'longitude': dest['longitude'],
+                'location_address': dest.get('location_address'),
+                'price': dest['price'],
+                'visit_time': dest['visit_time'],
+                'travel_time': travel_time,
+                'arrival_time': self.schedule.clock(service_start),
+                'wait_time': service_start - arrival,
+                'score': dest['score'],
+                'opening_hours': dest.get('opening_hours'),
+                'facilities': dest.get('facilities', []),
+                'images': dest.get('images', [])
+            })
+            
+            # Update totals
+            total_time = service_start + dest['visit_time']
+            total_distance += self._distance_rows[prev_node][node]
+            total_cost += dest['price']
+            total_score += dest['score']
+            prev_node = node
+        
+        # Chặng quay về start location (lộ trình khép kín)
+        total_time += self._time_rows[prev_node][0]
+        total_distance += self._distance_rows[prev_node][0]
+        
         return {
             'success': True,
             'route': route,
@@ -456,10 +1368,78 @@ class HeuristicOptimizer:
             'total_score': round(total_score, 3),
             'total_cost': total_cost,
             'avg_score': round(total_score / len(route), 3) if route else 0,
-            'optimizer_used': 'heuristic'  # Đánh dấu dùng heuristic
+            'optimizer_used': optimizer_used  # 'heuristic' | 'heuristic_local_search'
         }
 
 
+# ==============================================================================
+# ROUTE REPAIRER - Sửa lộ trình đang đi dở (re-plan)
+# ==============================================================================
+
+class RouteRepairer(HeuristicOptimizer):
+    """
+    Sửa phần còn lại của một lộ trình thay vì tối ưu lại từ đầu
+    
+    Node 0 là vị trí hiện tại, giới hạn time / budget / max_locations là phần còn lại.
+    Các bước (chỉ dùng ma trận đã có, vài ms):
+    1. Cheapest insertion: chèn địa điểm mới vào vị trí làm tăng quãng đường ít nhất
+    2. Removal: bỏ dần địa điểm cho tới khi lộ trình thỏa constraints
+    3. Local search ngắn (insertion, replace, 2-opt, Or-opt) của HeuristicOptimizer
+    """
+    
+    def repair(self, nodes: List[int], added_nodes: List[int]) -> List[int]:
+        """
+        Args:
+            nodes: Lộ trình còn lại theo thứ tự cũ (node 1..n)
+            added_nodes: Địa điểm cần thêm vào lộ trình
+        
+        Returns:
+            Lộ trình đã sửa (node 1..n theo thứ tự thăm)
+        """
+        nodes = list(nodes)
+        for node in added_nodes:
+            nodes = self._cheapest_insertion(nodes, node)
+        nodes = self._remove_until_feasible(nodes)
+        return self.local_search_nodes(nodes)
+    
+    def optimize_repair(self, nodes: List[int], added_nodes: List[int]) -> Dict:
+        """repair() + Dict kết quả (cùng format HeuristicOptimizer, optimizer_used = 'repair')"""
+        return self._build_result(self.repair(nodes, added_nodes), 'repair')
+    
+    def _cheapest_insertion(self, nodes: List[int], node: int) -> List[int]:
+        """Chèn node vào vị trí khả thi tăng quãng đường ít nhất (không có thì vị trí rẻ nhất)"""
+        def added_distance(pos: int) -> float:
+            prev = nodes[pos - 1] if pos > 0 else 0
+            added = self._distance_rows[prev][node]
+            if pos < len(nodes):
+                added += self._distance_rows[node][nodes[pos]] - self._distance_rows[prev][nodes[pos]]
+            return added
+        
+        positions = sorted(range(len(nodes) + 1), key=added_distance)
+        for pos in positions:
+            candidate = nodes[:pos] + [node] + nodes[pos:]
+            if self._evaluate(candidate) is not None:
+                return candidate
+        return nodes[:positions[0]] + [node] + nodes[positions[0]:]
+    
+    def _remove_until_feasible(self, nodes: List[int]) -> List[int]:
+        """
+        Bỏ từng địa điểm cho tới khi thỏa constraints: ưu tiên lần bỏ cho ra lộ trình
+        khả thi tốt nhất, nếu chưa có thì bỏ địa điểm điểm thấp nhất / tốn thời gian nhất
+        """
+        while nodes and self._evaluate(nodes) is None:
+            removals = [nodes[:i] + nodes[i + 1:] for i in range(len(nodes))]
+            feasible = self._best_of(removals, (float('-inf'), float('inf')))
+            if feasible is not None:
+                return feasible[0]
+            worst = min(
+                range(len(nodes)),
+                key=lambda i: (self._scores[nodes[i]], -self._visit_times[nodes[i]])
+            )
+            nodes = nodes[:worst] + nodes[worst + 1:]
+        return nodes
+
+
 # ==============================================================================
 # ROUTE OPTIMIZER - Tối ưu lộ trình với OR-Tools
 # ==============================================================================
@@ -467,138 +1447,221 @@ class HeuristicOptimizer:
 class RouteOptimizer:
     """Lớp tối ưu hóa lộ trình du lịch sử dụng OR-Tools VRP"""
     
-    def __init__(self, destinations: List[Dict], user: Dict, start_location: Dict):
+    # Orienteering: bỏ một địa điểm bị phạt score * PRIZE_SCALE (đơn vị quãng đường
+    # của solver = km * DISTANCE_SCALE) => điểm được ưu tiên hơn hẳn quãng đường
+    PRIZE_SCALE = 100000
+    
+    def __init__(
+        self,
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+        optional_nodes: bool = False
+    ):
         """
         Args:
             destinations: Danh sách địa điểm đã có điểm
             user: User profile
             start_location: Điểm khởi hành
+            matrices: (distance, time) cho [start_location] + destinations (None = tự build)
+            optional_nodes: True = orienteering: solver tự chọn tập địa điểm (tối đa
+                max_locations), bỏ địa điểm bị phạt theo score; False = thăm tất cả
         """
         self.user = user
         self.start_location = start_location
+        self.optional_nodes = optional_nodes
+        self.num_vehicles = 1  # Mỗi vehicle là một lộ trình xuất phát từ start location
         
         # Thêm start location vào đầu danh sách
         self.locations = [start_location] + destinations
         self.num_locations = len(self.locations)
         
-        # Build matrices
-        self.distance_matrix, self.time_matrix = DistanceCalculator.build_distance_matrix(
-            self.locations
+        # Build matrices (NumPy, cắt từ store precompute nếu có) + bản số nguyên cho solver
+        if matrices is None:
+            matrices = DistanceCalculator.build_route_matrices(start_location, destinations)
+        self.distance_matrix, self.time_matrix = matrices
+        
+        # Transit matrix / vector số nguyên đăng ký thẳng vào OR-Tools
+        # (không dùng Python callback => không gọi ngược vào Python trong lúc search)
+        visit_times = np.array(
+            [loc.get('visit_time', 60) for loc in self.locations], dtype=np.int64
         )
+        self.solver_distance_matrix = DistanceCalculator.scale_distance_matrix(
+            self.distance_matrix
+        ).tolist()
+        # Time transit i -> j = visit_time(i) + travel_time(i, j) => CumulVar(j) = giờ bắt đầu
+        # tham quan j (áp được giờ mở cửa), CumulVar của điểm cuối = tổng thời gian
+        self.solver_time_matrix = (visit_times[:, None] + self.time_matrix).tolist()
+        self.solver_prices = [int(loc.get('price', 0)) for loc in self.locations]
         
         # Điểm của từng địa điểm (start location có điểm 0)
         self.scores = [0.0] + [dest.get('score', 0.0) for dest in destinations]
-        
-        # Time windows
-        self.time_windows = self._build_time_windows()
+        self.drop_penalties = [int(round(score * self.PRIZE_SCALE)) for score in self.scores]
         
         # Constraints
-        self.max_time = user.get('time_available', 8) * 60  # Convert to minutes
+        self.max_time = int(user.get('time_available', 8) * 60)  # Convert to minutes (số nguyên cho solver)
         self.max_budget = user.get('budget', float('inf'))
         self.max_locations = user.get('max_locations', 5)
+        
+        # Time windows: giờ mở cửa (parse sẵn trong snapshot) tính từ giờ bắt đầu tour
+        self.schedule = OpeningSchedule.from_user(self.locations, user)
     
-    def _build_time_windows(self) -> List[Tuple[int, int]]:
-        """Xây dựng time windows từ opening_hours"""
-        windows = []
-        for loc in self.locations:
-            opening = loc.get('opening_hours', '00:00-23:59')
-            if opening and '-' in opening:
-                start_str, end_str = opening.split('-')
-                start_h, start_m = map(int, start_str.split(':'))
-                end_h, end_m = map(int, end_str.split(':'))
-                windows.append((start_h * 60 + start_m, end_h * 60 + end_m))
-            else:
-                windows.append((0, 24 * 60))
-        return windows
+    def _closed_nodes(self) -> List[int]:
+        """Các node không thể bắt đầu tham quan trong khoảng thời gian của tour"""
+        return [node for node, intervals in enumerate(self.schedule.intervals) if intervals == []]
     
-    def optimize(self) -> Dict:
+    def _build_model(self) -> Tuple[pywrapcp.RoutingIndexManager, pywrapcp.RoutingModel]:
         """
-        Chạy OR-Tools để tối ưu lộ trình
+        Xây dựng routing model từ các transit matrix / vector số nguyên
         
         Returns:
-            Dict với 'success', 'route', 'total_time', 'total_distance', 'total_score', 'total_cost'
+            (manager, routing)
         """
         # Tạo routing model
         manager = pywrapcp.RoutingIndexManager(
             self.num_locations,  # Số locations
-            1,                   # Số vehicles (1 tour)
+            self.num_vehicles,   # Số vehicles (1 tour, hoặc 1 ngày của tour nhiều ngày)
             0                    # Depot (start location)
         )
         routing = pywrapcp.RoutingModel(manager)
         
-        # ===== Callback cho distance (for objective) =====
-        def distance_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return int(self.distance_matrix[from_node][to_node] * 100)  # Convert to int
-        
-        distance_callback_index = routing.RegisterTransitCallback(distance_callback)
+        # ===== Transit matrix cho distance (for objective) =====
+        distance_transit_index = routing.RegisterTransitMatrix(self.solver_distance_matrix)
         
-        # ===== Callback cho travel time =====
-        def time_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            travel_time = self.time_matrix[from_node][to_node]
-            visit_time = self.locations[to_node].get('visit_time', 60)
-            return travel_time + visit_time
-        
-        time_callback_index = routing.RegisterTransitCallback(time_callback)
+        # ===== Transit matrix cho travel time + visit time =====
+        time_transit_index = routing.RegisterTransitMatrix(self.solver_time_matrix)
         
         # ===== Time dimension với time windows =====
         routing.AddDimension(
-            time_callback_index,
-            0,  # Slack
-            self.max_time,  # Max total time - increase để dễ tìm solution hơn
-            True,  # Start cumul to zero
+            time_transit_index,
+            self.max_time,  # Slack = thời gian chờ tới giờ mở cửa
+            self.max_time,  # Max total time
+            True,  # Start cumul to zero (0 = giờ bắt đầu tour)
             'Time'
         )
         
         time_dimension = routing.GetDimensionOrDie('Time')
         
-        # Chỉ set time window cho depot (start location)
-        # Không set cho các địa điểm khác vì có thể gây conflict với constraints
-        depot_index = manager.NodeToIndex(0)
-        time_dimension.CumulVar(depot_index).SetRange(0, self.max_time)
+        # Giờ mở cửa: CumulVar (giờ bắt đầu tham quan) phải nằm trong một khoảng cho phép
+        # => solver loại thứ tự đến nơi đã đóng cửa ngay trong lúc search
+        for node in range(1, self.num_locations):
+            intervals = self.schedule.intervals[node]
+            if intervals is None:
+                continue
+            index = manager.NodeToIndex(node)
+            if not intervals:
+                routing.ActiveVar(index).SetValue(0)  # Chỉ xảy ra khi node là tùy chọn
+                continue
+            cumul = time_dimension.CumulVar(index)
+            cumul.SetRange(intervals[0][0], intervals[-1][1])
+            for (_, prev_hi), (next_lo, _) in zip(intervals, intervals[1:]):
+                cumul.RemoveInterval(prev_hi + 1, next_lo - 1)
         
         # ===== Budget dimension =====
-        # Tạm thời comment out để test
-        def cost_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            return self.locations[from_node].get('price', 0)
-        
-        cost_callback_index = routing.RegisterUnaryTransitCallback(cost_callback)
+        cost_transit_index = routing.RegisterUnaryTransitVector(self.solver_prices)
         routing.AddDimensionWithVehicleCapacity(
-            cost_callback_index,
+            cost_transit_index,
             0,  # Null slack
-            [self.max_budget],  # Max budget
+            [self.max_budget] * self.num_vehicles,  # Max budget
             True,
             'Budget'
         )
         
         # ===== Objective: Minimize distance =====
-        # Sử dụng distance callback đã định nghĩa ở trên
-        routing.SetArcCostEvaluatorOfAllVehicles(distance_callback_index)
+        routing.SetArcCostEvaluatorOfAllVehicles(distance_transit_index)
+        
+        # ===== Orienteering: địa điểm tùy chọn + giới hạn số điểm dừng =====
+        # (chế độ thăm tất cả thì đã filter top N trước khi optimize)
+        if self.optional_nodes:
+            for node in range(1, self.num_locations):
+                routing.AddDisjunction([manager.NodeToIndex(node)], self.drop_penalties[node])
+            
+            stop_transit_index = routing.RegisterUnaryTransitVector(
+                [0] + [1] * (self.num_locations - 1)
+            )
+            routing.AddDimensionWithVehicleCapacity(
+                stop_transit_index,
+                0,
+                [self.max_locations] * self.num_vehicles,
+                True,
+                'Stops'
+            )
+        
+        return manager, routing
+    
+    def optimize(
+        self,
+        time_limit_ms: Optional[int] = None,
+        first_solution_strategy: str = 'AUTOMATIC',
+        local_search_metaheuristic: str = 'AUTOMATIC',
+        initial_nodes: Optional[List[int]] = None,
+        on_solution: Optional[Callable[[Dict], None]] = None
+    ) -> Dict:
+        """
+        Chạy OR-Tools để tối ưu lộ trình
+        
+        Args:
+            time_limit_ms: Thời gian tối đa cho solver (None = settings.TOUR_SOLVER_TIME_LIMIT_MS).
+                Hết giờ solver trả về lời giải tốt nhất đã tìm được (nếu có).
+            first_solution_strategy: Tên FirstSolutionStrategy (vd: 'PATH_CHEAPEST_ARC')
+            local_search_metaheuristic: Tên LocalSearchMetaheuristic (vd: 'GUIDED_LOCAL_SEARCH')
+            initial_nodes: Lộ trình khởi đầu (node 1..n, vd: HeuristicOptimizer.local_search_nodes()).
+                Local search bắt đầu từ lộ trình này thay vì first_solution_strategy;
+                nếu không hợp lệ với model thì solve bình thường.
+            on_solution: Gọi với kết quả (như giá trị trả về) mỗi khi solver tìm được
+                lời giải có cost tốt hơn mọi lời giải trước (streaming)
+        
+        Returns:
+            Dict với 'success', 'route', 'total_time', 'total_distance', 'total_score', 'total_cost'
+        """
+        if not self.optional_nodes and self._closed_nodes():
+            return {
+                'success': False,
+                'message': 'Có địa điểm đóng cửa trong suốt thời gian của tour'
+            }
         
-        # Note: Không dùng giới hạn số địa điểm bằng AddConstantDimension 
-        # vì có thể gây conflict. Đã filter top N trước khi optimize.
+        manager, routing = self._build_model()
         
         # ===== Search parameters =====
         search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.AUTOMATIC
+        search_parameters.first_solution_strategy = getattr(
+            routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy
         )
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.AUTOMATIC
+        search_parameters.local_search_metaheuristic = getattr(
+            routing_enums_pb2.LocalSearchMetaheuristic, local_search_metaheuristic
         )
-        search_parameters.time_limit.seconds = 30
-        search_parameters.log_search = True  # Debug logging
+        if time_limit_ms is None:
+            time_limit_ms = settings.TOUR_SOLVER_TIME_LIMIT_MS
+        search_parameters.time_limit.FromMilliseconds(max(1, time_limit_ms))
+        search_parameters.log_search = False
+        
+        if on_solution is not None:
+            self._add_solution_callback(manager, routing, on_solution)
         
         # ===== Solve =====
-        solution = routing.SolveWithParameters(search_parameters)
+        initial_assignment = None
+        if initial_nodes is not None:
+            routing.CloseModelWithParameters(search_parameters)
+            routes = [
+                [manager.NodeToIndex(node) for node in route]
+                for route in self._initial_routes(initial_nodes)
+            ]
+            initial_assignment = routing.ReadAssignmentFromRoutes(routes, True)
+            if initial_assignment is None:
+                print(f"DEBUG: Initial route rejected by OR-Tools model, solving from scratch")
+        
+        if initial_assignment is not None:
+            solution = routing.SolveFromAssignmentWithParameters(
+                initial_assignment, search_parameters
+            )
+        else:
+            solution = routing.SolveWithParameters(search_parameters)
         
         if solution:
             result = self._extract_solution(manager, routing, solution)
-            result['optimizer_used'] = 'ortools'  # Đánh dấu dùng OR-Tools
+            if result['success']:
+                result['optimizer_used'] = 'ortools'  # Đánh dấu dùng OR-Tools
             return result
         else:
             return {
@@ -606,57 +1669,129 @@ class RouteOptimizer:
                 'message': 'Không tìm thấy lộ trình phù hợp với các ràng buộc'
             }
     
+    def _add_solution_callback(self, manager, routing, on_solution: Callable[[Dict], None]) -> None:
+        """
+        Báo các lời giải tốt dần trong lúc search
+        
+        Callback của OR-Tools chạy với mọi lời giải được chấp nhận (GLS nhận cả lời giải
+        kém hơn) => chỉ báo khi cost thực sự giảm.
+        """
+        best_cost = [None]
+        
+        def report_solution():
+            cost = routing.CostVar().Value()
+            if best_cost[0] is not None and cost >= best_cost[0]:
+                return
+            best_cost[0] = cost
+            nodes = []
+            index = routing.NextVar(routing.Start(0)).Value()
+            while not routing.IsEnd(index):
+                nodes.append(manager.IndexToNode(index))
+                index = routing.NextVar(index).Value()
+            result = self._build_result(nodes)
+            if result['success']:
+                result['optimizer_used'] = 'ortools'
+                on_solution(result)
+        
+        routing.AddAtSolutionCallback(report_solution)
+    
+    def _initial_routes(self, initial_nodes: List[int]) -> List[List[int]]:
+        """Lộ trình khởi đầu cho từng vehicle (node 1..n)"""
+        return [self._complete_route(initial_nodes)]
+    
+    def _complete_route(self, nodes: List[int]) -> List[int]:
+        """
+        Model thăm tất cả địa điểm: chèn các node còn thiếu vào vị trí
+        làm tăng quãng đường ít nhất (constraints do OR-Tools kiểm tra khi đọc route)
+        """
+        route = list(nodes)
+        if self.optional_nodes:
+            return route
+        dist = self.solver_distance_matrix
+        for node in range(1, self.num_locations):
+            if node in route:
+                continue
+            path = [0] + route + [0]
+            best_pos = min(
+                range(len(route) + 1),
+                key=lambda pos: (dist[path[pos]][node] + dist[node][path[pos + 1]]
+                                 - dist[path[pos]][path[pos + 1]])
+            )
+            route.insert(best_pos, node)
+        return route
+    
     def _extract_solution(self, manager, routing, solution) -> Dict:
         """Trích xuất kết quả từ solution"""
+        nodes = []
+        index = solution.Value(routing.NextVar(routing.Start(0)))  # Bỏ qua start location
+        while not routing.IsEnd(index):
+            nodes.append(manager.IndexToNode(index))
+            index = solution.Value(routing.NextVar(index))
+        return self._build_result(nodes)
+    
+    def _build_result(self, nodes: List[int]) -> Dict:
+        """
+        Tạo Dict kết quả từ thứ tự thăm
+        
+        Args:
+            nodes: Các node theo thứ tự thăm (không gồm start location = node 0)
+        """
+        if not nodes:
+            # Orienteering có thể bỏ mọi địa điểm => coi như không có lộ trình
+            return {
+                'success': False,
+                'message': 'Không tìm thấy lộ trình phù hợp với các ràng buộc'
+            }
+        
         route = []
         total_time = 0
         total_distance = 0.0
         total_score = 0.0
         total_cost = 0
+        prev_node = 0
         
-        index = routing.Start(0)
-        prev_node = None
-        
-        while not routing.IsEnd(index):
-            node = manager.IndexToNode(index)
+        for node in nodes:
             location = self.locations[node]
             
-            # Tính travel time từ location trước
-            travel_time = 0
-            if prev_node is not None:
-                travel_time = self.time_matrix[prev_node][node]
-                travel_distance = self.distance_matrix[prev_node][node]
-                total_distance += travel_distance
+            # Tính travel time từ location trước (đến sớm thì chờ giờ mở cửa)
+            travel_time = int(self.time_matrix[prev_node, node])
+            total_distance += float(self.distance_matrix[prev_node, node])
+            arrival = total_time + travel_time
+            service_start = self.schedule.earliest_start(node, arrival)
+            if service_start is None:
+                service_start = arrival
             
             # Lấy thông tin location
             visit_time = location.get('visit_time', 60)
             price = location.get('price', 0)
             score = self.scores[node]
             
-            # Add vào route (bỏ qua start location trong output)
-            if node > 0:  # Không add start location
-                route.append({
-                    'id': location.get('id'),
-                    'name': location.get('name'),
-                    'type': location.get('type'),
-                    'latitude': location.get('latitude'),
-                    'longitude': location.get('longitude'),
-                    'location_address': location.get('location_address'),
-                    'price': price,
-                    'visit_time': visit_time,
-                    'travel_time': travel_time,
-                    'score': score,
-                    'opening_hours': location.get('opening_hours'),
-                    'facilities': location.get('facilities', []),
-                    'images': location.get('images', [])
-                })
-                
-                total_time += visit_time + travel_time
-                total_cost += price
-                total_score += score
+            route.append({
+                'id': location.get('id'),
+                'name': location.get('name'),
+                'type': location.get('type'),
+                'latitude': location.get('latitude'),
+                'longitude': location.get('longitude'),
+                'location_address': location.get('location_address'),
+                'price': price,
+                'visit_time': visit_time,
+                'travel_time': travel_time,
+                'arrival_time': self.schedule.clock(service_start),
+                'wait_time': service_start - arrival,
+                'score': score,
+                'opening_hours': location.get('opening_hours'),
+                'facilities': location.get('facilities', []),
+                'images': location.get('images', [])
+            })
             
+            total_time = service_start + visit_time
+            total_cost += price
+            total_score += score
             prev_node = node
-            index = solution.Value(routing.NextVar(index))
+        
+        # Chặng quay về start location (lộ trình khép kín, như time dimension của model)
+        total_time += int(self.time_matrix[prev_node, 0])
+        total_distance += float(self.distance_matrix[prev_node, 0])
         
         return {
             'success': True,
@@ -671,126 +1806,1425 @@ class RouteOptimizer:
 
 
 # ==============================================================================
-# TOUR RECOMMENDATION SERVICE - Service chính
+# MULTI-DAY ROUTE OPTIMIZER - Tour nhiều ngày trong một routing model
 # ==============================================================================
 
-class TourRecommendationService:
-    """Service chính cho tour recommendation"""
+class MultiDayRouteOptimizer(RouteOptimizer):
+    """
+    Tour nhiều ngày: mỗi ngày là một vehicle của cùng một routing model
+    
+    - Mỗi ngày xuất phát (và kết thúc) ở start location vào giờ bắt đầu tour,
+      time_available và max_locations tính cho từng ngày, giờ mở cửa áp như nhau mỗi ngày
+    - budget là ngân sách cho cả chuyến (ràng buộc trên tổng giá của mọi ngày)
+    - Orienteering: solver chọn địa điểm cho mọi ngày cùng lúc từ một tập ứng viên,
+      một ma trận khoảng cách (không có địa điểm nào bị thăm hai lần)
+    """
+    
+    def __init__(
+        self,
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    ):
+        """
+        Args:
+            destinations: Danh sách địa điểm đã có điểm
+            user: User profile (num_days = số ngày)
+            start_location: Điểm khởi hành (nơi lưu trú)
+            matrices: (distance, time) cho [start_location] + destinations (None = tự build)
+        """
+        super().__init__(destinations, user, start_location, matrices, optional_nodes=True)
+        self.num_vehicles = self.get_num_days(user)
     
     @staticmethod
-    def get_tour_recommendations(
-        db: Session,
-        user_profile: Dict,
-        start_location: Optional[Dict] = None,
-        user_id: Optional[int] = None,  # NEW: User ID for CF
-        use_cf: bool = True  # NEW: Enable/disable CF
-    ) -> Dict:
+    def get_num_days(user: Dict) -> int:
+        """Số ngày của tour (thiếu / không hợp lệ = 1)"""
+        return max(1, int(user.get('num_days') or 1))
+    
+    def _build_model(self) -> Tuple[pywrapcp.RoutingIndexManager, pywrapcp.RoutingModel]:
+        """Model của RouteOptimizer + ràng buộc ngân sách trên tổng mọi ngày"""
+        manager, routing = super()._build_model()
+        
+        # Budget dimension chỉ giới hạn từng ngày => thêm ràng buộc trên tổng giá
+        # các địa điểm được chọn (ActiveVar = 1)
+        if self.max_budget != float('inf'):
+            solver = routing.solver()
+            spent = [
+                routing.ActiveVar(manager.NodeToIndex(node)) * price
+                for node, price in enumerate(self.solver_prices)
+                if node > 0 and price > 0
+            ]
+            if spent:
+                solver.Add(solver.Sum(spent) <= int(self.max_budget))
+        
+        return manager, routing
+    
+    def _initial_routes(self, initial_nodes: List[List[int]]) -> List[List[int]]:
+        """initial_nodes: lộ trình khởi đầu của từng ngày (vd: sequential_days())"""
+        return [list(nodes) for nodes in initial_nodes]
+    
+    def _extract_solution(self, manager, routing, solution) -> Dict:
+        """Trích xuất lộ trình của từng ngày từ solution"""
+        days = []
+        for vehicle in range(self.num_vehicles):
+            nodes = []
+            index = solution.Value(routing.NextVar(routing.Start(vehicle)))
+            while not routing.IsEnd(index):
+                nodes.append(manager.IndexToNode(index))
+                index = solution.Value(routing.NextVar(index))
+            days.append(nodes)
+        return self._build_days_result(days)
+    
+    def sequential_days(self, local_search: bool = True) -> List[List[int]]:
         """
-        Tạo gợi ý tour cho user với Hybrid Recommendation (CB + CF)
+        Heuristic: lần lượt từng ngày, HeuristicOptimizer trên các địa điểm chưa thăm
+        với ngân sách còn lại (ma trận con cắt từ cùng ma trận)
         
-        Args:
-            db: Database session
-            user_profile: {
-                'type': 'Adventure' | 'Cultural' | 'Family' | 'Relaxation' | 'Budget',
-                'preference': ['nature', 'hiking', ...],
-                'budget': 1000000,
-                'time_available': 8,  # hours
-                'max_locations': 5
-            }
-            start_location: Điểm khởi hành (optional)
-            user_id: User ID for collaborative filtering (None = anonymous, content-based only)
-            use_cf: Enable collaborative filtering (False = content-based only)
-            
         Returns:
-            Dict với tour recommendations
+            Danh sách node (1..n) theo thứ tự thăm của từng ngày
+        """
+        remaining = list(range(1, self.num_locations))
+        budget_left = self.max_budget
+        days = []
+        for _ in range(self.num_vehicles):
+            nodes = []
+            if remaining:
+                index = [0] + remaining
+                heuristic = HeuristicOptimizer(
+                    [self.locations[node] for node in remaining],
+                    dict(self.user, budget=budget_left),
+                    self.start_location,
+                    (self.distance_matrix[np.ix_(index, index)], self.time_matrix[np.ix_(index, index)])
+                )
+                local_nodes = heuristic.local_search_nodes() if local_search else heuristic._greedy_nodes()
+                nodes = [remaining[node - 1] for node in local_nodes]
+            
+            days.append(nodes)
+            chosen = set(nodes)
+            remaining = [node for node in remaining if node not in chosen]
+            budget_left -= sum(self.solver_prices[node] for node in nodes)
+        return days
+    
+    def optimize_heuristic(self, local_search: bool = True) -> Dict:
+        """Lộ trình nhiều ngày bằng sequential_days (không cần OR-Tools)"""
+        result = self._build_days_result(self.sequential_days(local_search))
+        if result['success']:
+            result['optimizer_used'] = 'heuristic_local_search' if local_search else 'heuristic'
+        return result
+    
+    def _build_days_result(self, days: List[List[int]]) -> Dict:
         """
-        # 1. Lấy tất cả destinations từ database
-        destinations = db.query(Destination).filter(
-            Destination.is_active == True
-        ).all()
+        Tạo Dict kết quả từ thứ tự thăm của từng ngày
         
-        if not destinations:
+        route: mọi địa điểm theo thứ tự (mỗi địa điểm có 'day'), days: tổng kết từng ngày
+        """
+        route = []
+        day_summaries = []
+        for day, nodes in enumerate(days, start=1):
+            result = self._build_result(nodes) if nodes else {'success': False}
+            if not result['success']:
+                result = {'route': [], 'total_time': 0, 'total_distance': 0.0,
+                          'total_score': 0.0, 'total_cost': 0}
+            for location in result['route']:
+                location['day'] = day
+            route.extend(result['route'])
+            day_summaries.append({
+                'day': day,
+                'total_locations': len(result['route']),
+                'total_time': result['total_time'],
+                'total_distance': result['total_distance'],
+                'total_score': result['total_score'],
+                'total_cost': result['total_cost']
+            })
+        
+        if not route:
             return {
                 'success': False,
-                'message': 'Không có địa điểm nào trong hệ thống'
+                'message': 'Không tìm thấy lộ trình phù hợp với các ràng buộc'
             }
         
-        # Convert to dict
-        destinations_dict = [dest.to_dict() for dest in destinations]
-        print(f"DEBUG: Found {len(destinations_dict)} destinations")
-        
-        # 1.5. Filter destinations hợp lệ (tọa độ ở Việt Nam, visit_time hợp lý)
-        valid_destinations = []
-        for dest in destinations_dict:
-            lat = dest.get('latitude', 0)
-            lon = dest.get('longitude', 0)
-            visit_time = dest.get('visit_time', 0)
-            
-            # Vietnam: latitude 8-24, longitude 102-110
-            if (8 <= lat <= 24 and 102 <= lon <= 110 and 
-                visit_time > 0 and visit_time <= 600):  # Max 10 hours per location
-                valid_destinations.append(dest)
-            else:
-                print(f"DEBUG: Filtered out '{dest.get('name')}' - Invalid location ({lat}, {lon}) or visit_time ({visit_time})")
-        
-        print(f"DEBUG: Valid destinations after filtering: {len(valid_destinations)}")
+        total_score = sum(location['score'] for location in route)
+        return {
+            'success': True,
+            'route': route,
+            'days': day_summaries,
+            'total_locations': len(route),
+            'total_time': sum(summary['total_time'] for summary in day_summaries),
+            'total_distance': round(sum(summary['total_distance'] for summary in day_summaries), 2),
+            'total_score': round(total_score, 3),
+            'total_cost': sum(summary['total_cost'] for summary in day_summaries),
+            'avg_score': round(total_score / len(route), 3)
+        }
+
+
+# ==============================================================================
+# EXACT ROUTE SOLVER - Held-Karp (bitmask DP) cho tập địa điểm nhỏ
+# ==============================================================================
+
+class ExactRouteSolver(RouteOptimizer):
+    """
+    Giải chính xác cùng bài toán với RouteOptimizer bằng quy hoạch động Held-Karp
+    
+    - Cùng model: quay về điểm xuất phát, tổng thời gian (di chuyển + chờ mở cửa + tham quan,
+      kể cả chặng về) <= max_time, giờ mở cửa, tổng giá <= max_budget, tối thiểu tổng quãng đường
+      (đơn vị solver_distance_matrix) + phạt các địa điểm bị bỏ (orienteering)
+    - Thăm tất cả: chỉ xét tập đầy đủ; orienteering: xét mọi tập <= max_locations địa điểm
+    - Trạng thái (tập đã thăm, node cuối) giữ các nhãn Pareto (quãng đường, thời gian)
+      vì thời gian không tỉ lệ tuyệt đối với quãng đường (travel_time làm tròn)
+    - Cắt tỉa: thời gian hiện tại + tổng visit_time còn phải thăm > max_time,
+      tổng giá / số điểm dừng của tập vượt giới hạn
+    - O(2^n * n^2): dùng cho n <= settings.TOUR_EXACT_SOLVER_MAX_NODES
+    """
+    
+    def optimize(self, time_limit_ms: Optional[int] = None, **kwargs) -> Dict:
+        """
+        Tìm lộ trình tối ưu (time_limit_ms không dùng - số trạng thái đã bị chặn bởi n)
         
-        if not valid_destinations:
+        Returns:
+            Dict cùng format RouteOptimizer.optimize, optimizer_used = 'held_karp'
+        """
+        n = self.num_locations - 1
+        if n == 0 or (not self.optional_nodes and
+                      (sum(self.solver_prices) > self.max_budget or self._closed_nodes())):
             return {
                 'success': False,
-                'message': 'Không có địa điểm hợp lệ trong hệ thống'
+                'message': 'Không tìm thấy lộ trình phù hợp với các ràng buộc'
             }
         
-        # 4. Set default start location nếu không có (Sài Gòn center)
-        if not start_location:
-            start_location = {
-                'id': 0,
-                'name': 'Điểm khởi hành',
-                'latitude': 10.7769,
-                'longitude': 106.7009,
-                'visit_time': 0,
-                'price': 0
+        dist = self.solver_distance_matrix
+        travel = self.time_matrix.tolist()
+        earliest_start = self.schedule.earliest_start  # Chờ tới giờ mở cửa, None = không kịp
+        visit = [int(loc.get('visit_time', 60)) for loc in self.locations]
+        prices = self.solver_prices
+        max_time = self.max_time
+        max_budget = self.max_budget
+        max_stops = self.max_locations if self.optional_nodes else n
+        full = (1 << n) - 1
+        
+        # Theo từng tập: tổng giá, số địa điểm, tổng phạt đã "nhận" (không bị bỏ)
+        # và tổng visit_time còn bắt buộc phải thăm (cận dưới thời gian còn cần)
+        mask_price = [0] * (full + 1)
+        mask_count = [0] * (full + 1)
+        mask_prize = [0] * (full + 1)
+        for mask in range(1, full + 1):
+            low = mask & -mask
+            node = low.bit_length()
+            mask_price[mask] = mask_price[mask ^ low] + prices[node]
+            mask_count[mask] = mask_count[mask ^ low] + 1
+            mask_prize[mask] = mask_prize[mask ^ low] + self.drop_penalties[node]
+        total_visit = sum(visit[1:])
+        if self.optional_nodes:
+            remaining_visit = [0] * (full + 1)
+        else:
+            remaining_visit = [
+                total_visit - sum(visit[j] for j in range(1, n + 1) if mask & (1 << (j - 1)))
+                for mask in range(full + 1)
+            ]
+        
+        def allowed(mask: int, t: int) -> bool:
+            return (t + remaining_visit[mask] <= max_time and
+                    mask_price[mask] <= max_budget and
+                    mask_count[mask] <= max_stops)
+        
+        # labels[mask][j] = [(distance, time, prev_node, prev_label_index), ...]
+        # time = lúc tham quan xong j (kể cả thời gian chờ mở cửa). Đến sớm hơn không bao giờ
+        # làm xong muộn hơn => nhãn Pareto (quãng đường, thời gian) vẫn đúng khi có giờ mở cửa
+        labels: List[Dict[int, List[Tuple[int, int, int, int]]]] = [{} for _ in range(full + 1)]
+        for j in range(1, n + 1):
+            mask = 1 << (j - 1)
+            start = earliest_start(j, travel[0][j])
+            if start is None:
+                continue
+            t = start + visit[j]
+            if allowed(mask, t):
+                labels[mask][j] = [(dist[0][j], t, 0, -1)]
+        
+        for mask in range(1, full + 1):
+            if mask_count[mask] >= max_stops:
+                continue
+            for j, node_labels in labels[mask].items():
+                for label_index, (d, t, _, _) in enumerate(node_labels):
+                    for k in range(1, n + 1):
+                        bit = 1 << (k - 1)
+                        if mask & bit:
+                            continue
+                        new_mask = mask | bit
+                        start = earliest_start(k, t + travel[j][k])
+                        if start is None:
+                            continue
+                        new_t = start + visit[k]
+                        if not allowed(new_mask, new_t):
+                            continue
+                        self._add_label(
+                            labels[new_mask].setdefault(k, []),
+                            (d + dist[j][k], new_t, j, label_index)
+                        )
+        
+        # Đóng tour: quay về điểm xuất phát. Chi phí = quãng đường + phạt địa điểm bị bỏ.
+        # Bằng chi phí (vd: chiều ngược lại của cùng một tour) thì chọn tour có
+        # quãng đường tới điểm cuối ngắn hơn
+        best = None
+        total_prize = mask_prize[full]
+        for mask in (range(1, full + 1) if self.optional_nodes else (full,)):
+            for j, node_labels in labels[mask].items():
+                for label_index, (d, t, _, _) in enumerate(node_labels):
+                    if t + travel[j][0] > max_time:
+                        continue
+                    key = (d + dist[j][0] + total_prize - mask_prize[mask], d)
+                    if best is None or key < best[0]:
+                        best = (key, mask, j, label_index)
+        
+        if best is None:
+            return {
+                'success': False,
+                'message': 'Không tìm thấy lộ trình phù hợp với các ràng buộc'
             }
         
-        # 2. Filter theo khoảng cách (chỉ giữ địa điểm trong bán kính hợp lý)
-        start_lat = start_location.get('latitude', 10.7769)
-        start_lon = start_location.get('longitude', 106.7009)
-        
-        nearby_destinations = []
-        max_distance_km = 50  # Bán kính 50km
-        
-        for dest in valid_destinations:
-            dist = DistanceCalculator.haversine_distance(
-                start_lat, start_lon,
-                dest['latitude'], dest['longitude']
-            )
-            if dist <= max_distance_km:
-                nearby_destinations.append(dest)
-            else:
-                print(f"DEBUG: Filtered out '{dest['name']}' - Too far ({dist:.1f}km)")
-        
-        print(f"DEBUG: Nearby destinations: {len(nearby_destinations)}")
-        
-        if not nearby_destinations:
-            # Nếu không có địa điểm gần, mở rộng bán kính
-            print(f"DEBUG: No nearby destinations, expanding radius to 100km")
-            max_distance_km = 100
-            for dest in valid_destinations:
-                dist = DistanceCalculator.haversine_distance(
-                    start_lat, start_lon,
-                    dest['latitude'], dest['longitude']
-                )
-                if dist <= max_distance_km:
-                    nearby_destinations.append(dest)
+        # Truy vết ngược thứ tự thăm
+        nodes = []
+        _, mask, node, label_index = best
+        while node != 0:
+            nodes.append(node)
+            _, _, prev_node, prev_index = labels[mask][node][label_index]
+            mask ^= 1 << (node - 1)
+            node, label_index = prev_node, prev_index
+        nodes.reverse()
+        
+        result = self._build_result(nodes)
+        result['optimizer_used'] = 'held_karp'
+        return result
+    
+    @staticmethod
+    def _add_label(node_labels: List[Tuple[int, int, int, int]], label: Tuple[int, int, int, int]) -> None:
+        """Thêm nhãn nếu không bị nhãn nào trội hơn, bỏ các nhãn bị nó trội hơn"""
+        d, t = label[0], label[1]
+        for other in node_labels:
+            if other[0] <= d and other[1] <= t:
+                return
+        node_labels[:] = [o for o in node_labels if not (d <= o[0] and t <= o[1])]
+        node_labels.append(label)
+
+
+# ==============================================================================
+# ROUTE SOLVER PORTFOLIO - Chạy song song nhiều chiến lược, lấy kết quả tốt nhất
+# ==============================================================================
+
+class RouteSolverPortfolio:
+    """
+    Chạy nhiều chiến lược tối ưu cùng lúc và trả về lộ trình tốt nhất có được
+    khi hết deadline
+    
+    - Các biến thể OR-Tools chạy trong SolverPool (mỗi chiến lược một process)
+    - Greedy + local search chạy ngay trong process hiện tại trong lúc chờ
+      (rất nhanh, đảm bảo luôn có kết quả dự phòng)
+    - Ít địa điểm (<= TOUR_EXACT_SOLVER_MAX_NODES): Held-Karp thay cho OR-Tools
+    - Tốt nhất = total_score cao nhất, bằng điểm thì total_distance ngắn hơn
+    """
+    
+    # Tên chiến lược -> (FirstSolutionStrategy, LocalSearchMetaheuristic, warm start từ heuristic)
+    ORTOOLS_STRATEGIES = {
+        'ortools': ('AUTOMATIC', 'AUTOMATIC', False),
+        'ortools_warm_gls': ('AUTOMATIC', 'GUIDED_LOCAL_SEARCH', True),
+        'ortools_gls': ('PATH_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH', False),
+        'ortools_sa': ('SAVINGS', 'SIMULATED_ANNEALING', False),
+        'ortools_tabu': ('CHRISTOFIDES', 'TABU_SEARCH', False),
+    }
+    
+    @staticmethod
+    def run_ortools_strategy(
+        strategy: str,
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Tuple[np.ndarray, np.ndarray],
+        deadline: Deadline,
+        optional_nodes: bool = False
+    ) -> Dict:
+        """
+        Chạy một biến thể OR-Tools (task chạy trong process của SolverPool)
         
-        if not nearby_destinations:
+        Time limit tính từ deadline chung của portfolio lúc task thực sự bắt đầu:
+        task phải chờ trong pool (đã vào call queue nên không hủy được) không chạy
+        thêm trọn time limit sau deadline, hết thời gian thì kết thúc ngay
+        """
+        time_limit_ms = deadline.remaining_ms() - settings.TOUR_FALLBACK_RESERVE_MS
+        if time_limit_ms < settings.TOUR_MIN_SOLVER_TIME_MS:
             return {
                 'success': False,
-                'message': f'Không có địa điểm nào trong bán kính {max_distance_km}km'
+                'message': 'Hết thời gian cho phép trước khi chạy OR-Tools'
             }
         
-        # 3. Tính điểm HYBRID (Content-Based + Collaborative Filtering)
-        max_locations = min(user_profile.get('max_locations', 5), 6)  # Max 6 locations
+        first_solution_strategy, metaheuristic, warm_start = \
+            RouteSolverPortfolio.ORTOOLS_STRATEGIES[strategy]
+        initial_nodes = None
+        if warm_start:
+            initial_nodes = HeuristicOptimizer(
+                destinations, user, start_location, matrices
+            ).local_search_nodes()
+        optimizer = RouteOptimizer(destinations, user, start_location, matrices, optional_nodes)
+        result = optimizer.optimize(
+            time_limit_ms=time_limit_ms,
+            first_solution_strategy=first_solution_strategy,
+            local_search_metaheuristic=metaheuristic,
+            initial_nodes=initial_nodes
+        )
+        if result.get('success'):
+            result['optimizer_used'] = strategy
+        return result
+    
+    @staticmethod
+    def _rank_key(result: Dict) -> Tuple[float, float]:
+        return (result['total_score'], -result['total_distance'])
+    
+    @classmethod
+    def _submit_strategies(
+        cls,
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Tuple[np.ndarray, np.ndarray],
+        deadline: Deadline,
+        optional_nodes: bool = False
+    ) -> Tuple[Dict[Future, str], Optional[str]]:
+        """
+        Gửi các biến thể OR-Tools vào SolverPool (pool đầy thì chạy ít chiến lược hơn)
+        
+        Returns:
+            (futures, degraded) - degraded: 'latency_budget' (hết thời gian cho OR-Tools) |
+            'overload' (pool đầy, chạy thiếu chiến lược) | None
+        """
+        futures = {}
+        solver_time_ms = deadline.remaining_ms() - settings.TOUR_FALLBACK_RESERVE_MS
+        if len(destinations) <= settings.TOUR_EXACT_SOLVER_MAX_NODES:
+            # Held-Karp đã cho lời giải tối ưu => không cần OR-Tools
+            return futures, None
+        if not optional_nodes and FeasibilityChecker.visit_all_infeasible(user, destinations, matrices):
+            # Không thể thăm hết => OR-Tools chắc chắn thất bại, chỉ còn heuristic
+            return futures, None
+        if solver_time_ms < settings.TOUR_MIN_SOLVER_TIME_MS:
+            return futures, TourRecommendationService.DEGRADED_BUDGET
+        
+        degraded = None
+        
+        for strategy in list(cls.ORTOOLS_STRATEGIES)[:SolverPool.get_max_workers()]:
+            try:
+                future = SolverPool.submit(
+                    cls.run_ortools_strategy,
+                    strategy, destinations, user, start_location, matrices, deadline,
+                    optional_nodes
+                )
+            except SolverPoolOverloaded:
+                print(f"DEBUG: Solver pool full, portfolio runs {len(futures)} OR-Tools strategies")
+                degraded = TourRecommendationService.DEGRADED_OVERLOAD
+                break
+            futures[future] = strategy
+        print(f"DEBUG: Portfolio started {list(futures.values())} (time limit {solver_time_ms}ms)")
+        return futures, degraded
+    
+    @classmethod
+    def _pick_best(
+        cls,
+        futures: Dict[Future, str],
+        heuristic_results: List[Dict],
+        degraded: Optional[str] = None
+    ) -> Dict:
+        """
+        Hủy các chiến lược chưa xong và chọn kết quả tốt nhất trong số đã có
+        
+        Thiếu chiến lược (hết thời gian / pool đầy) => kết quả được đánh dấu degraded
+        
+        future.cancel() chỉ hủy được task còn chờ; task đang chạy giữ process và slot
+        của SolverPool (trả trong done callback, tức là khi task thực sự kết thúc) tới
+        khi chạm time limit - time limit tính từ cùng deadline (run_ortools_strategy)
+        nên task thua kết thúc muộn nhất khoảng deadline - TOUR_FALLBACK_RESERVE_MS
+        """
+        candidates = []
+        for future, strategy in futures.items():
+            if not future.done():
+                future.cancel()
+                print(f"DEBUG: Portfolio strategy {strategy} missed the deadline")
+                degraded = degraded or TourRecommendationService.DEGRADED_BUDGET
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"ERROR: Portfolio strategy {strategy} failed: {str(e)}")
+                continue
+            if result.get('success'):
+                candidates.append(result)
+        # OR-Tools đứng trước => bằng điểm thì ưu tiên lời giải của OR-Tools
+        candidates.extend(r for r in heuristic_results if r.get('success'))
+        
+        if not candidates:
+            return {
+                'success': False,
+                'message': 'Không tìm thấy lộ trình phù hợp với các ràng buộc'
+            }
+        
+        best = max(candidates, key=cls._rank_key)
+        print(f"DEBUG: Portfolio winner: {best['optimizer_used']} "
+              f"({len(candidates)} feasible results)")
+        return TourRecommendationService.mark_degraded(best, degraded)
+    
+    @staticmethod
+    def _run_heuristics(
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Tuple[np.ndarray, np.ndarray],
+        optional_nodes: bool = False
+    ) -> List[Dict]:
+        """Các chiến lược chạy ngay trong process hiện tại (Held-Karp nếu ít địa điểm)"""
+        results = []
+        if len(destinations) <= settings.TOUR_EXACT_SOLVER_MAX_NODES:
+            results.append(ExactRouteSolver(
+                destinations, user, start_location, matrices, optional_nodes
+            ).optimize())
+        heuristic = HeuristicOptimizer(destinations, user, start_location, matrices)
+        results.append(heuristic.optimize_local_search())  # Greedy + local search (>= greedy)
+        return results
+    
+    @classmethod
+    def solve(
+        cls,
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Tuple[np.ndarray, np.ndarray],
+        deadline: Deadline,
+        optional_nodes: bool = False
+    ) -> Dict:
+        """
+        Chạy portfolio và trả về kết quả tốt nhất trước deadline
+        
+        Returns:
+            Dict kết quả (format như RouteOptimizer.optimize), optimizer_used = chiến lược thắng
+        """
+        futures, degraded = cls._submit_strategies(
+            destinations, user, start_location, matrices, deadline, optional_nodes
+        )
+        
+        # Heuristic chạy ngay trong lúc các process OR-Tools đang search
+        heuristic_results = cls._run_heuristics(
+            destinations, user, start_location, matrices, optional_nodes
+        )
+        
+        if futures:
+            wait(futures, timeout=deadline.remaining_ms() / 1000)
+        return cls._pick_best(futures, heuristic_results, degraded)
+    
+    @classmethod
+    async def solve_async(
+        cls,
+        destinations: List[Dict],
+        user: Dict,
+        start_location: Dict,
+        matrices: Tuple[np.ndarray, np.ndarray],
+        deadline: Deadline,
+        optional_nodes: bool = False
+    ) -> Dict:
+        """Như solve() nhưng chờ kết quả mà không chặn event loop"""
+        futures, degraded = cls._submit_strategies(
+            destinations, user, start_location, matrices, deadline, optional_nodes
+        )
+        # Held-Karp + local search tốn CPU (tới vài trăm ms) => chạy trong threadpool
+        heuristic_results = await run_in_threadpool(
+            cls._run_heuristics, destinations, user, start_location, matrices, optional_nodes
+        )
+        
+        if futures:
+            await asyncio.wait(
+                [asyncio.wrap_future(future) for future in futures],
+                timeout=deadline.remaining_ms() / 1000
+            )
+        return cls._pick_best(futures, heuristic_results, degraded)
+
+
+# ==============================================================================
+# TOUR RECOMMENDATION SERVICE - Service chính
+# ==============================================================================
+
+class TourRecommendationService:
+    """
+    Service chính cho tour recommendation
+    
+    Pipeline gồm 3 bước để API có thể chạy từng bước ở nơi phù hợp:
+    1. prepare_tour_request: catalog, lọc, tính điểm, ma trận (cần db => threadpool)
+    2. solve_route: tối ưu lộ trình (CPU-heavy => SolverPool)
+    3. finalize_result: gắn metadata
+    
+    Request giống hệt: lấy từ TourResultCache, hoặc nếu đang được tính thì chờ
+    và dùng chung kết quả (single flight) thay vì chạy solver thêm lần nữa.
+    """
+    
+    _flights = SingleFlight()
+    _async_flights = AsyncSingleFlight()
+    
+    # Lý do kết quả kém hơn bình thường (result['degraded']) - không được cache
+    DEGRADED_BUDGET = 'latency_budget'  # Hết thời gian trước / trong khi chạy solver
+    DEGRADED_OVERLOAD = 'overload'  # SolverPool đầy / process giải chết => heuristic
+    
+    # Batch: số node tối đa của ma trận dùng chung (lớn hơn => mỗi item tự build ma trận)
+    SHARED_MATRIX_MAX_NODES = 2000
+    
+    @staticmethod
+    def get_tour_recommendations(
+        db: Session,
+        user_profile: Dict,
+        start_location: Optional[Dict] = None,
+        user_id: Optional[int] = None,  # NEW: User ID for CF
+        use_cf: bool = True,  # NEW: Enable/disable CF
+        latency_budget_ms: Optional[int] = None,
+        start_time: Optional[str] = None
+    ) -> Dict:
+        """
+        Tạo gợi ý tour cho user với Hybrid Recommendation (CB + CF)
+        
+        Chạy toàn bộ pipeline trong thread hiện tại (dùng cho script / test).
+        API dùng get_tour_recommendations_async để tối ưu trong SolverPool.
+        
+        Args:
+            db: Database session
+            user_profile: {
+                'type': 'Adventure' | 'Cultural' | 'Family' | 'Relaxation' | 'Budget',
+                'preference': ['nature', 'hiking', ...],
+                'budget': 1000000,  # cả chuyến
+                'time_available': 8,  # hours (mỗi ngày)
+                'max_locations': 5,  # mỗi ngày
+                'num_days': 1  # > 1: tour nhiều ngày, kết quả có 'days'
+            }
+            start_location: Điểm khởi hành (optional)
+            user_id: User ID for collaborative filtering (None = anonymous, content-based only)
+            use_cf: Enable collaborative filtering (False = content-based only)
+            latency_budget_ms: Tổng thời gian tối đa cho request (None = settings.TOUR_LATENCY_BUDGET_MS).
+                OR-Tools nhận phần thời gian còn lại, chừa lại một khoảng cho heuristic fallback.
+            start_time: Giờ bắt đầu tour "HH:MM" (None = settings.TOUR_START_TIME), dùng để
+                áp giờ mở cửa của từng địa điểm
+            
+        Returns:
+            Dict với tour recommendations
+        """
+        deadline = Deadline(latency_budget_ms or settings.TOUR_LATENCY_BUDGET_MS)
+        
+        cached = TourRecommendationService.get_cached_result(
+            user_profile, start_location, user_id, use_cf, start_time, deadline
+        )
+        if cached is not None:
+            return cached
+        
+        def run() -> Dict:
+            return TourRecommendationService._run_pipeline(
+                db, user_profile, start_location, user_id, use_cf, start_time, deadline
+            )
+        
+        key = TourRecommendationService.get_flight_key(
+            user_profile, start_location, user_id, use_cf, start_time
+        )
+        if key is None:
+            return run()
+        shared, result = TourRecommendationService._flights.do(key, run)
+        return TourRecommendationService.share_result(result) if shared else result
+    
+    @staticmethod
+    def _run_pipeline(
+        db: Session,
+        user_profile: Dict,
+        start_location: Optional[Dict],
+        user_id: Optional[int],
+        use_cf: bool,
+        start_time: Optional[str],
+        deadline: Deadline
+    ) -> Dict:
+        """prepare => solve => finalize trong thread hiện tại, lưu cache nếu được"""
+        prepared = TourRecommendationService.prepare_tour_request(
+            db, user_profile, start_location, user_id, use_cf, start_time
+        )
+        if not prepared['success']:
+            return prepared
+        
+        solve_args = (
+            prepared['destinations'],
+            prepared['user_profile'],
+            prepared['start_location'],
+            prepared['matrices'],
+            deadline,
+            prepared['optional_nodes']
+        )
+        multi_day = MultiDayRouteOptimizer.get_num_days(prepared['user_profile']) > 1
+        if settings.TOUR_SOLVER_PORTFOLIO and not multi_day:
+            # Portfolio: nhiều chiến lược song song, lấy kết quả tốt nhất khi hết deadline
+            result = RouteSolverPortfolio.solve(*solve_args)
+        else:
+            result = TourRecommendationService.solve_route(*solve_args)
+        
+        result = TourRecommendationService.finalize_result(result, prepared, deadline)
+        TourRecommendationService.cache_result(result, prepared, start_location, start_time)
+        return result
+    
+    @staticmethod
+    async def get_tour_recommendations_async(
+        db: Session,
+        user_profile: Dict,
+        start_location: Optional[Dict] = None,
+        user_id: Optional[int] = None,
+        use_cf: bool = True,
+        latency_budget_ms: Optional[int] = None,
+        start_time: Optional[str] = None,
+        num_alternatives: int = 1
+    ) -> Dict:
+        """
+        Như get_tour_recommendations nhưng không chặn event loop / threadpool của API:
+        bước chuẩn bị chạy trong threadpool, bước tối ưu chạy trong SolverPool
+        
+        num_alternatives > 1: kèm các phương án thay thế (get_tour_alternatives_async)
+        
+        Raises:
+            SolverPoolOverloaded: SolverPool đã đầy (API trả về 503)
+        """
+        if num_alternatives > 1:
+            return await TourRecommendationService.get_tour_alternatives_async(
+                db, user_profile, num_alternatives, start_location, user_id, use_cf,
+                latency_budget_ms, start_time
+            )
+        
+        deadline = Deadline(latency_budget_ms or settings.TOUR_LATENCY_BUDGET_MS)
+        
+        cached = TourRecommendationService.get_cached_result(
+            user_profile, start_location, user_id, use_cf, start_time, deadline
+        )
+        if cached is not None:
+            return cached
+        
+        def run() -> Awaitable[Dict]:
+            return TourRecommendationService._run_pipeline_async(
+                db, user_profile, start_location, user_id, use_cf, start_time, deadline
+            )
+        
+        key = TourRecommendationService.get_flight_key(
+            user_profile, start_location, user_id, use_cf, start_time
+        )
+        if key is None:
+            return await run()
+        shared, result = await TourRecommendationService._async_flights.do(key, run)
+        return TourRecommendationService.share_result(result) if shared else result
+    
+    @staticmethod
+    async def _run_pipeline_async(
+        db: Session,
+        user_profile: Dict,
+        start_location: Optional[Dict],
+        user_id: Optional[int],
+        use_cf: bool,
+        start_time: Optional[str],
+        deadline: Deadline
+    ) -> Dict:
+        """Như _run_pipeline: chuẩn bị trong threadpool, tối ưu trong SolverPool"""
+        prepared = await run_in_threadpool(
+            TourRecommendationService.prepare_tour_request,
+            db, user_profile, start_location, user_id, use_cf, start_time
+        )
+        if not prepared['success']:
+            return prepared
+        
+        solve_args = (
+            prepared['destinations'],
+            prepared['user_profile'],
+            prepared['start_location'],
+            prepared['matrices'],
+            deadline,
+            prepared['optional_nodes']
+        )
+        multi_day = MultiDayRouteOptimizer.get_num_days(prepared['user_profile']) > 1
+        if settings.TOUR_SOLVER_PORTFOLIO and not multi_day:
+            result = await RouteSolverPortfolio.solve_async(*solve_args)
+        else:
+            future = SolverPool.submit(TourRecommendationService.solve_route, *solve_args)
+            try:
+                result = await asyncio.wrap_future(future)
+            except BrokenProcessPool as e:
+                # Process con chết giữa chừng => vẫn trả về lộ trình greedy
+                print(f"ERROR: Solver process failed: {str(e)}")
+                result = TourRecommendationService.mark_degraded(
+                    TourRecommendationService.solve_heuristic(prepared),
+                    TourRecommendationService.DEGRADED_OVERLOAD
+                )
+        
+        result = TourRecommendationService.finalize_result(result, prepared, deadline)
+        TourRecommendationService.cache_result(result, prepared, start_location, start_time)
+        return result
+    
+    @staticmethod
+    async def stream_tour_recommendations(
+        db: Session,
+        user_profile: Dict,
+        start_location: Optional[Dict] = None,
+        user_id: Optional[int] = None,
+        use_cf: bool = True,
+        latency_budget_ms: Optional[int] = None,
+        start_time: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Gợi ý tour dạng streaming: trả từng bước thay vì chờ OR-Tools chạy hết
+        
+        Yields (event, data):
+            'initial': lộ trình greedy (ngay sau bước chuẩn bị)
+            'improved': mỗi lời giải OR-Tools tốt hơn lời giải trước
+            'final': kết quả cuối (như get_tour_recommendations_async), kết thúc stream
+            'error': {'success': False, 'message'} - không tạo được tour, kết thúc stream
+        
+        Luôn tối ưu bằng solve_route trong SolverPool (không dùng portfolio, không gộp
+        request giống hệt); kết quả từ cache chỉ có 'final'. Pool đầy / process con
+        lỗi => 'final' là lộ trình heuristic.
+        """
+        deadline = Deadline(latency_budget_ms or settings.TOUR_LATENCY_BUDGET_MS)
+        
+        cached = TourRecommendationService.get_cached_result(
+            user_profile, start_location, user_id, use_cf, start_time, deadline
+        )
+        if cached is not None:
+            yield 'final', cached
+            return
+        
+        prepared = await run_in_threadpool(
+            TourRecommendationService.prepare_tour_request,
+            db, user_profile, start_location, user_id, use_cf, start_time
+        )
+        if not prepared['success']:
+            yield 'error', prepared
+            return
+        
+        initial = await run_in_threadpool(TourRecommendationService.solve_greedy, prepared)
+        if initial.get('success'):
+            yield 'initial', TourRecommendationService.finalize_result(initial, prepared, deadline)
+        
+        channel = await run_in_threadpool(SolverPool.open_channel, asyncio.get_running_loop())
+        future = None
+        try:
+            future = SolverPool.submit(
+                TourRecommendationService.solve_route,
+                prepared['destinations'],
+                prepared['user_profile'],
+                prepared['start_location'],
+                prepared['matrices'],
+                deadline,
+                prepared['optional_nodes'],
+                channel.reporter
+            )
+            result_future = asyncio.wrap_future(future)
+            # Thread đọc chung của SolverPool đẩy lời giải trung gian vào channel; kết thúc
+            # khi task xong và đã nhận hết (không chiếm threadpool trong lúc chờ)
+            async for improved in channel.receive(result_future):
+                yield 'improved', TourRecommendationService.finalize_result(improved, prepared, deadline)
+            result = result_future.result()
+        except (SolverPoolOverloaded, BrokenProcessPool) as e:
+            print(f"ERROR: Streaming solve falls back to heuristic: {str(e)}")
+            result = TourRecommendationService.mark_degraded(
+                await run_in_threadpool(TourRecommendationService.solve_heuristic, prepared),
+                TourRecommendationService.DEGRADED_OVERLOAD
+            )
+        finally:
+            SolverPool.close_channel(channel)
+            if future is not None:
+                future.cancel()  # Client ngắt kết nối khi task còn chờ trong pool
+        
+        result = TourRecommendationService.finalize_result(result, prepared, deadline)
+        TourRecommendationService.cache_result(result, prepared, start_location, start_time)
+        if result.get('success'):
+            yield 'final', result
+        else:
+            yield 'error', result
+    
+    @staticmethod
+    async def get_batch_tour_recommendations_async(db: Session, items: List[Dict]) -> Dict:
+        """
+        Gợi ý tour cho nhiều profile trong một request (batch API)
+        
+        - Item đã có trong cache => trả luôn; các item giống hệt nhau trong batch chỉ tính một lần
+        - Bước chuẩn bị chung cho cả batch (prepare_batch_requests) chạy trong threadpool
+        - Tối ưu song song trong SolverPool, tối đa số process của pool cùng lúc; latency
+          budget của mỗi item tính từ lúc item bắt đầu được tối ưu, nhưng không vượt quá
+          phần còn lại của TOUR_BATCH_LATENCY_BUDGET_MS (tính từ lúc nhận request). Batch
+          không dùng portfolio (mỗi item đã chiếm một process)
+        - Item chưa được tối ưu khi deadline của batch sắp hết => lộ trình greedy
+          (degraded = 'latency_budget')
+        - Pool đầy / process con lỗi => item đó dùng heuristic trong threadpool
+        
+        Args:
+            items: [{'user_profile', 'start_location', 'user_id', 'use_cf',
+                     'latency_budget_ms', 'start_time'}]
+            
+        Returns:
+            {'success', 'total', 'succeeded', 'failed', 'elapsed_ms',
+             'results': [{'index', 'success', 'result' | 'error'}]} theo đúng thứ tự items
+        """
+        started = time.monotonic()
+        batch_deadline = Deadline(settings.TOUR_BATCH_LATENCY_BUDGET_MS)
+        if len(items) > settings.TOUR_BATCH_MAX_ITEMS:
+            return {
+                'success': False,
+                'message': f'Batch tối đa {settings.TOUR_BATCH_MAX_ITEMS} request (nhận {len(items)})'
+            }
+        
+        results: List[Any] = [None] * len(items)
+        first_by_key = {}  # flight key -> index của item đầu tiên
+        duplicates = {}  # index -> index của item giống hệt được tính
+        to_prepare = []
+        for index, item in enumerate(items):
+            request_args = (
+                item['user_profile'], item.get('start_location'), item.get('user_id'),
+                item.get('use_cf', True), item.get('start_time')
+            )
+            cached = TourRecommendationService.get_cached_result(
+                *request_args,
+                Deadline(item.get('latency_budget_ms') or settings.TOUR_LATENCY_BUDGET_MS)
+            )
+            if cached is not None:
+                results[index] = cached
+                continue
+            
+            key = TourRecommendationService.get_flight_key(*request_args)
+            if key is not None and key in first_by_key:
+                duplicates[index] = first_by_key[key]
+                continue
+            if key is not None:
+                first_by_key[key] = index
+            to_prepare.append(index)
+        
+        print(f"DEBUG: Batch {len(items)} items: {len(items) - len(to_prepare) - len(duplicates)} cached, "
+              f"{len(duplicates)} duplicates, {len(to_prepare)} to solve")
+        
+        prepared_items = await run_in_threadpool(
+            TourRecommendationService.prepare_batch_requests, db, [items[i] for i in to_prepare]
+        )
+        semaphore = asyncio.Semaphore(SolverPool.get_max_workers())
+        
+        async def solve(index: int, prepared: Dict) -> Dict:
+            if not prepared['success']:
+                return prepared
+            
+            item = items[index]
+            async with semaphore:
+                deadline = Deadline(
+                    item.get('latency_budget_ms') or settings.TOUR_LATENCY_BUDGET_MS
+                ).cap(batch_deadline)
+                solver_time_ms = batch_deadline.remaining_ms() - settings.TOUR_FALLBACK_RESERVE_MS
+                if solver_time_ms < settings.TOUR_MIN_SOLVER_TIME_MS:
+                    # Batch sắp hết giờ => không chiếm process nữa, trả lộ trình greedy (vài ms)
+                    print(f"DEBUG: Batch item {index} starts after the batch deadline, using greedy route")
+                    result = TourRecommendationService.mark_degraded(
+                        await run_in_threadpool(TourRecommendationService.solve_greedy, prepared),
+                        TourRecommendationService.DEGRADED_BUDGET
+                    )
+                else:
+                    try:
+                        future = SolverPool.submit(
+                            TourRecommendationService.solve_route,
+                            prepared['destinations'],
+                            prepared['user_profile'],
+                            prepared['start_location'],
+                            prepared['matrices'],
+                            deadline,
+                            prepared['optional_nodes']
+                        )
+                        result = await asyncio.wrap_future(future)
+                    except (SolverPoolOverloaded, BrokenProcessPool) as e:
+                        print(f"ERROR: Batch item {index} falls back to heuristic: {str(e)}")
+                        result = TourRecommendationService.mark_degraded(
+                            await run_in_threadpool(TourRecommendationService.solve_heuristic, prepared),
+                            TourRecommendationService.DEGRADED_OVERLOAD
+                        )
+            
+            result = TourRecommendationService.finalize_result(result, prepared, deadline)
+            TourRecommendationService.cache_result(
+                result, prepared, item.get('start_location'), item.get('start_time')
+            )
+            return result
+        
+        solved = await asyncio.gather(
+            *(solve(index, prepared) for index, prepared in zip(to_prepare, prepared_items)),
+            return_exceptions=True
+        )
+        for index, result in zip(to_prepare, solved):
+            results[index] = result
+        for index, origin in duplicates.items():
+            result = results[origin]
+            results[index] = result if isinstance(result, BaseException) else TourRecommendationService.share_result(result)
+        
+        entries = []
+        for index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                print(f"ERROR: Batch item {index} failed: {str(result)}")
+                entries.append({
+                    'index': index,
+                    'success': False,
+                    'error': str(result) or type(result).__name__
+                })
+            elif result.get('success'):
+                entries.append({'index': index, 'success': True, 'result': result})
+            else:
+                entries.append({
+                    'index': index,
+                    'success': False,
+                    'error': result.get('message', 'Không thể tạo tour')
+                })
+        
+        succeeded = sum(1 for entry in entries if entry['success'])
+        return {
+            'success': True,
+            'total': len(items),
+            'succeeded': succeeded,
+            'failed': len(items) - succeeded,
+            'results': entries,
+            'elapsed_ms': int((time.monotonic() - started) * 1000)
+        }
+    
+    @staticmethod
+    async def get_tour_alternatives_async(
+        db: Session,
+        user_profile: Dict,
+        num_alternatives: int,
+        start_location: Optional[Dict] = None,
+        user_id: Optional[int] = None,
+        use_cf: bool = True,
+        latency_budget_ms: Optional[int] = None,
+        start_time: Optional[str] = None
+    ) -> Dict:
+        """
+        Tour chính + tối đa num_alternatives - 1 phương án thay thế khác nhau
+        
+        - Một lần chuẩn bị (tính điểm, ma trận) cho mọi phương án, ứng viên theo orienteering
+        - Đa dạng: diversify_destinations giảm điểm các địa điểm đã dùng ở phương án trước
+        - Các phương án được tối ưu song song trong SolverPool (pool đầy / process con
+          lỗi => phương án đó dùng lộ trình heuristic đã có)
+        
+        Returns:
+            Kết quả như get_tour_recommendations_async (phương án đầu tiên) + 'alternatives':
+            các phương án còn lại (bỏ phương án trùng lộ trình)
+        """
+        deadline = Deadline(latency_budget_ms or settings.TOUR_LATENCY_BUDGET_MS)
+        user_profile = dict(user_profile, num_alternatives=num_alternatives)
+        
+        cached = TourRecommendationService.get_cached_result(
+            user_profile, start_location, user_id, use_cf, start_time, deadline
+        )
+        if cached is not None:
+            return cached
+        
+        prepared = await run_in_threadpool(
+            TourRecommendationService.prepare_tour_request,
+            db, user_profile, start_location, user_id, use_cf, start_time
+        )
+        if not prepared['success']:
+            return prepared
+        
+        variants, heuristic_results = await run_in_threadpool(
+            TourRecommendationService.diversify_destinations, prepared, num_alternatives
+        )
+        scores = {dest['id']: dest['score'] for dest in prepared['destinations']}
+        
+        async def solve(destinations: List[Dict], heuristic_result: Dict) -> Dict:
+            try:
+                future = SolverPool.submit(
+                    TourRecommendationService.solve_route,
+                    destinations,
+                    prepared['user_profile'],
+                    prepared['start_location'],
+                    prepared['matrices'],
+                    deadline,
+                    prepared['optional_nodes']
+                )
+                result = await asyncio.wrap_future(future)
+            except (SolverPoolOverloaded, BrokenProcessPool) as e:
+                print(f"ERROR: Alternative tour falls back to heuristic: {str(e)}")
+                result = TourRecommendationService.mark_degraded(
+                    dict(heuristic_result), TourRecommendationService.DEGRADED_OVERLOAD
+                )
+            return TourRecommendationService.restore_scores(result, scores)
+        
+        solved = await asyncio.gather(*(
+            solve(destinations, heuristic_result)
+            for destinations, heuristic_result in zip(variants, heuristic_results)
+        ))
+        
+        alternatives = []
+        seen_routes = set()
+        for result in solved:
+            if not result.get('success'):
+                continue
+            route_ids = tuple((location['id'], location.get('day')) for location in result['route'])
+            if route_ids not in seen_routes:
+                seen_routes.add(route_ids)
+                alternatives.append(result)
+        print(f"DEBUG: {len(alternatives)}/{num_alternatives} distinct alternative tours")
+        
+        if alternatives:
+            result = dict(alternatives[0], alternatives=alternatives[1:])
+            # Một phương án bị rút gọn => cả response không được cache
+            degraded = next((alt['degraded'] for alt in alternatives if alt.get('degraded')), None)
+            result = TourRecommendationService.mark_degraded(result, degraded)
+        else:
+            result = solved[0]
+        
+        result = TourRecommendationService.finalize_result(result, prepared, deadline)
+        TourRecommendationService.cache_result(result, prepared, start_location, start_time)
+        return result
+    
+    @staticmethod
+    def diversify_destinations(
+        prepared: Dict,
+        num_alternatives: int
+    ) -> Tuple[List[List[Dict]], List[Dict]]:
+        """
+        Danh sách ứng viên cho từng phương án: điểm của địa điểm đã có trong lộ trình
+        heuristic của các phương án trước nhân với (1 - TOUR_ALTERNATIVE_PENALTY) mỗi lần
+        
+        Lộ trình heuristic (vài ms) thay cho lời giải OR-Tools khi phạt => các phương án
+        tối ưu song song được; phương án đầu tiên giữ nguyên điểm.
+        
+        Returns:
+            (destinations của từng phương án, lộ trình heuristic của từng phương án)
+        """
+        destinations = prepared['destinations']
+        base_scores = np.array([dest['score'] for dest in destinations], dtype=np.float64)
+        position_by_id = {dest['id']: i for i, dest in enumerate(destinations)}
+        used = np.zeros(len(destinations))
+        
+        variants = []
+        heuristic_results = []
+        for _ in range(num_alternatives):
+            weights = base_scores * (1 - settings.TOUR_ALTERNATIVE_PENALTY) ** used
+            variant = [
+                dict(dest, score=round(float(weight), 4))
+                for dest, weight in zip(destinations, weights)
+            ]
+            result = TourRecommendationService.solve_heuristic(dict(prepared, destinations=variant))
+            for location in result.get('route', []):
+                used[position_by_id[location['id']]] += 1
+            variants.append(variant)
+            heuristic_results.append(result)
+        return variants, heuristic_results
+    
+    @staticmethod
+    async def replan_tour_async(
+        db: Session,
+        user_profile: Dict,
+        current_location: Dict,
+        elapsed_minutes: int,
+        visited_ids: List[int],
+        remaining_ids: List[int],
+        added_ids: Optional[List[int]] = None,
+        start_time: Optional[str] = None,
+        latency_budget_ms: Optional[int] = None
+    ) -> Dict:
+        """
+        Sửa lộ trình đang đi dở (bỏ qua địa điểm, bị trễ, thêm địa điểm)
+        
+        - Sửa nhanh bằng RouteRepairer trên ma trận của các địa điểm còn lại / mới thêm
+        - Chỉ khi lộ trình sửa giữ ít hơn TOUR_REPLAN_MIN_KEEP_RATIO số địa điểm yêu cầu:
+          giải lại toàn bộ (orienteering trên ứng viên quanh vị trí hiện tại) trong
+          SolverPool, lấy lộ trình có tổng điểm cao hơn
+        
+        Args:
+            current_location: Vị trí hiện tại {'latitude', 'longitude'}
+            elapsed_minutes: Số phút đã đi tính từ giờ bắt đầu tour
+            visited_ids: Địa điểm đã thăm (trừ vào ngân sách / số địa điểm, không thăm lại)
+            remaining_ids: Phần còn lại của lộ trình theo thứ tự (bỏ id = bỏ qua địa điểm)
+            added_ids: Địa điểm muốn thêm
+            start_time: Giờ bắt đầu tour "HH:MM" (None = settings.TOUR_START_TIME)
+            latency_budget_ms: None = settings.TOUR_REPLAN_LATENCY_BUDGET_MS
+        
+        Returns:
+            Kết quả như get_tour_recommendations (phần còn lại của tour, giờ theo đồng hồ)
+            + 'replan': {'strategy' ('repair' | 'full_solve'), 'current_time', 'time_left',
+            'budget_left', 'dropped_ids', 'elapsed_ms'}
+        """
+        deadline = Deadline(latency_budget_ms or settings.TOUR_REPLAN_LATENCY_BUDGET_MS)
+        
+        prepared = await run_in_threadpool(
+            TourRecommendationService.prepare_replan,
+            db, user_profile, current_location, elapsed_minutes, visited_ids,
+            remaining_ids, added_ids, start_time
+        )
+        if not prepared['success']:
+            return prepared
+        
+        result = await run_in_threadpool(TourRecommendationService.repair_route, prepared)
+        strategy = 'repair'
+        
+        requested = len(prepared['route_nodes']) + len(prepared['added_nodes'])
+        kept = result['total_locations'] if result.get('success') else 0
+        if not kept or kept < requested * settings.TOUR_REPLAN_MIN_KEEP_RATIO:
+            print(f"DEBUG: Repair kept {kept}/{requested} stops, escalating to full solve")
+            full_prepared = await run_in_threadpool(
+                TourRecommendationService.prepare_replan_full_solve, db, prepared, user_profile
+            )
+            full_result = None
+            degraded = None
+            if full_prepared['success']:
+                try:
+                    future = SolverPool.submit(
+                        TourRecommendationService.solve_route,
+                        full_prepared['destinations'],
+                        full_prepared['user_profile'],
+                        full_prepared['start_location'],
+                        full_prepared['matrices'],
+                        deadline,
+                        True
+                    )
+                    full_result = await asyncio.wrap_future(future)
+                except (SolverPoolOverloaded, BrokenProcessPool) as e:
+                    print(f"ERROR: Replan full solve skipped: {str(e)}")
+                    degraded = TourRecommendationService.DEGRADED_OVERLOAD
+            
+            if full_result and full_result.get('success') and (
+                not result.get('success') or full_result['total_score'] > result['total_score']
+            ):
+                result = full_result
+                strategy = 'full_solve'
+            else:
+                result = TourRecommendationService.mark_degraded(result, degraded)
+        
+        if result.get('success'):
+            route_ids = {location['id'] for location in result['route']}
+            profile = prepared['user_profile']
+            result['replan'] = {
+                'strategy': strategy,
+                'current_time': prepared['start_time'],
+                'time_left': int(profile['time_available'] * 60),
+                'budget_left': profile['budget'],
+                'dropped_ids': [
+                    dest['id'] for dest in prepared['destinations'][:requested]
+                    if dest['id'] not in route_ids
+                ],
+                'elapsed_ms': deadline.elapsed_ms()
+            }
+        return result
+    
+    @staticmethod
+    def prepare_replan(
+        db: Session,
+        user_profile: Dict,
+        current_location: Dict,
+        elapsed_minutes: int,
+        visited_ids: List[int],
+        remaining_ids: List[int],
+        added_ids: Optional[List[int]] = None,
+        start_time: Optional[str] = None
+    ) -> Dict:
+        """
+        Dữ liệu cho re-plan: giới hạn còn lại của tour, các địa điểm còn lại + mới thêm
+        (điểm content-based theo profile gốc) và ma trận với vị trí hiện tại là node 0
+        
+        Returns:
+            {'success': False, 'message'} hoặc {'success': True, 'destinations' (còn lại
+            rồi mới thêm), 'route_nodes', 'added_nodes', 'user_profile' (giới hạn còn lại),
+            'start_location', 'matrices', 'start_time' (giờ hiện tại), 'visited_ids'}
+        """
+        # elapsed_minutes / visited_ids không cho biết đang ở ngày nào và địa điểm nào thuộc
+        # ngày hiện tại => chưa sửa được tour nhiều ngày, báo rõ thay vì gộp thành một ngày
+        num_days = MultiDayRouteOptimizer.get_num_days(user_profile)
+        if num_days > 1:
+            return {
+                'success': False,
+                'message': f'Re-plan chỉ hỗ trợ tour một ngày (num_days = {num_days}), '
+                           f'hãy gửi profile của ngày hiện tại với num_days = 1'
+            }
+        
+        catalog = DestinationCatalog.get_snapshot(db)
+        
+        tour_start_minutes = OpeningHours.parse_clock(start_time or settings.TOUR_START_TIME)
+        if tour_start_minutes is None:
+            return {
+                'success': False,
+                'message': f'Giờ bắt đầu tour không hợp lệ: {start_time} (định dạng HH:MM)'
+            }
+        
+        visited = set(visited_ids)
+        remaining = [dest_id for dest_id in dict.fromkeys(remaining_ids) if dest_id not in visited]
+        added = [
+            dest_id for dest_id in dict.fromkeys(added_ids or [])
+            if dest_id not in visited and dest_id not in remaining
+        ]
+        missing = [dest_id for dest_id in remaining + added if catalog.get(dest_id) is None]
+        if missing:
+            return {
+                'success': False,
+                'message': f'Không tìm thấy địa điểm: {missing}'
+            }
+        
+        # Giới hạn còn lại của tour (cùng giới hạn số địa điểm với lúc gợi ý)
+        max_locations = TourRecommendationService.get_routing_options(user_profile)[0]
+        time_left = user_profile.get('time_available', 8) * 60 - elapsed_minutes
+        stops_left = max_locations - len(visited)
+        if time_left <= 0 or stops_left <= 0:
+            return {
+                'success': False,
+                'message': 'Tour đã dùng hết thời gian hoặc số địa điểm cho phép'
+            }
+        spent = sum(
+            catalog.get(dest_id).get('price', 0) for dest_id in visited if catalog.get(dest_id)
+        )
+        current_minutes = tour_start_minutes + elapsed_minutes
+        replan_profile = dict(
+            user_profile,
+            budget=max(0, user_profile.get('budget', float('inf')) - spent),
+            time_available=time_left / 60,
+            max_locations=stops_left,
+            tour_start_minutes=current_minutes % OpeningHours.MINUTES_PER_DAY  # Tour qua nửa đêm
+        )
+        
+        start_location = {
+            'id': 0,
+            'name': 'Vị trí hiện tại',
+            'latitude': current_location['latitude'],
+            'longitude': current_location['longitude'],
+            'visit_time': 0,
+            'price': 0
+        }
+        
+        positions = np.array([catalog.index_by_id[dest_id] for dest_id in remaining + added], dtype=np.intp)
+        scores = ScoringEngine.calculate_scores_batch(user_profile, catalog.features.subset(positions))
+        destinations = [
+            TourRecommendationService.to_routing_destination(dest, float(score))
+            for dest, score in zip(catalog.take(positions), scores)
+        ]
+        
+        # Ma trận cắt từ store precompute nếu có, chỉ hàng của vị trí hiện tại tính mới
+        matrices = DistanceCalculator.build_route_matrices(start_location, destinations)
+        
+        return {
+            'success': True,
+            'destinations': destinations,
+            'route_nodes': list(range(1, len(remaining) + 1)),
+            'added_nodes': list(range(len(remaining) + 1, len(remaining) + len(added) + 1)),
+            'user_profile': replan_profile,
+            'start_location': start_location,
+            'matrices': matrices,
+            'start_time': OpeningHours.format_clock(current_minutes),
+            'visited_ids': sorted(visited)
+        }
+    
+    @staticmethod
+    def repair_route(prepared: Dict) -> Dict:
+        """Sửa lộ trình còn lại bằng RouteRepairer (không cần SolverPool)"""
+        return RouteRepairer(
+            prepared['destinations'], prepared['user_profile'],
+            prepared['start_location'], prepared['matrices']
+        ).optimize_repair(prepared['route_nodes'], prepared['added_nodes'])
+    
+    @staticmethod
+    def prepare_replan_full_solve(db: Session, prepared: Dict, user_profile: Dict) -> Dict:
+        """
+        Ứng viên cho re-plan giải lại toàn bộ: địa điểm còn lại / mới thêm + top địa điểm
+        (content-based) quanh vị trí hiện tại còn khả thi, trừ các địa điểm đã thăm
+        """
+        catalog = DestinationCatalog.get_snapshot(db)
+        candidates = TourRecommendationService.select_candidates(
+            catalog, prepared['user_profile'], prepared['start_location'], prepared['start_time']
+        )
+        destinations = list(prepared['destinations'])
+        if candidates['success']:
+            excluded = set(prepared['visited_ids']) | {dest['id'] for dest in destinations}
+            keep = np.array(
+                [catalog.destinations[position]['id'] not in excluded for position in candidates['positions']],
+                dtype=bool
+            )
+            ranked = ScoringEngine.rank_destinations(
+                user_profile,
+                catalog.take(candidates['positions'][keep]),
+                top_n=settings.TOUR_ORIENTEERING_CANDIDATES,
+                features=candidates['features'].subset(np.flatnonzero(keep))
+            )
+            destinations += [
+                TourRecommendationService.to_routing_destination(dest, score)
+                for dest, score in ranked
+            ]
+        
+        if not destinations:
+            return {
+                'success': False,
+                'message': 'Không còn địa điểm nào phù hợp'
+            }
+        
+        return dict(
+            prepared,
+            destinations=destinations,
+            matrices=DistanceCalculator.build_route_matrices(prepared['start_location'], destinations)
+        )
+    
+    @staticmethod
+    def restore_scores(result: Dict, scores: Dict[int, float]) -> Dict:
+        """Điểm thật (trước khi phạt) cho lộ trình của một phương án, tính lại các tổng"""
+        if not result.get('success'):
+            return result
+        
+        for location in result['route']:
+            location['score'] = scores[location['id']]
+        total_score = sum(location['score'] for location in result['route'])
+        result['total_score'] = round(total_score, 3)
+        result['avg_score'] = round(total_score / len(result['route']), 3) if result['route'] else 0
+        for summary in result.get('days') or []:
+            summary['total_score'] = round(sum(
+                location['score'] for location in result['route']
+                if location.get('day') == summary['day']
+            ), 3)
+        return result
+    
+    @staticmethod
+    def prepare_tour_request(
+        db: Session,
+        user_profile: Dict,
+        start_location: Optional[Dict] = None,
+        user_id: Optional[int] = None,
+        use_cf: bool = True,
+        start_time: Optional[str] = None
+    ) -> Dict:
+        """
+        Bước 1: chọn và tính điểm địa điểm, build ma trận cho bước tối ưu
+        
+        Returns:
+            {'success': False, 'message': ...} hoặc {'success': True, 'destinations',
+            'start_location', 'matrices', ...} (dữ liệu thuần, gửi được sang process khác)
+        """
+        # 1. Lấy snapshot catalog (load từ database một lần cho mỗi worker)
+        catalog = DestinationCatalog.get_snapshot(db)
+        
+        if not len(catalog):
+            return {
+                'success': False,
+                'message': 'Không có địa điểm nào trong hệ thống'
+            }
+        
+        print(f"DEBUG: Catalog v{catalog.version}: {len(catalog)} destinations")
+        
+        # 1.5. Destinations hợp lệ (tọa độ ở Việt Nam, visit_time hợp lý) - đã lọc sẵn trong snapshot
+        valid_positions = catalog.valid_positions
+        print(f"DEBUG: Valid destinations after filtering: {len(valid_positions)}")
+        
+        if not len(valid_positions):
+            return {
+                'success': False,
+                'message': 'Không có địa điểm hợp lệ trong hệ thống'
+            }
+        
+        candidates = TourRecommendationService.select_candidates(
+            catalog, user_profile, start_location, start_time
+        )
+        if not candidates['success']:
+            return candidates
+        
+        user_profile = candidates['user_profile']
+        start_location = candidates['start_location']
+        nearby_positions = candidates['positions']
+        nearby_features = candidates['features']
+        
+        nearby_destinations = catalog.take(nearby_positions)
+        
+        # 3. Tính điểm HYBRID (Content-Based + Collaborative Filtering)
+        max_locations, optional_nodes, top_n = TourRecommendationService.get_routing_options(
+            user_profile
+        )
         
         if use_cf and user_id:
             # Use hybrid scoring (CB + CF)
@@ -801,16 +3235,15 @@ class TourRecommendationService:
                 db=db,
                 user_id=user_id,
                 use_cf=True,
-                top_n=max_locations
+                top_n=top_n,
+                features=nearby_features
             )
             
             # Prepare destinations for routing with metadata
-            routing_destinations = []
-            for dest, score, metadata in scored_destinations:
-                dest_copy = dest.copy()
-                dest_copy['score'] = score
-                dest_copy['scoring_metadata'] = metadata
-                routing_destinations.append(dest_copy)
+            routing_destinations = [
+                TourRecommendationService.to_routing_destination(dest, score, metadata)
+                for dest, score, metadata in scored_destinations
+            ]
                 
             scoring_method = 'hybrid'
         else:
@@ -819,19 +3252,15 @@ class TourRecommendationService:
             scored_destinations = ScoringEngine.rank_destinations(
                 user_profile,
                 nearby_destinations,
-                top_n=max_locations
+                top_n=top_n,
+                features=nearby_features
             )
             
             # Prepare destinations for routing
-            routing_destinations = []
-            for dest, score in scored_destinations:
-                dest_copy = dest.copy()
-                dest_copy['score'] = score
-                dest_copy['scoring_metadata'] = {
-                    'cb_score': round(score, 3),
-                    'scoring_method': 'content_based'
-                }
-                routing_destinations.append(dest_copy)
+            routing_destinations = [
+                TourRecommendationService.to_routing_destination(dest, score)
+                for dest, score in scored_destinations
+            ]
                 
             scoring_method = 'content_based'
         
@@ -839,37 +3268,558 @@ class TourRecommendationService:
         
         print(f"DEBUG: Routing destinations: {len(routing_destinations)}")
         
-        # 5. Try OR-Tools optimizer first
-        print(f"DEBUG: Attempting OR-Tools optimization...")
-        optimizer = RouteOptimizer(routing_destinations, user_profile, start_location)
-        result = optimizer.optimize()
+        # Ma trận dùng chung cho OR-Tools và heuristic (cắt từ store precompute nếu có)
+        matrices = DistanceCalculator.build_route_matrices(start_location, routing_destinations)
+        
+        return {
+            'success': True,
+            'destinations': routing_destinations,
+            'user_profile': dict(user_profile, max_locations=max_locations),
+            'start_location': start_location,
+            'matrices': matrices,
+            'optional_nodes': optional_nodes,
+            'scoring_method': scoring_method,
+            'user_id': user_id,
+            'cf_enabled': use_cf and user_id is not None,
+            'catalog_version': catalog.version,
+            'total_destinations_considered': len(nearby_destinations)
+        }
+    
+    @staticmethod
+    def prepare_batch_requests(db: Session, items: List[Dict]) -> List[Dict]:
+        """
+        Bước 1 cho nhiều request cùng lúc (batch API), kết quả giống prepare_tour_request
+        
+        - Một catalog snapshot cho cả batch
+        - Điểm content-based của mọi profile: một lần calculate_scores_matrix trên
+          hợp các địa điểm ứng viên (item có CF vẫn tính hybrid riêng)
+        - Một ma trận khoảng cách chung cho mọi điểm khởi hành + địa điểm được chọn,
+          mỗi item chỉ cắt ma trận con
         
-        # 6. Fallback to heuristic if OR-Tools fails
+        Args:
+            items: [{'user_profile', 'start_location', 'user_id', 'use_cf', 'start_time'}]
+            
+        Returns:
+            List kết quả theo đúng thứ tự items
+        """
+        catalog = DestinationCatalog.get_snapshot(db)
+        if not len(catalog.valid_positions):
+            return [{
+                'success': False,
+                'message': 'Không có địa điểm hợp lệ trong hệ thống'
+            } for _ in items]
+        
+        print(f"DEBUG: Batch of {len(items)} requests on catalog v{catalog.version}")
+        
+        candidates = [
+            TourRecommendationService.select_candidates(
+                catalog, item['user_profile'], item.get('start_location'), item.get('start_time')
+            )
+            for item in items
+        ]
+        selected = [i for i, candidate in enumerate(candidates) if candidate['success']]
+        
+        def uses_cf(i: int) -> bool:
+            return bool(items[i].get('use_cf', True) and items[i].get('user_id'))
+        
+        def get_top_n(i: int) -> int:
+            return TourRecommendationService.get_routing_options(candidates[i]['user_profile'])[2]
+        
+        routing = {}  # i -> (routing_destinations, scoring_method)
+        
+        # Content-based: một ma trận điểm (profiles x hợp các ứng viên)
+        cb_items = [i for i in selected if not uses_cf(i)]
+        if cb_items:
+            union = np.unique(np.concatenate([candidates[i]['positions'] for i in cb_items]))
+            scores = ScoringEngine.calculate_scores_matrix(
+                [candidates[i]['user_profile'] for i in cb_items],
+                catalog.features.subset(union)
+            )
+            print(f"DEBUG: Batch scoring {scores.shape[0]} profiles x {scores.shape[1]} destinations")
+            
+            for row, i in zip(scores, cb_items):
+                positions = candidates[i]['positions']
+                item_scores = row[np.searchsorted(union, positions)]
+                order = np.argsort(-item_scores, kind='stable')
+                top_n = get_top_n(i)
+                if top_n:
+                    order = order[:top_n]
+                routing[i] = ([
+                    TourRecommendationService.to_routing_destination(dest, float(item_scores[j]))
+                    for dest, j in zip(catalog.take(positions[order]), order)
+                ], 'content_based')
+        
+        for i in selected:
+            if uses_cf(i):
+                scored_destinations = ScoringEngine.rank_destinations_hybrid(
+                    candidates[i]['user_profile'],
+                    catalog.take(candidates[i]['positions']),
+                    db=db,
+                    user_id=items[i]['user_id'],
+                    use_cf=True,
+                    top_n=get_top_n(i),
+                    features=candidates[i]['features']
+                )
+                routing[i] = ([
+                    TourRecommendationService.to_routing_destination(dest, score, metadata)
+                    for dest, score, metadata in scored_destinations
+                ], 'hybrid')
+        
+        # Ma trận chung: [các điểm khởi hành khác nhau] + [hợp các địa điểm được chọn]
+        start_index = {}
+        starts = []
+        dest_index = {}
+        dests = []
+        for i in selected:
+            start = candidates[i]['start_location']
+            start_key = (start['latitude'], start['longitude'])
+            if start_key not in start_index:
+                start_index[start_key] = len(starts)
+                starts.append(start)
+            for dest in routing[i][0]:
+                if dest['id'] not in dest_index:
+                    dest_index[dest['id']] = len(dests)
+                    dests.append(dest)
+        
+        shared_matrices = None
+        if dests and len(starts) + len(dests) <= TourRecommendationService.SHARED_MATRIX_MAX_NODES:
+            shared_matrices = DistanceCalculator.build_shared_matrices(starts, dests)
+            print(f"DEBUG: Shared matrix for {len(starts)} starts + {len(dests)} destinations")
+        
+        prepared = []
+        for i, (item, candidate) in enumerate(zip(items, candidates)):
+            if not candidate['success']:
+                prepared.append(candidate)
+                continue
+            
+            routing_destinations, scoring_method = routing[i]
+            max_locations, optional_nodes, _ = TourRecommendationService.get_routing_options(
+                candidate['user_profile']
+            )
+            start_location = candidate['start_location']
+            if shared_matrices is not None:
+                matrices = DistanceCalculator.slice_route_matrices(
+                    shared_matrices,
+                    start_index[(start_location['latitude'], start_location['longitude'])],
+                    [len(starts) + dest_index[dest['id']] for dest in routing_destinations]
+                )
+            else:
+                matrices = DistanceCalculator.build_route_matrices(start_location, routing_destinations)
+            
+            prepared.append({
+                'success': True,
+                'destinations': routing_destinations,
+                'user_profile': dict(candidate['user_profile'], max_locations=max_locations),
+                'start_location': start_location,
+                'matrices': matrices,
+                'optional_nodes': optional_nodes,
+                'scoring_method': scoring_method,
+                'user_id': item.get('user_id'),
+                'cf_enabled': item.get('use_cf', True) and item.get('user_id') is not None,
+                'catalog_version': catalog.version,
+                'total_destinations_considered': len(candidate['positions'])
+            })
+        
+        return prepared
+    
+    @staticmethod
+    def get_routing_options(user_profile: Dict) -> Tuple[int, bool, int]:
+        """
+        Tham số bước tối ưu theo profile
+        
+        Returns:
+            (max_locations (tối đa 6, mỗi ngày), optional_nodes, top_n ứng viên cần tính điểm)
+        """
+        max_locations = min(user_profile.get('max_locations', 5), 6)  # Max 6 locations
+        
+        num_days = MultiDayRouteOptimizer.get_num_days(user_profile)
+        num_alternatives = max(1, int(user_profile.get('num_alternatives') or 1))
+        if num_days > 1 or num_alternatives > 1:
+            # Nhiều ngày / nhiều phương án: luôn orienteering, đủ ứng viên cho mọi ngày, mọi phương án
+            top_n = max(
+                settings.TOUR_ORIENTEERING_CANDIDATES,
+                3 * num_days * num_alternatives * max_locations
+            )
+            return max_locations, True, top_n
+        
+        # Orienteering: đưa top-K ứng viên cho solver tự chọn tối đa max_locations địa điểm
+        # Thăm tất cả: chỉ lấy top max_locations địa điểm
+        optional_nodes = settings.TOUR_ORIENTEERING
+        top_n = settings.TOUR_ORIENTEERING_CANDIDATES if optional_nodes else max_locations
+        return max_locations, optional_nodes, top_n
+    
+    @staticmethod
+    def to_routing_destination(dest: Dict, score: float, metadata: Optional[Dict] = None) -> Dict:
+        """Bản sao địa điểm (snapshot read-only) kèm điểm và metadata scoring"""
+        dest_copy = dest.copy()
+        dest_copy['score'] = score
+        dest_copy['scoring_metadata'] = metadata or {
+            'cb_score': round(score, 3),
+            'scoring_method': 'content_based'
+        }
+        return dest_copy
+    
+    @staticmethod
+    def select_candidates(
+        catalog: CatalogSnapshot,
+        user_profile: Dict,
+        start_location: Optional[Dict] = None,
+        start_time: Optional[str] = None
+    ) -> Dict:
+        """
+        Chọn các địa điểm ứng viên trong snapshot: gần điểm khởi hành và khả thi
+        với ngân sách / thời gian / giờ mở cửa của user
+        
+        Returns:
+            {'success': False, 'message': ...} hoặc {'success': True, 'user_profile' (có
+            tour_start_minutes), 'start_location', 'positions' (vị trí trong snapshot), 'features'}
+        """
+        # 4. Set default start location nếu không có (Sài Gòn center)
+        if not start_location:
+            start_location = {
+                'id': 0,
+                'name': 'Điểm khởi hành',
+                'latitude': 10.7769,
+                'longitude': 106.7009,
+                'visit_time': 0,
+                'price': 0
+            }
+        
+        # Giờ bắt đầu tour (phút từ 00:00) - các solver áp giờ mở cửa tính từ mốc này
+        tour_start_minutes = OpeningHours.parse_clock(start_time or settings.TOUR_START_TIME)
+        if tour_start_minutes is None:
+            return {
+                'success': False,
+                'message': f'Giờ bắt đầu tour không hợp lệ: {start_time} (định dạng HH:MM)'
+            }
+        user_profile = dict(user_profile, tour_start_minutes=tour_start_minutes)
+        
+        # 2. Filter theo khoảng cách (chỉ giữ địa điểm trong bán kính hợp lý)
+        start_lat = start_location.get('latitude', 10.7769)
+        start_lon = start_location.get('longitude', 106.7009)
+        
+        # Spatial index: bán kính 50km, mở rộng 100km nếu không có (một lần truy vấn)
+        nearby_positions, _, max_distance_km = catalog.spatial_index.query_expanding(
+            start_lat, start_lon, (50, 100)
+        )
+        
+        print(f"DEBUG: Nearby destinations: {len(nearby_positions)} (radius {max_distance_km}km)")
+        
+        if not len(nearby_positions):
+            return {
+                'success': False,
+                'message': f'Không có địa điểm nào trong bán kính {max_distance_km}km'
+            }
+        
+        nearby_features = catalog.features.subset(nearby_positions)
+        
+        # 2.5. Kiểm tra khả thi: bỏ địa điểm không thể nằm trong lộ trình nào
+        #      (vượt ngân sách / không đủ thời gian ngay cả khi chỉ thăm riêng nó)
+        feasible, min_time = FeasibilityChecker.feasible_mask(
+            user_profile, {'latitude': start_lat, 'longitude': start_lon}, nearby_features
+        )
+        if not feasible.any():
+            message = FeasibilityChecker.explain_infeasible(user_profile, nearby_features, min_time)
+            print(f"DEBUG: Infeasible request: {message}")
+            return {
+                'success': False,
+                'message': message
+            }
+        
+        if not feasible.all():
+            print(f"DEBUG: Feasibility pruning: {int(feasible.sum())}/{len(nearby_positions)} destinations kept")
+            nearby_positions = nearby_positions[feasible]
+            nearby_features = nearby_features.subset(np.flatnonzero(feasible))
+        
+        return {
+            'success': True,
+            'user_profile': user_profile,
+            'start_location': start_location,
+            'positions': nearby_positions,
+            'features': nearby_features
+        }
+    
+    @staticmethod
+    def solve_route(
+        destinations: List[Dict],
+        user_profile: Dict,
+        start_location: Dict,
+        matrices: Tuple[np.ndarray, np.ndarray],
+        deadline: Deadline,
+        optional_nodes: bool = False,
+        progress: Optional[Any] = None
+    ) -> Dict:
+        """
+        Bước 2: Held-Karp (ít địa điểm) hoặc OR-Tools trong thời gian còn lại,
+        fallback heuristic nếu thất bại
+        
+        optional_nodes=True (orienteering): solver tự chọn tối đa max_locations địa điểm
+        trong danh sách ứng viên thay vì phải thăm tất cả.
+        
+        progress: ProgressReporter (SolverPool.open_channel) nhận các lời giải tốt dần của OR-Tools
+        (streaming); Held-Karp / heuristic chỉ có kết quả cuối.
+        
+        Task top-level của SolverPool (Deadline dùng time.monotonic - chung cho
+        mọi process trên cùng máy, thời gian chờ trong hàng đợi cũng được tính).
+        
+        user_profile có num_days > 1: tour nhiều ngày (solve_multi_day_route).
+        """
+        if MultiDayRouteOptimizer.get_num_days(user_profile) > 1:
+            return TourRecommendationService.solve_multi_day_route(
+                destinations, user_profile, start_location, matrices, deadline
+            )
+        
+        # 5. Ít địa điểm: giải chính xác bằng Held-Karp (nhanh hơn dựng model OR-Tools)
+        #    Nhiều hơn: OR-Tools với thời gian còn lại trừ phần dành cho fallback
+        solver_time_ms = deadline.remaining_ms() - settings.TOUR_FALLBACK_RESERVE_MS
+        infeasible_reason = None
+        degraded = None
+        if not optional_nodes:
+            # Cận dưới đã vượt giới hạn => không solver nào thăm hết được, dùng heuristic luôn
+            infeasible_reason = FeasibilityChecker.visit_all_infeasible(
+                user_profile, destinations, matrices
+            )
+        
+        if infeasible_reason:
+            print(f"DEBUG: Visit-all model infeasible ({infeasible_reason}), skipping solver")
+            result = {
+                'success': False,
+                'message': infeasible_reason
+            }
+        elif len(destinations) <= settings.TOUR_EXACT_SOLVER_MAX_NODES:
+            print(f"DEBUG: Using exact Held-Karp solver ({len(destinations)} destinations)...")
+            optimizer = ExactRouteSolver(
+                destinations, user_profile, start_location, matrices, optional_nodes
+            )
+            result = optimizer.optimize()
+        elif solver_time_ms >= settings.TOUR_MIN_SOLVER_TIME_MS:
+            print(f"DEBUG: Attempting OR-Tools optimization (time limit {solver_time_ms}ms)...")
+            degraded = TourRecommendationService.DEGRADED_BUDGET  # Chỉ dùng nếu OR-Tools thất bại
+            initial_nodes = None
+            if settings.TOUR_SOLVER_WARM_START:
+                # Warm start: local search bắt đầu từ lộ trình heuristic (khả thi, có trong vài ms)
+                initial_nodes = HeuristicOptimizer(
+                    destinations, user_profile, start_location, matrices
+                ).local_search_nodes()
+            on_solution = None
+            if progress is not None:
+                def on_solution(improved: Dict) -> None:
+                    try:
+                        progress.put(improved)
+                    except Exception as e:
+                        # Mất kết nối tới Manager => vẫn tối ưu tiếp, chỉ bỏ bản trung gian
+                        print(f"ERROR: Cannot report intermediate route: {str(e)}")
+            optimizer = RouteOptimizer(
+                destinations, user_profile, start_location, matrices, optional_nodes
+            )
+            result = optimizer.optimize(
+                time_limit_ms=solver_time_ms, initial_nodes=initial_nodes, on_solution=on_solution
+            )
+        else:
+            print(f"DEBUG: Latency budget exhausted ({deadline.elapsed_ms()}ms), skipping OR-Tools")
+            degraded = TourRecommendationService.DEGRADED_BUDGET
+            result = {
+                'success': False,
+                'message': 'Hết thời gian cho phép trước khi chạy OR-Tools'
+            }
+        
+        # 6. Fallback to heuristic if OR-Tools / Held-Karp fails
         if not result.get('success'):
-            print(f"DEBUG: OR-Tools failed, falling back to Heuristic optimizer...")
+            print(f"DEBUG: Route solver failed, falling back to Heuristic optimizer...")
             heuristic_optimizer = HeuristicOptimizer(
-                routing_destinations, 
+                destinations, 
                 user_profile, 
-                start_location
+                start_location,
+                matrices
             )
-            result = heuristic_optimizer.optimize_greedy()
+            result = heuristic_optimizer.optimize_local_search()
             
             # Thêm note cho user biết đang dùng fallback
             if result.get('success'):
-                result['note'] = 'Sử dụng thuật toán tối ưu đơn giản (Greedy). Lộ trình có thể chưa tối ưu nhất.'
+                result['note'] = 'Sử dụng thuật toán tối ưu đơn giản (Greedy + Local Search). Lộ trình có thể chưa tối ưu nhất.'
+            result = TourRecommendationService.mark_degraded(result, degraded)
         
+        return result
+    
+    @staticmethod
+    def solve_multi_day_route(
+        destinations: List[Dict],
+        user_profile: Dict,
+        start_location: Dict,
+        matrices: Tuple[np.ndarray, np.ndarray],
+        deadline: Deadline
+    ) -> Dict:
+        """
+        Tour nhiều ngày: một OR-Tools model (mỗi ngày một vehicle) trong thời gian còn lại,
+        warm start / fallback bằng heuristic lần lượt từng ngày trên cùng ma trận
+        """
+        optimizer = MultiDayRouteOptimizer(destinations, user_profile, start_location, matrices)
+        solver_time_ms = deadline.remaining_ms() - settings.TOUR_FALLBACK_RESERVE_MS
+        
+        # OR-Tools thất bại / bị bỏ qua đều do giới hạn thời gian => heuristic là kết quả rút gọn
+        degraded = TourRecommendationService.DEGRADED_BUDGET
+        if solver_time_ms >= settings.TOUR_MIN_SOLVER_TIME_MS:
+            print(f"DEBUG: Attempting multi-day OR-Tools optimization "
+                  f"({optimizer.num_vehicles} days, time limit {solver_time_ms}ms)...")
+            initial_days = optimizer.sequential_days() if settings.TOUR_SOLVER_WARM_START else None
+            result = optimizer.optimize(time_limit_ms=solver_time_ms, initial_nodes=initial_days)
+        else:
+            print(f"DEBUG: Latency budget exhausted ({deadline.elapsed_ms()}ms), skipping OR-Tools")
+            result = {
+                'success': False,
+                'message': 'Hết thời gian cho phép trước khi chạy OR-Tools'
+            }
+        
+        if not result.get('success'):
+            print(f"DEBUG: Multi-day solver failed, falling back to Heuristic optimizer...")
+            result = optimizer.optimize_heuristic()
+            if result.get('success'):
+                result['note'] = 'Sử dụng thuật toán tối ưu đơn giản (Greedy + Local Search) cho từng ngày. Lộ trình có thể chưa tối ưu nhất.'
+            result = TourRecommendationService.mark_degraded(result, degraded)
+        
+        return result
+    
+    @staticmethod
+    def solve_greedy(prepared: Dict) -> Dict:
+        """Lộ trình greedy (vài ms) để trả cho client trước khi tối ưu xong"""
+        if MultiDayRouteOptimizer.get_num_days(prepared['user_profile']) > 1:
+            return MultiDayRouteOptimizer(
+                prepared['destinations'], prepared['user_profile'],
+                prepared['start_location'], prepared['matrices']
+            ).optimize_heuristic(local_search=False)
+        return HeuristicOptimizer(
+            prepared['destinations'], prepared['user_profile'],
+            prepared['start_location'], prepared['matrices']
+        ).optimize_greedy()
+    
+    @staticmethod
+    def solve_heuristic(prepared: Dict) -> Dict:
+        """Greedy + local search trong process hiện tại (khi không dùng được SolverPool)"""
+        if MultiDayRouteOptimizer.get_num_days(prepared['user_profile']) > 1:
+            return MultiDayRouteOptimizer(
+                prepared['destinations'], prepared['user_profile'],
+                prepared['start_location'], prepared['matrices']
+            ).optimize_heuristic()
+        return HeuristicOptimizer(
+            prepared['destinations'], prepared['user_profile'],
+            prepared['start_location'], prepared['matrices']
+        ).optimize_local_search()
+    
+    @staticmethod
+    def finalize_result(result: Dict, prepared: Dict, deadline: Deadline) -> Dict:
+        """Bước 3: gắn metadata (scoring, CF, thời gian xử lý) vào kết quả"""
         # Add CF metadata to result
         if result.get('success'):
             result['recommendation_metadata'] = {
-                'scoring_method': scoring_method,
-                'user_id': user_id,
-                'cf_enabled': use_cf and user_id is not None,
-                'total_destinations_considered': len(nearby_destinations),
-                'scored_destinations': len(routing_destinations)
+                'scoring_method': prepared['scoring_method'],
+                'user_id': prepared['user_id'],
+                'cf_enabled': prepared['cf_enabled'],
+                'total_destinations_considered': prepared['total_destinations_considered'],
+                'scored_destinations': len(prepared['destinations']),
+                'latency_budget_ms': deadline.budget_ms,
+                'elapsed_ms': deadline.elapsed_ms(),
+                'cache_hit': False
             }
         
         return result
     
+    @staticmethod
+    def mark_degraded(result: Dict, reason: Optional[str]) -> Dict:
+        """Đánh dấu kết quả thành công là bản rút gọn (reason None => giữ nguyên)"""
+        if reason and result.get('success'):
+            result['degraded'] = reason
+        return result
+    
+    @staticmethod
+    def get_flight_key(
+        user_profile: Dict,
+        start_location: Optional[Dict],
+        user_id: Optional[int],
+        use_cf: bool,
+        start_time: Optional[str]
+    ) -> Optional[str]:
+        """Key gộp request đồng thời (cùng key với cache), None = không gộp (tắt / có CF)"""
+        if not settings.TOUR_SINGLE_FLIGHT or (use_cf and user_id is not None):
+            return None
+        return TourResultCache.make_key(
+            user_profile, start_location, start_time, DestinationCatalog.current_version() or 0
+        )
+    
+    @staticmethod
+    def get_cache_stats() -> Dict:
+        """Thống kê cache + số request được gộp vào request đang chạy cùng key"""
+        flights = (TourRecommendationService._flights, TourRecommendationService._async_flights)
+        return dict(
+            TourResultCache.stats(),
+            single_flight={
+                'enabled': settings.TOUR_SINGLE_FLIGHT,
+                'coalesced': sum(flight.shared for flight in flights),
+                'in_flight': sum(flight.in_flight() for flight in flights)
+            }
+        )
+    
+    @staticmethod
+    def share_result(result: Dict) -> Dict:
+        """Bản sao kết quả của request khác đang chạy cùng key (đánh dấu coalesced)"""
+        result = copy.deepcopy(result)
+        if 'recommendation_metadata' in result:
+            result['recommendation_metadata']['coalesced'] = True
+        return result
+    
+    @staticmethod
+    def get_cached_result(
+        user_profile: Dict,
+        start_location: Optional[Dict],
+        user_id: Optional[int],
+        use_cf: bool,
+        start_time: Optional[str],
+        deadline: Deadline
+    ) -> Optional[Dict]:
+        """
+        Kết quả đã cache cho request giống hệt (None = phải tính)
+        
+        Không truy vấn database: dùng version của snapshot đang giữ, chưa load
+        catalog thì coi như miss. Request có CF (phụ thuộc user) không được cache.
+        """
+        catalog_version = DestinationCatalog.current_version()
+        if not TourResultCache.enabled() or (use_cf and user_id is not None) or catalog_version is None:
+            return None
+        
+        key = TourResultCache.make_key(user_profile, start_location, start_time, catalog_version)
+        result = TourResultCache.get(key, catalog_version)
+        if result is None:
+            return None
+        
+        print(f"DEBUG: Tour cache hit (catalog v{catalog_version})")
+        result.setdefault('recommendation_metadata', {}).update({
+            'latency_budget_ms': deadline.budget_ms,
+            'elapsed_ms': deadline.elapsed_ms(),
+            'cache_hit': True
+        })
+        return result
+    
+    @staticmethod
+    def cache_result(
+        result: Dict,
+        prepared: Dict,
+        start_location: Optional[Dict],
+        start_time: Optional[str]
+    ) -> None:
+        """
+        Lưu kết quả thành công (không CF) theo catalog version đã dùng để tính
+        
+        Kết quả degraded (fallback vì hết budget / pool quá tải) không được cache: key không
+        chứa latency budget, request sau với budget thoải mái phải được giải đầy đủ.
+        """
+        if (not TourResultCache.enabled() or prepared['cf_enabled'] or not result.get('success')
+                or result.get('degraded')):
+            return
+        
+        key = TourResultCache.make_key(
+            prepared['user_profile'], start_location, start_time, prepared['catalog_version']
+        )
+        TourResultCache.put(key, prepared['catalog_version'], result)
+    
     @staticmethod
     def analyze_destination_scores(
         db: Session,
@@ -882,16 +3832,13 @@ class TourRecommendationService:
         Returns:
             Dict với top destinations và scores
         """
-        destinations = db.query(Destination).filter(
-            Destination.is_active == True
-        ).all()
-        
-        destinations_dict = [dest.to_dict() for dest in destinations]
+        catalog = DestinationCatalog.get_snapshot(db)
         
         scored = ScoringEngine.rank_destinations(
             user_profile,
-            destinations_dict,
-            top_n=top_n
+            catalog.destinations,
+            top_n=top_n,
+            features=catalog.features
         )
         
         result = []
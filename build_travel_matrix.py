@@ -0,0 +1,61 @@
+"""
+Script để precompute ma trận khoảng cách / thời gian di chuyển cho toàn bộ catalog
+
+Ma trận được ghi ra file .npy và được RouteOptimizer / HeuristicOptimizer
+đọc qua memory-map (settings.TRAVEL_MATRIX_PATH). Chạy lại sau khi import
+hoặc thay đổi nhiều địa điểm, worker sẽ tự load lại store mới.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.services.destination_catalog import DestinationCatalog
+from app.services.tour_recommendation_service import TravelMatrixStore
+
+
+def build_travel_matrix(path: str = None, speed_kmh: float = 40):
+    """Build ma trận all-pairs cho các địa điểm hợp lệ đang hoạt động"""
+    
+    path = path or settings.TRAVEL_MATRIX_PATH
+    if not path:
+        print("❌ Chưa cấu hình TRAVEL_MATRIX_PATH")
+        return
+    
+    db = SessionLocal()
+    
+    try:
+        print("🔄 Đang load catalog từ database...")
+        catalog = DestinationCatalog.reload(db)
+        destinations = catalog.take(catalog.valid_positions)
+        print(f"✅ {len(destinations)} địa điểm hợp lệ")
+        
+        n = len(destinations)
+        print(f"🔄 Đang tính ma trận {n} x {n} (~{n * n * 8 / 1024 / 1024:.1f} MB) vào {path}...")
+        started = time.time()
+        store = TravelMatrixStore.build(path, destinations, speed_kmh=speed_kmh)
+        print(f"✅ Build xong {len(store)} địa điểm trong {time.time() - started:.1f}s")
+        
+    except Exception as e:
+        print(f"❌ Lỗi khi build ma trận: {str(e)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--help":
+        print("""
+Usage:
+  python build_travel_matrix.py           # Build vào settings.TRAVEL_MATRIX_PATH
+  python build_travel_matrix.py <dir>     # Build vào thư mục khác
+  python build_travel_matrix.py --help    # Hiện help
+        """)
+    elif len(sys.argv) > 1:
+        build_travel_matrix(sys.argv[1])
+    else:
+        build_travel_matrix()
@@ -0,0 +1,1247 @@
+import asyncio
+import itertools
+import os
+import random
+import threading
+import time
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.core.config import settings
+from app.services.collaborative_filtering_service import CFModel, CFModelStore, CollaborativeFilteringService
+from app.services.destination_catalog import (
+    CatalogSnapshot,
+    DestinationCatalog,
+    DestinationFeatureStore,
+    OpeningHours,
+)
+from app.services.single_flight import AsyncSingleFlight, SingleFlight
+from app.services.solver_pool import SolverPool, SolverPoolOverloaded
+from app.services.tour_cache import TourResultCache
+from app.services.tour_jobs import SolverProcess, TourJobCancelled, TourJobManager, TourJobStore
+from app.services.tour_recommendation_service import (
+    Deadline,
+    DistanceCalculator,
+    ExactRouteSolver,
+    FeasibilityChecker,
+    HeuristicOptimizer,
+    RouteOptimizer,
+    RouteSolverPortfolio,
+    ScoringEngine,
+    TourRecommendationService,
+    TravelMatrixStore,
+)
+
+
+TYPES = ['Cultural', 'Adventure', 'Family', 'Relaxation', 'Budget', '']
+TAGS = ['nature', 'hiking', 'culture', 'History', 'museum', 'park', 'spa', 'local', 'view']
+
+
+def make_destinations(n: int, seed: int = 42):
+    """Sinh danh sách địa điểm giả quanh trung tâm Sài Gòn"""
+    rng = random.Random(seed)
+    destinations = []
+    for i in range(1, n + 1):
+        destinations.append({
+            'id': i,
+            'name': f'Destination {i}',
+            'type': rng.choice(TYPES),
+            'tags': rng.sample(TAGS, rng.randint(0, 4)),
+            'latitude': 10.7769 + rng.uniform(-0.2, 0.2),
+            'longitude': 106.7009 + rng.uniform(-0.2, 0.2),
+            'price': rng.choice([0, 20000, 50000, 150000, 400000, 1200000]),
+            'visit_time': rng.choice([30, 60, 90, 120, 240]),
+            'opening_hours': '08:00-17:00',
+        })
+    return destinations
+
+
+@pytest.fixture
+def destinations():
+    return make_destinations(200)
+
+
+@pytest.mark.parametrize("user", [
+    {'type': 'Cultural', 'preference': ['culture', 'history', 'museum'], 'budget': 500000, 'time_available': 8},
+    {'type': 'Adventure', 'preference': ['Nature', 'hiking'], 'budget': 100000, 'time_available': 2},
+    {'type': 'Family', 'preference': [], 'budget': 0, 'time_available': 4},
+    {'type': 'Budget', 'preference': ['unknown-tag'], 'budget': 1000000, 'time_available': 0},
+])
+def test_batch_scores_match_scalar_scores(destinations, user):
+    """Tính điểm vector hóa phải cho kết quả giống hệt calculate_score"""
+    features = DestinationFeatureStore(destinations)
+    batch = ScoringEngine.calculate_scores_batch(user, features)
+
+    assert batch.tolist() == [ScoringEngine.calculate_score(user, d) for d in destinations]
+
+
+def test_rank_destinations_keeps_stable_order(destinations):
+    """Xếp hạng giữ thứ tự gốc khi bằng điểm, giống list.sort(reverse=True)"""
+    user = {'type': 'Relaxation', 'preference': ['spa', 'view'], 'budget': 300000, 'time_available': 6}
+    expected = [(d, ScoringEngine.calculate_score(user, d)) for d in destinations]
+    expected.sort(key=lambda x: x[1], reverse=True)
+
+    ranked = ScoringEngine.rank_destinations(user, destinations, top_n=10)
+
+    assert [(d['id'], s) for d, s in ranked] == [(d['id'], s) for d, s in expected[:10]]
+
+
+def test_feature_store_subset_matches_rebuilt_store(destinations):
+    """Feature store của tập con cho điểm giống store dựng lại từ dict"""
+    user = {'type': 'Cultural', 'preference': ['culture', 'museum'], 'budget': 200000, 'time_available': 4}
+    positions = [5, 3, 150, 42, 7]
+    snapshot = CatalogSnapshot(destinations, version=1)
+
+    subset_scores = ScoringEngine.calculate_scores_batch(user, snapshot.features.subset(positions))
+    rebuilt = DestinationFeatureStore(snapshot.take(positions))
+
+    assert subset_scores.tolist() == ScoringEngine.calculate_scores_batch(user, rebuilt).tolist()
+    assert snapshot.get(destinations[42]['id']) is destinations[42]
+
+
+def test_spatial_index_matches_haversine_scan():
+    """Truy vấn bán kính / k-nearest khớp với quét haversine toàn bộ"""
+    destinations = make_destinations(300)
+    for dest in destinations[::10]:
+        dest['latitude'] += 1.0  # Một số địa điểm ở xa (~110km)
+    snapshot = CatalogSnapshot(destinations, version=1)
+    lat, lon = 10.7769, 106.7009
+    distances = [
+        DistanceCalculator.haversine_distance(lat, lon, d['latitude'], d['longitude'])
+        for d in destinations
+    ]
+
+    positions, _ = snapshot.spatial_index.query_radius(lat, lon, 20)
+    assert positions.tolist() == [i for i, d in enumerate(distances) if d <= 20]
+
+    nearest, nearest_dist = snapshot.spatial_index.query_nearest(lat, lon, 5)
+    assert nearest.tolist() == sorted(range(len(distances)), key=distances.__getitem__)[:5]
+    assert nearest_dist == pytest.approx(sorted(distances)[:5])
+
+    positions, _, radius = snapshot.spatial_index.query_expanding(lat + 2.5, lon, (50, 200))
+    assert radius == 200
+    assert positions.tolist() == list(range(0, 300, 10))
+
+
+def test_distance_matrix_matches_scalar_haversine():
+    """Ma trận vector hóa khớp với haversine_distance / calculate_travel_time"""
+    locations = make_destinations(25)
+    distance_matrix, time_matrix = DistanceCalculator.build_distance_matrix(locations)
+
+    assert distance_matrix.shape == time_matrix.shape == (25, 25)
+    for i, a in enumerate(locations):
+        for j, b in enumerate(locations):
+            dist = 0.0 if i == j else DistanceCalculator.haversine_distance(
+                a['latitude'], a['longitude'], b['latitude'], b['longitude']
+            )
+            assert distance_matrix[i, j] == pytest.approx(dist, abs=1e-9)
+            assert time_matrix[i, j] == DistanceCalculator.calculate_travel_time(dist)
+
+
+def test_travel_matrix_store_slices_route_matrices(tmp_path):
+    """Ma trận cắt từ store memory-map khớp với ma trận tính trực tiếp"""
+    destinations = make_destinations(40)
+    store = TravelMatrixStore.build(str(tmp_path / 'matrix'), destinations, block_size=16)
+    start = {'id': 0, 'latitude': 10.78, 'longitude': 106.69}
+    route = [destinations[i] for i in (7, 3, 31, 12)]
+
+    distance, travel_time = DistanceCalculator.build_route_matrices(start, route, store=store)
+    expected_distance, expected_time = DistanceCalculator.build_distance_matrix([start] + route)
+
+    assert isinstance(store.distance, np.memmap)
+    assert (distance == expected_distance).all()
+    assert (travel_time == expected_time).all()
+
+
+def test_travel_matrix_store_rebuild_swaps_symlink(tmp_path):
+    """Build lại trỏ symlink sang thư mục mới, store cũ vẫn đọc được, thư mục cũ bị xóa"""
+    path = str(tmp_path / 'matrix')
+    old_store = TravelMatrixStore.build(path, make_destinations(20, seed=1))
+    old_dir = os.path.realpath(path)
+
+    new_store = TravelMatrixStore.build(path, make_destinations(30, seed=2))
+
+    assert os.path.islink(path) and os.path.realpath(path) != old_dir
+    assert not os.path.exists(old_dir)
+    assert len(new_store) == len(TravelMatrixStore.load(path)) == 30
+    assert old_store.distance.shape == (20, 20) and float(old_store.distance[0, 1]) > 0
+    assert sorted(os.listdir(tmp_path)) == sorted(['matrix', os.path.basename(os.path.realpath(path))])
+
+
+@pytest.mark.parametrize("budget,time_available,max_locations", [
+    (10_000_000, 24, 8),
+    (300_000, 6, 4),
+    (150_000, 4, 3),
+])
+def test_local_search_improves_greedy_route(budget, time_available, max_locations):
+    """Local search không kém greedy (điểm, rồi quãng đường) và vẫn thỏa constraints"""
+    destinations = make_destinations(15, seed=7)
+    for i, dest in enumerate(destinations):
+        dest['score'] = round(0.3 + (i % 5) * 0.1, 3)
+    user = {'budget': budget, 'time_available': time_available, 'max_locations': max_locations}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009}
+    optimizer = HeuristicOptimizer(destinations, user, start)
+
+    greedy = optimizer.optimize_greedy()
+    improved = optimizer.optimize_local_search()
+
+    assert improved['optimizer_used'] == 'heuristic_local_search'
+    assert (improved['total_score'], -improved['total_distance']) >= \
+        (greedy['total_score'], -greedy['total_distance'])
+    assert improved['total_locations'] <= max_locations
+    assert improved['total_time'] <= time_available * 60
+    assert improved['total_cost'] <= budget
+    assert len({d['id'] for d in improved['route']}) == improved['total_locations']
+
+
+@pytest.mark.parametrize('time_available', [2, 3, 5])
+def test_heuristic_route_returns_to_start_within_time(time_available):
+    """Heuristic dùng lộ trình khép kín như OR-Tools: tính cả chặng quay về start"""
+    destinations = make_destinations(15, seed=11)
+    for i, dest in enumerate(destinations):
+        dest['score'] = round(0.3 + (i % 5) * 0.1, 3)
+        dest['opening_hours'] = None  # Không chờ giờ mở cửa => tổng thời gian tính lại được
+    user = {'budget': 10**9, 'time_available': time_available, 'max_locations': 8}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009}
+    optimizer = HeuristicOptimizer(destinations, user, start)
+    node_of = {dest['id']: node for node, dest in enumerate(destinations, start=1)}
+
+    for result in (optimizer.optimize_greedy(), optimizer.optimize_local_search()):
+        assert result['success']
+        nodes = [node_of[location['id']] for location in result['route']]
+        total_time = 0
+        prev = 0
+        for node in nodes:
+            total_time += optimizer.time_matrix[prev, node] + destinations[node - 1]['visit_time']
+            prev = node
+        total_time += optimizer.time_matrix[prev, 0]
+        assert total_time <= time_available * 60
+        assert result['total_time'] == total_time
+
+
+def test_solver_pool_rejects_tasks_over_capacity(monkeypatch):
+    """Pool đầy (đang chạy + đang chờ) thì từ chối ngay, nhận lại khi có task xong"""
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_WORKERS', 1)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_MAX_QUEUE', 1)
+    try:
+        running = SolverPool.submit(time.sleep, 0.5)
+        queued = SolverPool.submit(time.sleep, 0)
+        with pytest.raises(SolverPoolOverloaded) as exc_info:
+            SolverPool.submit(time.sleep, 0)
+        assert exc_info.value.retry_after >= 1
+
+        running.result(timeout=30)
+        queued.result(timeout=30)
+        # Slot được trả trong done callback (có thể chạy ngay sau result())
+        deadline = time.monotonic() + 5
+        while SolverPool.in_flight() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert SolverPool.in_flight() == 0
+        SolverPool.submit(time.sleep, 0).result(timeout=30)
+    finally:
+        SolverPool.shutdown()
+
+
+@pytest.mark.parametrize("seed,time_available", [(1, 24), (2, 12), (3, 10), (4, 8)])
+def test_exact_solver_matches_brute_force(seed, time_available):
+    """Held-Karp cho chi phí tối ưu giống duyệt mọi hoán vị (cùng model với OR-Tools)"""
+    destinations = make_destinations(6, seed=seed)
+    for dest in destinations:
+        dest['score'] = 0.5
+        dest['visit_time'] = min(dest['visit_time'], 90)
+    destinations[0]['opening_hours'] = '16:00-02:00'  # Mở qua đêm
+    destinations[1]['opening_hours'] = None
+    user = {'budget': 10_000_000, 'time_available': time_available}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009, 'visit_time': 0, 'price': 0}
+    solver = ExactRouteSolver(destinations, user, start)
+    dist, travel = solver.solver_distance_matrix, solver.time_matrix
+
+    def closed_tour(order):
+        """(quãng đường, tổng thời gian kể cả chờ mở cửa), thời gian None nếu đến trễ"""
+        path = (0,) + order + (0,)
+        total_time = 0
+        for prev, node in zip(path, order):
+            total_time = solver.schedule.earliest_start(node, total_time + travel[prev][node])
+            if total_time is None:
+                break
+            total_time += destinations[node - 1]['visit_time']
+        else:
+            total_time += travel[order[-1]][0]
+        return sum(dist[a][b] for a, b in zip(path, path[1:])), total_time
+
+    feasible = [
+        cost for cost, total_time in map(closed_tour, itertools.permutations(range(1, 7)))
+        if total_time is not None and total_time <= time_available * 60
+    ]
+    result = solver.optimize()
+
+    assert result['success'] == bool(feasible)
+    if feasible:
+        order = tuple(
+            next(i for i, d in enumerate(destinations, start=1) if d['id'] == stop['id'])
+            for stop in result['route']
+        )
+        assert closed_tour(order)[0] == min(feasible)
+        assert result['optimizer_used'] == 'held_karp'
+
+
+def test_exact_solver_rejects_over_budget():
+    destinations = make_destinations(4)
+    for dest in destinations:
+        dest['score'] = 0.5
+        dest['price'] = 100000
+    user = {'budget': 350000, 'time_available': 24}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009}
+
+    assert ExactRouteSolver(destinations, user, start).optimize()['success'] is False
+
+
+def test_ortools_warm_start_from_heuristic_route():
+    """Warm start từ lộ trình heuristic cho kết quả không kém lộ trình khởi đầu"""
+    destinations = make_destinations(12, seed=3)
+    for dest in destinations:
+        dest['score'] = 0.5
+        dest['visit_time'] = 30
+        dest['opening_hours'] = None  # 12 địa điểm không vừa một khung 08:00-17:00
+    user = {'budget': 10_000_000, 'time_available': 24, 'max_locations': 12}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009, 'visit_time': 0, 'price': 0}
+    initial_nodes = HeuristicOptimizer(destinations, user, start).local_search_nodes()
+
+    optimizer = RouteOptimizer(destinations, user, start)
+    result = optimizer.optimize(time_limit_ms=500, initial_nodes=initial_nodes)
+
+    def closed_distance(nodes):
+        path = [0] + list(nodes) + [0]
+        return sum(optimizer.solver_distance_matrix[a][b] for a, b in zip(path, path[1:]))
+
+    node_by_id = {dest['id']: i for i, dest in enumerate(destinations, start=1)}
+    assert result['success'] and result['total_locations'] == 12
+    assert closed_distance(node_by_id[d['id']] for d in result['route']) <= \
+        closed_distance(optimizer._complete_route(initial_nodes))
+
+    # Lộ trình khởi đầu không hợp lệ (thiếu thời gian) => vẫn solve bình thường
+    tight = RouteOptimizer(destinations, dict(user, time_available=1), start)
+    assert tight.optimize(time_limit_ms=50, initial_nodes=initial_nodes)['success'] is False
+
+
+@pytest.mark.parametrize("seed,time_available,budget,max_locations", [
+    (1, 6, 10_000_000, 3),
+    (2, 4, 200_000, 6),
+    (3, 8, 500_000, 4),
+])
+def test_orienteering_exact_solver_matches_brute_force(seed, time_available, budget, max_locations):
+    """Orienteering: Held-Karp tối ưu quãng đường + phạt bỏ địa điểm trên mọi tập con"""
+    destinations = make_destinations(6, seed=seed)
+    rng = random.Random(seed)
+    for dest in destinations:
+        dest['score'] = round(rng.uniform(0.2, 0.9), 3)
+    user = {'budget': budget, 'time_available': time_available, 'max_locations': max_locations}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009, 'visit_time': 0, 'price': 0}
+    solver = ExactRouteSolver(destinations, user, start, optional_nodes=True)
+    dist, transit = solver.solver_distance_matrix, solver.solver_time_matrix
+    penalties = solver.drop_penalties
+
+    def objective(order):
+        path = (0,) + order + (0,)
+        if (len(order) > max_locations or
+                sum(solver.solver_prices[node] for node in order) > budget or
+                sum(transit[a][b] for a, b in zip(path, path[1:])) > time_available * 60):
+            return None
+        dropped = sum(penalties[node] for node in range(1, 7) if node not in order)
+        return sum(dist[a][b] for a, b in zip(path, path[1:])) + dropped
+
+    feasible = [
+        value
+        for k in range(1, max_locations + 1)
+        for order in itertools.permutations(range(1, 7), k)
+        for value in [objective(order)] if value is not None
+    ]
+    result = solver.optimize()
+
+    assert result['success'] == bool(feasible)
+    if feasible:
+        node_by_id = {dest['id']: i for i, dest in enumerate(destinations, start=1)}
+        assert objective(tuple(node_by_id[d['id']] for d in result['route'])) == min(feasible)
+
+
+def test_orienteering_ortools_respects_stop_limit():
+    """OR-Tools với địa điểm tùy chọn chọn tập con thỏa max_locations / budget / time"""
+    destinations = make_destinations(30, seed=11)
+    for i, dest in enumerate(destinations):
+        dest['score'] = round(0.3 + (i % 7) * 0.1, 3)
+    user = {'budget': 400_000, 'time_available': 6, 'max_locations': 4}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009, 'visit_time': 0, 'price': 0}
+
+    result = RouteOptimizer(destinations, user, start, optional_nodes=True).optimize(time_limit_ms=500)
+
+    assert result['success']
+    assert 1 <= result['total_locations'] <= 4
+    assert result['total_cost'] <= 400_000
+    assert result['total_time'] <= 6 * 60
+
+
+@pytest.mark.parametrize("budget", [1_500_000, 300_000])
+def test_multi_day_tour_splits_candidates_across_days(monkeypatch, budget):
+    """Một model cho mọi ngày: giới hạn mỗi ngày, ngân sách cả chuyến, không thăm lại"""
+    snapshot = CatalogSnapshot(make_destinations(120, seed=5), version=3)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    user = {'type': 'Cultural', 'preference': ['culture', 'museum'], 'budget': budget,
+            'time_available': 6, 'max_locations': 4, 'num_days': 3}
+
+    result = TourRecommendationService.get_tour_recommendations(None, user, use_cf=False)
+    prepared = TourRecommendationService.prepare_tour_request(None, user, use_cf=False)
+    heuristic = TourRecommendationService.solve_heuristic(prepared)
+
+    assert result['success'] and result['optimizer_used'] == 'ortools'
+    assert [day['day'] for day in result['days']] == [1, 2, 3]
+    assert all(day['total_locations'] <= 4 and day['total_time'] <= 6 * 60 for day in result['days'])
+    assert result['total_cost'] <= budget
+    ids = [location['id'] for location in result['route']]
+    assert len(ids) == len(set(ids)) == result['total_locations']
+    assert [location['day'] for location in result['route']] == sorted(
+        location['day'] for location in result['route']
+    )
+    assert result['total_score'] >= heuristic['total_score']
+    assert TourResultCache.make_key(user) != TourResultCache.make_key(dict(user, num_days=1))
+
+
+def test_hopeless_request_fails_before_scoring(monkeypatch):
+    """Ngân sách thấp hơn địa điểm rẻ nhất => lỗi ngay kèm lý do"""
+    destinations = make_destinations(50, seed=5)
+    for dest in destinations:
+        dest['price'] = max(dest['price'], 20000)
+    snapshot = CatalogSnapshot(destinations, version=1)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+
+    user = {'type': 'Cultural', 'preference': [], 'budget': 10000, 'time_available': 8}
+    prepared = TourRecommendationService.prepare_tour_request(None, user, use_cf=False)
+
+    assert not prepared['success']
+    assert prepared['message'].startswith('Không thể tạo tour')
+    assert '20,000' in prepared['message']
+
+
+def test_feasibility_pruning_keeps_only_reachable_candidates(monkeypatch):
+    """Chỉ địa điểm vừa ngân sách và đủ thời gian (đi + thăm) mới được đưa vào tối ưu"""
+    destinations = make_destinations(200, seed=6)
+    snapshot = CatalogSnapshot(destinations, version=1)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(settings, 'TOUR_ORIENTEERING', True)
+
+    user = {'type': 'Family', 'preference': [], 'budget': 100000, 'time_available': 1.5}
+    prepared = TourRecommendationService.prepare_tour_request(None, user, use_cf=False)
+
+    assert prepared['success']
+    start = prepared['start_location']
+    for dest in prepared['destinations']:
+        travel = DistanceCalculator.travel_time_matrix(np.array(DistanceCalculator.haversine_matrix(
+            [start['latitude']], [start['longitude']], [dest['latitude']], [dest['longitude']]
+        )), 40)[0][0]
+        assert dest['price'] <= 100000
+        assert travel + dest['visit_time'] <= 90
+
+
+def test_visit_all_bound_detects_impossible_tour():
+    """Tổng visit_time vượt thời gian => cận dưới kết luận không thể thăm hết"""
+    destinations = make_destinations(8, seed=7)
+    for dest in destinations:
+        dest['price'] = 0
+        dest['visit_time'] = 60
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009, 'visit_time': 0, 'price': 0}
+    matrices = DistanceCalculator.build_route_matrices(start, destinations)
+
+    assert FeasibilityChecker.visit_all_infeasible(
+        {'budget': 0, 'time_available': 7}, destinations, matrices
+    )
+    assert FeasibilityChecker.visit_all_infeasible(
+        {'budget': 0, 'time_available': 24}, destinations, matrices
+    ) is None
+
+
+@pytest.mark.parametrize("value,expected", [
+    ('08:00-17:00', (480, 1020)),
+    (' 7:30 - 17:30', (450, 1050)),
+    ('18:00-02:00', (1080, 120)),
+    ('00:00-23:59', None),
+    ('11', None),
+    (None, None),
+])
+def test_opening_hours_parse(value, expected):
+    assert OpeningHours.parse(value) == expected
+
+
+@pytest.mark.parametrize("optimizer_cls", [RouteOptimizer, HeuristicOptimizer])
+def test_routes_respect_opening_hours(optimizer_cls):
+    """Mọi điểm dừng bắt đầu tham quan khi đã mở cửa và xong trước giờ đóng cửa"""
+    destinations = make_destinations(8, seed=9)
+    for i, dest in enumerate(destinations):
+        dest['score'] = 0.5
+        dest['visit_time'] = 60
+        dest['opening_hours'] = ['13:00-17:00', '08:00-12:30', '17:30-22:00', None][i % 4]
+    user = {'budget': 10_000_000, 'time_available': 16, 'max_locations': 8, 'tour_start_minutes': 8 * 60}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009, 'visit_time': 0, 'price': 0}
+
+    optimizer = optimizer_cls(destinations, user, start)
+    if optimizer_cls is RouteOptimizer:
+        result = optimizer.optimize(time_limit_ms=500)
+    else:
+        result = optimizer.optimize_local_search()
+
+    assert result['success']
+    for stop in result['route']:
+        window = OpeningHours.parse(stop['opening_hours'])
+        if window is None:
+            continue
+        arrival = OpeningHours.parse_clock(stop['arrival_time'])
+        assert window[0] <= arrival <= window[1] - stop['visit_time'] or (
+            window[1] < window[0] and arrival >= window[0])
+
+
+def test_tour_cache_key_normalizes_request():
+    """Request chỉ khác hoa thường / thứ tự preference / tọa độ rất gần => cùng key"""
+    profile = {'type': 'Cultural', 'preference': ['Museum', 'history'], 'budget': 500000,
+               'time_available': 8, 'max_locations': 9}
+    same = {'type': 'cultural', 'preference': ['history', 'museum', 'HISTORY'], 'budget': 500000,
+            'time_available': 8, 'max_locations': 6}
+    start = {'latitude': 10.776901, 'longitude': 106.700899}
+
+    key = TourResultCache.make_key(profile, None, None, catalog_version=3)
+    assert TourResultCache.make_key(same, start, '08:00', catalog_version=3) == key
+    assert TourResultCache.make_key(profile, None, None, catalog_version=4) != key
+    assert TourResultCache.make_key(dict(profile, budget=400000), None, None, catalog_version=3) != key
+
+
+def test_tour_cache_lru_ttl_and_catalog_invalidation(monkeypatch):
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 2)
+    monkeypatch.setattr(settings, 'TOUR_CACHE_TTL_SECONDS', 60)
+    TourResultCache.clear()
+    result = {'success': True, 'route': [{'id': 1}]}
+
+    TourResultCache.put('a', 1, result)
+    TourResultCache.put('b', 1, result)
+    assert TourResultCache.get('a', 1) == result  # 'a' mới dùng => 'b' bị bỏ khi đầy
+    TourResultCache.put('c', 1, result)
+    assert TourResultCache.get('b', 1) is None
+    assert TourResultCache.get('c', 1) == result
+
+    # Bản sao: sửa kết quả trả về không ảnh hưởng cache
+    TourResultCache.get('c', 1)['route'].clear()
+    assert TourResultCache.get('c', 1) == result
+
+    # Catalog đổi version => xóa hết, kết quả tính trên catalog cũ không được lưu
+    assert TourResultCache.get('a', 2) is None
+    TourResultCache.put('a', 1, result)
+    assert TourResultCache.get('a', 2) is None
+
+    monkeypatch.setattr(settings, 'TOUR_CACHE_TTL_SECONDS', -1)
+    TourResultCache.put('d', 2, result)
+    assert TourResultCache.get('d', 2) is None
+    TourResultCache.clear()
+
+
+def test_identical_request_served_from_cache(monkeypatch):
+    destinations = make_destinations(60, seed=8)
+    snapshot = CatalogSnapshot(destinations, version=7)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(DestinationCatalog, '_snapshot', snapshot)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_PORTFOLIO', False)
+    TourResultCache.clear()
+    user = {'type': 'Family', 'preference': ['park'], 'budget': 500000, 'time_available': 8}
+
+    first = TourRecommendationService.get_tour_recommendations(None, user, use_cf=False)
+    hits = TourResultCache.stats()['hits']
+    monkeypatch.setattr(
+        DestinationCatalog, 'get_snapshot',
+        classmethod(lambda cls, db: pytest.fail('cache hit must not touch the catalog'))
+    )
+    second = TourRecommendationService.get_tour_recommendations(None, dict(user), use_cf=False)
+
+    assert first['success'] and not first['recommendation_metadata']['cache_hit']
+    assert second['recommendation_metadata']['cache_hit']
+    assert second['route'] == first['route']
+    assert TourResultCache.stats()['hits'] == hits + 1
+    TourResultCache.clear()
+
+
+def test_deadline_counts_down():
+    deadline = Deadline(80)
+    assert 0 < deadline.remaining_ms() <= 80 and not deadline.expired()
+    time.sleep(0.1)
+    assert deadline.remaining_ms() == 0 and deadline.expired() and deadline.elapsed_ms() >= 80
+
+
+@pytest.mark.parametrize("portfolio", [False, True])
+def test_tiny_latency_budget_returns_heuristic_without_solver(monkeypatch, capsys, portfolio):
+    """Budget không đủ TOUR_MIN_SOLVER_TIME_MS => bỏ qua OR-Tools / Held-Karp, trả lộ trình heuristic"""
+    destinations = make_destinations(60, seed=9)
+    snapshot = CatalogSnapshot(destinations, version=9)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_PORTFOLIO', portfolio)
+    monkeypatch.setattr(settings, 'TOUR_EXACT_SOLVER_MAX_NODES', 0)
+    for target in (RouteOptimizer, ExactRouteSolver):
+        monkeypatch.setattr(target, 'optimize', lambda self, *args, **kwargs: pytest.fail('solver must be skipped'))
+    monkeypatch.setattr(SolverPool, 'submit', classmethod(lambda cls, *args, **kwargs: pytest.fail('no pool task')))
+    user = {'type': 'Family', 'preference': ['park'], 'budget': 500000, 'time_available': 8}
+
+    result = TourRecommendationService.get_tour_recommendations(None, user, use_cf=False, latency_budget_ms=1)
+
+    assert result['success'] and result['route']
+    assert result['optimizer_used'] in ('heuristic', 'heuristic_local_search')
+    if not portfolio:
+        assert 'Latency budget exhausted' in capsys.readouterr().out
+        assert result['note']
+
+
+def test_portfolio_async_runs_heuristics_off_event_loop(monkeypatch):
+    """solve_async chạy Held-Karp + local search trong threadpool, không chặn event loop"""
+    destinations = make_destinations(8, seed=4)
+    for i, dest in enumerate(destinations):
+        dest.update(score=round(0.3 + (i % 5) * 0.1, 3), opening_hours=None)
+    user = {'budget': 10**9, 'time_available': 24, 'max_locations': 8}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009}
+    matrices = DistanceCalculator.build_route_matrices(start, destinations)
+    monkeypatch.setattr(settings, 'TOUR_EXACT_SOLVER_MAX_NODES', 10)  # Held-Karp => không có task trong pool
+    heuristic_threads = []
+    run_heuristics = RouteSolverPortfolio._run_heuristics
+
+    def tracked(*args):
+        heuristic_threads.append(threading.get_ident())
+        return run_heuristics(*args)
+
+    monkeypatch.setattr(RouteSolverPortfolio, '_run_heuristics', staticmethod(tracked))
+
+    async def solve():
+        result = await RouteSolverPortfolio.solve_async(destinations, user, start, matrices, Deadline(2000))
+        return threading.get_ident(), result
+
+    loop_thread, result = asyncio.run(solve())
+
+    assert result['success'] and result['optimizer_used'] == 'held_karp'
+    assert heuristic_threads and heuristic_threads[0] != loop_thread
+
+
+def test_portfolio_strategy_started_after_deadline_returns_at_once(monkeypatch):
+    """Chiến lược OR-Tools bắt đầu khi deadline đã hết không dựng model, trả slot ngay"""
+    destinations = make_destinations(12, seed=4)
+    for dest in destinations:
+        dest['score'] = 0.5
+    user = {'budget': 10**9, 'time_available': 24, 'max_locations': 12}
+    start = {'id': 0, 'latitude': 10.7769, 'longitude': 106.7009}
+    matrices = DistanceCalculator.build_route_matrices(start, destinations)
+    monkeypatch.setattr(RouteOptimizer, 'optimize', lambda self, *args, **kwargs: pytest.fail('solver must be skipped'))
+
+    result = RouteSolverPortfolio.run_ortools_strategy(
+        'ortools_gls', destinations, user, start, matrices, Deadline(settings.TOUR_FALLBACK_RESERVE_MS)
+    )
+
+    assert result['success'] is False
+
+
+def test_degraded_result_is_not_cached(monkeypatch):
+    """Lộ trình fallback vì hết budget không được cache => request sau với budget đủ được giải đầy đủ"""
+    destinations = make_destinations(60, seed=10)
+    snapshot = CatalogSnapshot(destinations, version=10)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(DestinationCatalog, '_snapshot', snapshot)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_PORTFOLIO', False)
+    monkeypatch.setattr(settings, 'TOUR_EXACT_SOLVER_MAX_NODES', 0)
+    TourResultCache.clear()
+    user = {'type': 'Family', 'preference': ['park'], 'budget': 500000, 'time_available': 8}
+
+    rushed = TourRecommendationService.get_tour_recommendations(None, user, use_cf=False, latency_budget_ms=1)
+    assert rushed['success'] and rushed['degraded'] == TourRecommendationService.DEGRADED_BUDGET
+    assert TourResultCache.stats()['size'] == 0
+
+    full = TourRecommendationService.get_tour_recommendations(None, dict(user), use_cf=False, latency_budget_ms=800)
+    assert full['success'] and not full['recommendation_metadata']['cache_hit']
+    assert full['optimizer_used'] == 'ortools' and 'degraded' not in full
+    assert TourResultCache.stats()['size'] == 1
+    TourResultCache.clear()
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flight = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'value': 42}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', compute))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while flight.shared < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(shared for shared, _ in results) == [False, True, True, True, True]
+    assert all(result == {'value': 42} for _, result in results)
+    assert flight.in_flight() == 0
+
+    # Exception của lời gọi chính được trả cho mọi lời gọi cùng key
+    with pytest.raises(ValueError):
+        flight.do('k', lambda: (_ for _ in ()).throw(ValueError('boom')))
+    assert flight.do('k', lambda: 1) == (False, 1)
+
+
+def test_async_single_flight_coalesces_and_recovers_from_cancel():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do('k', compute) for _ in range(5)))
+        assert len(calls) == 1
+        assert [shared for shared, _ in results].count(False) == 1
+        assert {result for _, result in results} == {1}
+
+        # Lời gọi chính bị hủy => lời gọi đang chờ tự chạy lại
+        leader = asyncio.ensure_future(flight.do('x', compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do('x', compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == (False, 3)
+
+    asyncio.run(scenario())
+    assert flight.in_flight() == 0
+
+
+def test_concurrent_identical_requests_share_one_solve(monkeypatch):
+    destinations = make_destinations(60, seed=8)
+    snapshot = CatalogSnapshot(destinations, version=9)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(DestinationCatalog, '_snapshot', snapshot)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_PORTFOLIO', False)
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)  # Gộp request cả khi tắt cache
+    prepare = TourRecommendationService.prepare_tour_request
+    calls = []
+
+    def slow_prepare(*args, **kwargs):
+        calls.append(1)
+        time.sleep(0.2)
+        return prepare(*args, **kwargs)
+
+    monkeypatch.setattr(TourRecommendationService, 'prepare_tour_request', staticmethod(slow_prepare))
+    user = {'type': 'Family', 'preference': ['park'], 'budget': 500000, 'time_available': 8}
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            TourRecommendationService.get_tour_recommendations(None, dict(user), use_cf=False)
+        ))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(calls) == 1
+    assert len(results) == 4 and all(r['route'] == results[0]['route'] for r in results)
+    assert sum(bool(r['recommendation_metadata'].get('coalesced')) for r in results) == 3
+
+
+def test_score_matrix_matches_per_profile_scores(destinations):
+    """Một lần tính cho nhiều profile giống hệt tính từng profile"""
+    features = DestinationFeatureStore(destinations)
+    users = [
+        {'type': 'Cultural', 'preference': ['culture', 'history', 'museum'], 'budget': 500000, 'time_available': 8},
+        {'type': 'Adventure', 'preference': ['Nature', 'hiking'], 'budget': 100000, 'time_available': 2},
+        {'type': 'Family', 'preference': [], 'budget': 0, 'time_available': 4},
+        {'type': 'Budget', 'preference': ['unknown-tag'], 'budget': 1000000, 'time_available': 0},
+    ]
+
+    matrix = ScoringEngine.calculate_scores_matrix(users, features)
+
+    assert matrix.shape == (len(users), len(destinations))
+    for row, user in zip(matrix, users):
+        assert row.tolist() == ScoringEngine.calculate_scores_batch(user, features).tolist()
+
+
+def test_shared_matrices_slice_matches_route_matrices():
+    """Ma trận cắt từ ma trận chung của batch khớp với ma trận build riêng từng lộ trình"""
+    destinations = make_destinations(30, seed=11)
+    starts = [
+        {'id': 0, 'latitude': 10.78, 'longitude': 106.69},
+        {'id': 0, 'latitude': 10.70, 'longitude': 106.75},
+    ]
+    shared = DistanceCalculator.build_shared_matrices(starts, destinations)
+
+    for start_index, route_positions in ((0, [4, 17, 2]), (1, [29, 0, 8, 13, 21])):
+        route = [destinations[i] for i in route_positions]
+        distance, travel_time = DistanceCalculator.slice_route_matrices(
+            shared, start_index, [len(starts) + i for i in route_positions]
+        )
+        expected_distance, expected_time = DistanceCalculator.build_route_matrices(starts[start_index], route)
+
+        assert distance == pytest.approx(expected_distance, abs=1e-9)
+        assert (travel_time == expected_time).all()
+
+
+def test_batch_recommendations_keep_order_and_report_errors(monkeypatch):
+    """Batch trả kết quả theo thứ tự request, lỗi từng item không ảnh hưởng item khác"""
+    destinations = make_destinations(80, seed=12)
+    snapshot = CatalogSnapshot(destinations, version=12)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(DestinationCatalog, '_snapshot', snapshot)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_PORTFOLIO', False)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_WORKERS', 2)
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    items = [
+        {'user_profile': {'type': 'Cultural', 'preference': ['culture', 'museum'], 'budget': 500000,
+                          'time_available': 8, 'max_locations': 4}},
+        {'user_profile': {'type': 'Family', 'preference': ['park'], 'budget': 500000, 'time_available': 0}},
+        {'user_profile': {'type': 'Adventure', 'preference': ['nature', 'hiking'], 'budget': 2000000,
+                          'time_available': 10, 'max_locations': 5},
+         'start_location': {'id': 0, 'latitude': 10.70, 'longitude': 106.75}, 'start_time': '09:30'},
+        {'user_profile': {'type': 'Family', 'preference': ['park'], 'budget': 500000, 'time_available': 8},
+         'start_time': '99:99'},
+        {'user_profile': {'type': 'Cultural', 'preference': ['museum', 'culture'], 'budget': 500000,
+                          'time_available': 8, 'max_locations': 4}},
+    ]
+
+    try:
+        batch = asyncio.run(TourRecommendationService.get_batch_tour_recommendations_async(None, items))
+    finally:
+        SolverPool.shutdown()
+
+    assert batch['success'] and batch['total'] == 5
+    assert [entry['index'] for entry in batch['results']] == list(range(5))
+    assert [entry['success'] for entry in batch['results']] == [True, False, True, False, True]
+    assert batch['succeeded'] == 3 and batch['failed'] == 2
+    assert batch['results'][1]['error'].startswith('Không thể tạo tour')
+    assert 'Giờ bắt đầu tour không hợp lệ' in batch['results'][3]['error']
+    assert batch['results'][4]['result']['recommendation_metadata']['coalesced']
+
+    for index in (0, 2):
+        item = items[index]
+        single = TourRecommendationService.get_tour_recommendations(
+            None, item['user_profile'], item.get('start_location'), use_cf=False,
+            start_time=item.get('start_time')
+        )
+        result = batch['results'][index]['result']
+        assert [d['id'] for d in result['route']] == [d['id'] for d in single['route']]
+        assert result['total_distance'] == single['total_distance']
+
+
+def test_batch_items_after_batch_deadline_fall_back_to_greedy(monkeypatch):
+    """Hết TOUR_BATCH_LATENCY_BUDGET_MS thì item chưa tối ưu nhận lộ trình greedy"""
+    snapshot = CatalogSnapshot(make_destinations(80, seed=12), version=13)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(DestinationCatalog, '_snapshot', snapshot)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_WORKERS', 1)
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    monkeypatch.setattr(settings, 'TOUR_BATCH_LATENCY_BUDGET_MS', 0)
+    items = [
+        {'user_profile': {'type': 'Cultural', 'preference': ['culture'], 'budget': 500000,
+                          'time_available': 8, 'max_locations': 4 + i},
+         'latency_budget_ms': 30000}
+        for i in range(3)
+    ]
+
+    try:
+        batch = asyncio.run(TourRecommendationService.get_batch_tour_recommendations_async(None, items))
+    finally:
+        SolverPool.shutdown()
+
+    assert batch['succeeded'] == 3
+    assert batch['elapsed_ms'] < 5000
+    for entry in batch['results']:
+        assert entry['result']['optimizer_used'] == 'heuristic'
+        assert entry['result']['degraded'] == TourRecommendationService.DEGRADED_BUDGET
+
+    item_deadline = Deadline(30000).cap(Deadline(0))
+    assert item_deadline.expired() and item_deadline.budget_ms == 30000
+
+
+def test_alternative_tours_are_distinct_and_keep_true_scores(monkeypatch):
+    """Các phương án tính song song từ một lần chuẩn bị, khác nhau, điểm không bị phạt"""
+    snapshot = CatalogSnapshot(make_destinations(120, seed=5), version=3)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_WORKERS', 2)
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    user = {'type': 'Cultural', 'preference': ['culture', 'museum'], 'budget': 800000,
+            'time_available': 8, 'max_locations': 4}
+
+    try:
+        result = asyncio.run(TourRecommendationService.get_tour_recommendations_async(
+            None, user, use_cf=False, num_alternatives=3
+        ))
+    finally:
+        SolverPool.shutdown()
+
+    prepared = TourRecommendationService.prepare_tour_request(
+        None, dict(user, num_alternatives=3), use_cf=False
+    )
+    scores = {dest['id']: dest['score'] for dest in prepared['destinations']}
+    tours = [result] + result['alternatives']
+    assert result['success'] and len(result['alternatives']) == 2
+    assert len({tuple(d['id'] for d in tour['route']) for tour in tours}) == 3
+    for tour in tours:
+        assert all(d['score'] == scores[d['id']] for d in tour['route'])
+        assert tour['total_score'] == round(sum(d['score'] for d in tour['route']), 3)
+        assert tour['total_locations'] <= 4 and tour['total_cost'] <= 800000
+    primary = {d['id'] for d in result['route']}
+    assert all(len(primary & {d['id'] for d in tour['route']}) < len(primary) for tour in tours[1:])
+
+
+def test_replan_repairs_remaining_route_without_full_solve(monkeypatch):
+    """Re-plan: bỏ qua / trễ giờ / thêm địa điểm được sửa trên lộ trình còn lại"""
+    destinations = make_destinations(40, seed=3)
+    for dest in destinations:
+        dest.update(opening_hours=None, visit_time=30, price=100000)
+    snapshot = CatalogSnapshot(destinations, version=3)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(SolverPool, 'submit', classmethod(lambda cls, *args: pytest.fail('no full solve')))
+    user = {'type': 'Family', 'preference': ['park'], 'budget': 2000000, 'time_available': 10,
+            'max_locations': 6}
+    ids = [2, 3, 4, 5, 6]
+    current = {'latitude': destinations[0]['latitude'], 'longitude': destinations[0]['longitude']}
+    visited = [1]
+
+    def replan(**kwargs):
+        args = dict(elapsed_minutes=60, visited_ids=visited, remaining_ids=ids)
+        args.update(kwargs)
+        return asyncio.run(TourRecommendationService.replan_tour_async(None, user, current, **args))
+
+    skipped = replan(remaining_ids=ids[:1] + ids[2:])
+    late = replan(elapsed_minutes=10 * 60 - 200)
+    added = replan(remaining_ids=ids[:3], added_ids=[ids[4]])
+
+    for result in (skipped, late, added):
+        assert result['success'] and result['replan']['strategy'] == 'repair'
+        assert result['total_time'] <= result['replan']['time_left']
+        assert result['total_cost'] <= result['replan']['budget_left']
+        assert visited[0] not in [d['id'] for d in result['route']]
+    assert ids[1] not in [d['id'] for d in skipped['route']]
+    assert late['total_locations'] < 5 and late['replan']['dropped_ids']
+    assert late['replan']['current_time'] == OpeningHours.format_clock(8 * 60 + 10 * 60 - 200)
+    assert ids[4] in [d['id'] for d in added['route']]
+    assert replan(elapsed_minutes=10 * 60)['success'] is False
+
+    multi_day = asyncio.run(TourRecommendationService.replan_tour_async(
+        None, dict(user, num_days=2), current, elapsed_minutes=60, visited_ids=visited, remaining_ids=ids
+    ))
+    assert multi_day['success'] is False and 'một ngày' in multi_day['message']
+
+
+def test_stream_sends_greedy_route_then_improvements(monkeypatch):
+    """Streaming: lộ trình greedy trước, các lời giải OR-Tools tốt dần, kết quả cuối sau cùng"""
+    destinations = make_destinations(80, seed=13)
+    for dest in destinations:
+        dest['opening_hours'] = None
+    snapshot = CatalogSnapshot(destinations, version=13)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(DestinationCatalog, '_snapshot', snapshot)
+    monkeypatch.setenv('TOUR_EXACT_SOLVER_MAX_NODES', '0')  # Luôn dùng OR-Tools (cả trong process con)
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_WORKERS', 1)
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    user = {'type': 'Adventure', 'preference': ['nature', 'view'], 'budget': 5000000,
+            'time_available': 24, 'max_locations': 6}
+
+    async def collect():
+        return [
+            event async for event in TourRecommendationService.stream_tour_recommendations(
+                None, user, use_cf=False, latency_budget_ms=3000
+            )
+        ]
+
+    try:
+        SolverPool.warm_up()  # Thời gian khởi động process không tính vào latency budget
+        events = asyncio.run(collect())
+    finally:
+        SolverPool.shutdown()
+        SolverPool.shutdown_manager()
+
+    names = [name for name, _ in events]
+    assert names[0] == 'initial' and names[-1] == 'final'
+    assert set(names[1:-1]) == {'improved'}
+    initial, last_improved, final = events[0][1], events[-2][1], events[-1][1]
+    assert initial['optimizer_used'] == 'heuristic'
+    assert final['optimizer_used'] == 'ortools'
+    assert [d['id'] for d in final['route']] == [d['id'] for d in last_improved['route']]
+    assert {d['id'] for d in final['route']} == {d['id'] for d in initial['route']}
+
+
+def test_concurrent_streams_share_one_progress_reader(monkeypatch):
+    """Các stream đồng thời dùng chung một thread đọc, mỗi stream chỉ nhận lời giải của mình"""
+    destinations = make_destinations(80, seed=14)
+    for dest in destinations:
+        dest['opening_hours'] = None
+    snapshot = CatalogSnapshot(destinations, version=14)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(DestinationCatalog, '_snapshot', snapshot)
+    monkeypatch.setenv('TOUR_EXACT_SOLVER_MAX_NODES', '0')
+    monkeypatch.setattr(settings, 'TOUR_SOLVER_WORKERS', 2)
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    users = [
+        {'type': 'Adventure', 'preference': ['nature', 'view'], 'budget': 5000000,
+         'time_available': 24, 'max_locations': 6},
+        {'type': 'Cultural', 'preference': ['culture', 'museum'], 'budget': 5000000,
+         'time_available': 24, 'max_locations': 7},
+    ]
+
+    async def collect(user):
+        return [
+            event async for event in TourRecommendationService.stream_tour_recommendations(
+                None, user, use_cf=False, latency_budget_ms=2000
+            )
+        ]
+
+    async def collect_all():
+        return await asyncio.gather(*(collect(user) for user in users))
+
+    try:
+        SolverPool.warm_up()
+        reader = SolverPool._progress_reader
+        streams = asyncio.run(collect_all())
+        assert SolverPool._progress_reader is reader and reader.is_alive()
+        assert SolverPool._channels == {}
+    finally:
+        SolverPool.shutdown()
+        SolverPool.shutdown_manager()
+
+    assert not reader.is_alive()
+    chosen = []
+    for events in streams:
+        assert events[0][0] == 'initial' and events[-1][0] == 'final'
+        ids = {d['id'] for d in events[0][1]['route']}
+        for name, result in events[1:]:
+            assert name in ('improved', 'final') and {d['id'] for d in result['route']} == ids
+        chosen.append(ids)
+    assert chosen[0] != chosen[1]
+
+
+class NoQuerySession:
+    """Session giả: mọi query đều lỗi (CF lúc request chỉ được tra cứu model)"""
+
+    def query(self, *args, **kwargs):
+        raise AssertionError('request-time CF must not query the database')
+
+
+def make_cf_model(version: int) -> CFModel:
+    rng = np.random.default_rng(version)
+    matrix = csr_matrix(np.where(rng.random((30, 20)) < 0.4, rng.integers(1, 6, (30, 20)), 0), dtype=np.float32)
+    service = CollaborativeFilteringService(NoQuerySession())
+    return CFModel(
+        matrix, list(range(100, 130)), list(range(1, 21)),
+        *service.build_neighbors(matrix),
+        {100: (12, 3, 1)}, {d: 4.0 for d in range(1, 21)},
+        version, {'ratings': (0, 0), 'visits': (0, 0), 'favorites': (0, 0)}, None
+    )
+
+
+class RowsSession:
+    """Session giả trả lần lượt ratings, visits, favorites cho build_interaction_matrix"""
+
+    class Query:
+        def __init__(self, rows):
+            self.rows = rows
+
+        def filter(self, *args):
+            return self
+
+        def group_by(self, *args):
+            return self
+
+        def all(self):
+            return self.rows
+
+    def __init__(self, *tables):
+        self.tables = list(tables)
+
+    def query(self, *args):
+        return self.Query(self.tables.pop(0))
+
+
+def test_interaction_matrix_is_sparse_and_matches_dense_predictions():
+    """Ma trận tương tác dựng thẳng dạng CSR float32; rating > visit > favorite; dự đoán khớp bản dense"""
+    rng = random.Random(25)
+    ratings = [(rng.randint(1, 60), rng.randint(1, 30), rng.randint(1, 5)) for _ in range(400)]
+    visits = list({(u, d): (u, d, rng.randint(1, 4)) for u, d in
+                   ((rng.randint(1, 60), rng.randint(1, 30)) for _ in range(200))}.values())
+    favorites = [(rng.randint(1, 70), rng.randint(1, 35)) for _ in range(150)]
+
+    service = CollaborativeFilteringService(RowsSession(ratings, visits, favorites))
+    matrix, user_ids, dest_ids = service.build_interaction_matrix()
+    assert isinstance(matrix, csr_matrix) and matrix.dtype == np.float32
+
+    expected = {}
+    for u, d, count in visits:
+        expected[(u, d)] = min(3.0 + (count - 1) * 0.5, 5.0)
+    for u, d in favorites:
+        expected.setdefault((u, d), 4.5)
+    expected.update({(u, d): float(r) for u, d, r in ratings})
+    assert user_ids == sorted({u for u, _ in expected}) and dest_ids == sorted({d for _, d in expected})
+    assert matrix.nnz == len(expected)
+    dense = np.zeros(matrix.shape)
+    for (u, d), value in expected.items():
+        dense[user_ids.index(u), dest_ids.index(d)] = value
+    assert np.allclose(matrix.toarray(), dense)
+
+    # Dự đoán từ danh sách top-k láng giềng == kNN trên ma trận similarity dense
+    service = CollaborativeFilteringService(NoQuerySession())
+    user_neighbors, item_neighbors = service.build_neighbors(matrix)
+    assert np.diff(user_neighbors.indptr).max() <= service.NEIGHBORS_K
+    assert np.diff(item_neighbors.indptr).max() <= service.NEIGHBORS_K
+    user_similarity = cosine_similarity(dense)
+    item_similarity = cosine_similarity(dense.T)
+    np.fill_diagonal(user_similarity, 0)
+    np.fill_diagonal(item_similarity, 0)
+
+    def dense_knn(similarities, ratings, k=20):
+        top = np.argsort(similarities)[-k:]
+        rated = ratings[top] > 0
+        weight = np.abs(similarities[top][rated]).sum()
+        return None if weight == 0 else float(np.clip(similarities[top][rated] @ ratings[top][rated] / weight, 1, 5))
+
+    for u in user_ids[::5]:
+        row = user_ids.index(u)
+        for col, d in enumerate(dest_ids):
+            for predict, expected in (
+                ('predict_user_based', dense_knn(user_similarity[row], dense[:, col])),
+                ('predict_item_based', dense_knn(item_similarity[col], dense[row])),
+            ):
+                if dense[row, col] > 0:
+                    expected = dense[row, col]
+                actual = getattr(service, predict)(u, d, matrix, user_ids, dest_ids)
+                assert (actual is None and expected is None) or actual == pytest.approx(expected, rel=1e-4)
+
+    empty, no_users, _ = CollaborativeFilteringService(RowsSession([], [], [])).build_interaction_matrix()
+    assert empty.nnz == 0 and no_users == []
+
+
+def test_hybrid_ranking_uses_shared_cf_model_and_refreshes_on_changes(monkeypatch, destinations):
+    """Hybrid scoring dùng model CF của worker (không query DB); làm mới theo số thay đổi / tuổi model"""
+    model = make_cf_model(version=3)
+    monkeypatch.setattr(CFModelStore, '_model', model)
+    user = {'type': 'Cultural', 'preference': ['culture', 'museum'], 'budget': 500000, 'time_available': 8}
+    monkeypatch.setattr(CollaborativeFilteringService, 'build_neighbors',
+                        lambda self, matrix, k=None: pytest.fail('request-time CF must not compute similarities'))
+
+    ranked = ScoringEngine.rank_destinations_hybrid(
+        user, destinations[:40], NoQuerySession(), user_id=100, use_cf=True
+    )
+    hybrid = [meta for _, _, meta in ranked if meta['scoring_method'] == 'hybrid']
+    assert len(hybrid) == 40 and all(meta['cf_model_version'] == 3 for meta in hybrid)
+    assert not any('cf_error' in meta for _, _, meta in ranked)
+    assert CollaborativeFilteringService(NoQuerySession(), model=model).get_user_activity_level(100)['activity_level'] == 'hot'
+
+    rebuilt = []
+    monkeypatch.setattr(CFModelStore, 'reload', classmethod(lambda cls, db, only_if_missing=False: rebuilt.append(db)))
+    monkeypatch.setattr(settings, 'CF_MODEL_REFRESH_SECONDS', 3600)
+    monkeypatch.setattr(settings, 'CF_MODEL_REFRESH_MIN_CHANGES', 10)
+    changes = iter([9, 10])
+    monkeypatch.setattr(CFModelStore, 'count_changes', classmethod(lambda cls, db, m: next(changes)))
+    assert not CFModelStore.refresh_if_needed('db') and not rebuilt
+    assert CFModelStore.refresh_if_needed('db') and len(rebuilt) == 1
+
+    monkeypatch.setattr(settings, 'CF_MODEL_REFRESH_SECONDS', 1)
+    model.loaded_at -= 2
+    assert CFModelStore.refresh_if_needed('db') and len(rebuilt) == 2
+
+
+@pytest.mark.parametrize("use_sqlite", [False, True])
+def test_tour_job_runs_in_background_and_keeps_result(monkeypatch, tmp_path, use_sqlite):
+    """Job chạy nền: queued/running => succeeded, kết quả đọc lại được; xóa job đã xong"""
+    destinations = make_destinations(60, seed=14)
+    snapshot = CatalogSnapshot(destinations, version=14)
+    monkeypatch.setattr(DestinationCatalog, 'get_snapshot', classmethod(lambda cls, db: snapshot))
+    monkeypatch.setattr(settings, 'TOUR_CACHE_SIZE', 0)
+    monkeypatch.setattr(settings, 'TOUR_JOB_DB_PATH', str(tmp_path / 'jobs.db') if use_sqlite else None)
+    monkeypatch.setattr(settings, 'TOUR_JOB_WORKERS', 1)
+    user = {'type': 'Family', 'preference': ['park'], 'budget': 500000, 'time_available': 8}
+
+    try:
+        job = TourJobManager.submit({'user_profile': user, 'use_cf': False}, session_factory=lambda: None)
+        failed = TourJobManager.submit({'user_profile': dict(user, time_available=0), 'use_cf': False},
+                                       session_factory=lambda: None)
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline and any(
+            TourJobStore.get(j['job_id'])['status'] in TourJobStore.ACTIVE_STATUSES for j in (job, failed)
+        ):
+            time.sleep(0.1)
+    finally:
+        TourJobManager.shutdown()
+
+    done = TourJobStore.get(job['job_id'])
+    assert done['status'] == TourJobStore.SUCCEEDED
+    assert done['result']['success'] and done['result']['route']
+    assert done['expires_at'] >= done['finished_at'] + settings.TOUR_JOB_TTL_SECONDS - 1
+    assert TourJobStore.get(failed['job_id'])['status'] == TourJobStore.FAILED
+
+    assert TourJobManager.cancel(job['job_id'])['status'] == TourJobStore.SUCCEEDED
+    assert TourJobStore.get(job['job_id']) is None
+    TourJobStore.clear()
+
+
+@pytest.mark.parametrize("use_sqlite", [False, True])
+def test_orphaned_and_dropped_jobs_are_finalized(monkeypatch, tmp_path, use_sqlite):
+    """Job của worker đã chết (heartbeat cũ) => failed; job đang chờ khi shutdown => cancelled; clear xóa cả SQLite"""
+    monkeypatch.setattr(settings, 'TOUR_JOB_DB_PATH', str(tmp_path / 'jobs.db') if use_sqlite else None)
+    monkeypatch.setattr(settings, 'TOUR_JOB_WORKERS', 1)
+    now = time.time()
+    for job_id, status, heartbeat_at in (('orphan-queued', 'queued', None), ('orphan-running', 'running', now - 3600),
+                                         ('alive', 'running', now)):
+        TourJobStore.save({
+            'job_id': job_id, 'status': status, 'owner': 'dead-worker:1', 'created_at': now - 3600,
+            'heartbeat_at': heartbeat_at, 'started_at': None, 'finished_at': None, 'expires_at': None,
+            'cancel_requested': False, 'result': None, 'error': None,
+        })
+
+    assert TourJobStore.count_active() == 1
+    for job_id in ('orphan-queued', 'orphan-running'):
+        job = TourJobStore.get(job_id)
+        assert job['status'] == TourJobStore.FAILED and job['error'] == TourJobStore.STALE_ERROR
+        assert job['expires_at'] >= now + settings.TOUR_JOB_TTL_SECONDS - 1
+    assert TourJobStore.get('alive')['status'] == TourJobStore.RUNNING
+
+    # Thread duy nhất bị giữ => các job sau nằm trong hàng đợi khi worker tắt
+    release = threading.Event()
+    monkeypatch.setattr(TourJobManager, '_run', classmethod(lambda cls, job_id, params, factory: release.wait(10)))
+    try:
+        jobs = [TourJobManager.submit({'user_profile': {}}, session_factory=lambda: None) for _ in range(3)]
+        TourJobManager.shutdown()
+    finally:
+        release.set()
+    for job in jobs:
+        done = TourJobStore.get(job['job_id'])
+        assert done['status'] == TourJobStore.CANCELLED and done['expires_at'] is not None
+
+    TourJobStore.clear()
+    assert TourJobStore.get('alive') is None and TourJobStore.count_active() == 0
+
+
+def test_solver_process_cancel_stops_running_task():
+    """Hủy job đang chạy dừng hẳn process giải (không chờ task xong)"""
+    process = SolverProcess()
+    try:
+        assert process.run(max, ((3, 7, 5),), should_cancel=lambda: False) == 7
+
+        started = time.monotonic()
+        with pytest.raises(TourJobCancelled):
+            process.run(time.sleep, (60,), should_cancel=lambda: time.monotonic() - started > 0.5)
+        assert time.monotonic() - started < 10
+        assert not process.is_alive()
+    finally:
+        process.terminate()
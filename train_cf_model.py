@@ -125,25 +125,22 @@ def train_cf_model(db: Session) -> bool:
         print(f"   ✅ User IDs: {user_ids}")
         print(f"   ✅ Destination IDs: {dest_ids}")
         
-        print("\n2️⃣ Computing user-user similarities...")
-        cf_service.compute_user_similarity()
-        print(f"   ✅ User similarity matrix: {cf_service.user_similarity.shape}")
+        print("\n2️⃣ Computing top-k neighbours (users & destinations)...")
+        user_neighbors, item_neighbors = cf_service.build_neighbors(matrix)
+        print(f"   ✅ User neighbours: {user_neighbors.nnz} links (k = {cf_service.NEIGHBORS_K})")
+        print(f"   ✅ Destination neighbours: {item_neighbors.nnz} links (k = {cf_service.NEIGHBORS_K})")
         
-        print("\n3️⃣ Computing item-item similarities...")
-        cf_service.compute_item_similarity()
-        print(f"   ✅ Item similarity matrix: {cf_service.item_similarity.shape}")
-        
-        print("\n4️⃣ Saving model to disk...")
+        print("\n3️⃣ Saving model to disk...")
         model_data = {
-            "user_item_matrix": matrix,
-            "user_similarity": cf_service.user_similarity,
-            "item_similarity": cf_service.item_similarity,
+            "user_item_matrix": matrix,  # CSR float32
+            "user_neighbors": user_neighbors,  # CSR: row = user, indices/data = neighbours/similarities
+            "item_neighbors": item_neighbors,
             "user_ids": user_ids,
             "dest_ids": dest_ids,
             "trained_at": datetime.now().isoformat(),
             "n_users": len(user_ids),
             "n_destinations": len(dest_ids),
-            "n_ratings": np.count_nonzero(matrix)
+            "n_ratings": matrix.nnz
         }
         
         model_path = Path(__file__).parent / "cf_model.pkl"